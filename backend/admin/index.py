@@ -1,13 +1,33 @@
 """API для админ-панели управления сайтом"""
 import json
 import os
-import psycopg2
 from psycopg2.extras import RealDictCursor
+from db import get_db_connection, release_db_connection
+from counters import bump_counters
+from stats import read_stats
+from presence import purge_expired, PRESENCE_TTL_MINUTES
+from session import authenticate
+from tracing import traced
+from response import json_response, row_encoder, iso
+import queries
+import rules
 
-def get_db_connection():
-    """Создание подключения к базе данных"""
-    return psycopg2.connect(os.environ['DATABASE_URL'])
+LEDGER_PARTITIONS_AHEAD = int(os.environ.get('LEDGER_PARTITIONS_AHEAD', '3'))
+LEDGER_RETENTION_MONTHS = int(os.environ.get('LEDGER_RETENTION_MONTHS', '12'))
+LEDGER_DROP_ARCHIVED = os.environ.get('LEDGER_DROP_ARCHIVED', '') == '1'
+# Часовые корзины заработка старше этого срока удаляются при обслуживании журнала
+EARNINGS_RETENTION_HOURS = int(os.environ.get('EARNINGS_RETENTION_HOURS', '48'))
 
+# Порядок ключей совпадает с колонками SELECT соответствующих запросов
+encode_online = row_encoder(
+    ('id', None), ('username', None), ('coins', None), ('isGuest', None), ('lastActive', iso),
+    ('earnedToday', None)
+)
+encode_transactions = row_encoder(
+    ('id', None), ('amount', None), ('type', None), ('description', None), ('createdAt', iso)
+)
+
+@traced
 def handler(event: dict, context) -> dict:
     """Обработчик админ API"""
     
@@ -18,11 +38,13 @@ def handler(event: dict, context) -> dict:
             'headers': {
                 'Access-Control-Allow-Origin': '*',
                 'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type'
+                'Access-Control-Allow-Headers': 'Content-Type, Authorization',
+                'Access-Control-Max-Age': '86400'
             },
             'body': ''
         }
     
+    conn = None
     try:
         method = event.get('httpMethod', 'GET')
         path = event.get('path', '/')
@@ -32,47 +54,37 @@ def handler(event: dict, context) -> dict:
         conn = get_db_connection()
         cur = conn.cursor(cursor_factory=RealDictCursor)
         
-        admin_id = query.get('adminId') or body.get('adminId')
+        # Проверка прав админа по флагу в подписанном токене
+        session = authenticate(event, cur)
         
-        # Проверка прав админа
-        if admin_id:
-            cur.execute("SELECT is_admin FROM users WHERE id = %s", (admin_id,))
-            admin = cur.fetchone()
-            
-            if not admin or not admin['is_admin']:
-                cur.close()
-                conn.close()
-                return {
-                    'statusCode': 403,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'error': 'Доступ запрещен'})
-                }
+        if not session or not session['admin']:
+            cur.close()
+            return {
+                'statusCode': 403,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': json.dumps({'error': 'Доступ запрещен'})
+            }
         
         # Получить список онлайн пользователей (активных за последние 5 минут)
         if path == '/online' and method == 'GET':
+            purge_expired(cur)
+            cur.close()
+            
+            cur = conn.cursor()
             cur.execute("""
-                SELECT id, username, coins, is_guest, last_active
-                FROM users
-                WHERE last_active > NOW() - INTERVAL '5 minutes'
-                ORDER BY last_active DESC
-            """)
+                SELECT u.id, u.username, u.coins, u.is_guest, p.last_seen, daily_earnings(u.id, %s)
+                FROM presence p
+                JOIN users u ON u.id = p.user_id
+                WHERE p.last_seen > NOW() - make_interval(mins => %s)
+                ORDER BY p.last_seen DESC
+            """, (rules.EARNINGS_WINDOW, PRESENCE_TTL_MINUTES))
             
             users = cur.fetchall()
+            conn.commit()
             
             cur.close()
-            conn.close()
             
-            return {
-                'statusCode': 200,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps([{
-                    'id': u['id'],
-                    'username': u['username'],
-                    'coins': u['coins'],
-                    'isGuest': u['is_guest'],
-                    'lastActive': u['last_active'].isoformat() if u['last_active'] else None
-                } for u in users])
-            }
+            return json_response(event, 200, encode_online(users))
         
         # Выдать монеты пользователю
         elif path == '/give-coins' and method == 'POST':
@@ -81,7 +93,6 @@ def handler(event: dict, context) -> dict:
             
             if not target_user_id or amount <= 0:
                 cur.close()
-                conn.close()
                 return {
                     'statusCode': 400,
                     'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
@@ -89,22 +100,39 @@ def handler(event: dict, context) -> dict:
                 }
             
             # Обновление баланса
-            cur.execute("UPDATE users SET coins = coins + %s WHERE id = %s", (amount, target_user_id))
+            cur.execute(
+                "UPDATE users SET coins = coins + %s WHERE id = %s RETURNING id, coins, username",
+                (amount, target_user_id)
+            )
+            user = cur.fetchone()
+            
+            if not user:
+                conn.rollback()
+                cur.close()
+                return {
+                    'statusCode': 404,
+                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'body': json.dumps({'error': 'User not found'})
+                }
             
             # Запись транзакции
             cur.execute(
                 "INSERT INTO coin_transactions (user_id, amount, transaction_type, description) VALUES (%s, %s, 'admin_gift', %s)",
-                (target_user_id, amount, f"Подарок от администратора")
+                (user['id'], amount, f"Подарок от администратора")
             )
+            bump_counters(cur, user['id'], coins_earned=amount)
             
-            conn.commit()
+            # Подарок двигает баланс и дневной заработок: задания на них проверяются сразу
+            queries.execute(cur, 'daily_earnings', ([user['id']], rules.EARNINGS_WINDOW))
+            earned = cur.fetchone()['earned']
+            completed_tasks = rules.evaluate(cur, {user['id']: {
+                'coins': (None, user['coins']),
+                'daily_earnings': (None, earned)
+            }}).get(user['id'], [])
             
-            # Получение нового баланса
-            cur.execute("SELECT coins, username FROM users WHERE id = %s", (target_user_id,))
-            user = cur.fetchone()
+            conn.commit()
             
             cur.close()
-            conn.close()
             
             return {
                 'statusCode': 200,
@@ -112,55 +140,32 @@ def handler(event: dict, context) -> dict:
                 'body': json.dumps({
                     'success': True,
                     'username': user['username'],
-                    'newCoins': user['coins'],
+                    'newCoins': user['coins'] + sum(t['reward'] for t in completed_tasks),
+                    'completedTasks': completed_tasks,
                     'message': f"Выдано {amount} монет пользователю {user['username']}"
                 })
             }
         
         # Получить статистику сайта
         elif path == '/stats' and method == 'GET':
-            # Общее количество пользователей
-            cur.execute("SELECT COUNT(*) as total FROM users")
-            total_users = cur.fetchone()['total']
-            
-            # Пользователей онлайн
-            cur.execute("SELECT COUNT(*) as online FROM users WHERE last_active > NOW() - INTERVAL '5 minutes'")
-            online_users = cur.fetchone()['online']
-            
-            # Всего отправлено сообщений
-            cur.execute("SELECT COUNT(*) as total FROM chat_messages")
-            total_messages = cur.fetchone()['total']
-            
-            # Всего куплено титулов
-            cur.execute("SELECT COUNT(*) as total FROM user_titles")
-            total_purchases = cur.fetchone()['total']
-            
-            # Топ-10 по монетам
-            cur.execute("""
-                SELECT id, username, coins, is_guest
-                FROM users
-                ORDER BY coins DESC
-                LIMIT 10
-            """)
-            top_users = cur.fetchall()
+            # Снимок статистики вместо полных пересчётов; exact=1 — точный пересчёт для сверки
+            exact = query.get('exact') in ('1', 'true')
+            stats = read_stats(cur, exact=exact)
+            conn.commit()
             
             cur.close()
-            conn.close()
             
             return {
                 'statusCode': 200,
                 'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
                 'body': json.dumps({
-                    'totalUsers': total_users,
-                    'onlineUsers': online_users,
-                    'totalMessages': total_messages,
-                    'totalPurchases': total_purchases,
-                    'topUsers': [{
-                        'id': u['id'],
-                        'username': u['username'],
-                        'coins': u['coins'],
-                        'isGuest': u['is_guest']
-                    } for u in top_users]
+                    'totalUsers': stats['total_users'],
+                    'onlineUsers': stats['online_users'],
+                    'totalMessages': stats['total_messages'],
+                    'totalPurchases': stats['total_purchases'],
+                    'topUsers': stats['top_users'],
+                    'refreshedAt': stats['refreshed_at'].isoformat(),
+                    'exact': exact
                 })
             }
         
@@ -170,13 +175,15 @@ def handler(event: dict, context) -> dict:
             
             if not target_user_id:
                 cur.close()
-                conn.close()
                 return {
                     'statusCode': 400,
                     'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
                     'body': json.dumps({'error': 'targetUserId required'})
                 }
             
+            cur.close()
+            
+            cur = conn.cursor()
             cur.execute("""
                 SELECT id, amount, transaction_type, description, created_at
                 FROM coin_transactions
@@ -188,23 +195,81 @@ def handler(event: dict, context) -> dict:
             transactions = cur.fetchall()
             
             cur.close()
-            conn.close()
+            
+            return json_response(event, 200, encode_transactions(transactions))
+        
+        # Помесячные сводки транзакций пользователя из архивированных секций
+        elif path == '/transactions-monthly' and method == 'GET':
+            target_user_id = query.get('targetUserId')
+            
+            if not target_user_id:
+                cur.close()
+                return {
+                    'statusCode': 400,
+                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'body': json.dumps({'error': 'targetUserId required'})
+                }
+            
+            cur.execute("""
+                SELECT month, transaction_type, total_amount, entries
+                FROM coin_transactions_monthly
+                WHERE user_id = %s
+                ORDER BY month DESC, transaction_type
+            """, (target_user_id,))
+            
+            summaries = cur.fetchall()
+            
+            cur.close()
             
             return {
                 'statusCode': 200,
                 'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
                 'body': json.dumps([{
-                    'id': t['id'],
-                    'amount': t['amount'],
-                    'type': t['transaction_type'],
-                    'description': t['description'],
-                    'createdAt': t['created_at'].isoformat() if t['created_at'] else None
-                } for t in transactions])
+                    'month': s['month'].isoformat(),
+                    'type': s['transaction_type'],
+                    'totalAmount': s['total_amount'],
+                    'entries': s['entries']
+                } for s in summaries])
+            }
+        
+        # Обслуживание журнала: секции наперёд и архивирование старых (для планировщика)
+        elif path == '/ledger-maintenance' and method == 'POST':
+            cur.execute("""
+                SELECT ensure_ledger_partition(
+                    (date_trunc('month', CURRENT_TIMESTAMP) + make_interval(months => m))::DATE
+                ) AS name
+                FROM generate_series(0, %s) m
+            """, (LEDGER_PARTITIONS_AHEAD,))
+            partitions = [r['name'] for r in cur.fetchall()]
+            
+            cur.execute(
+                "SELECT partition_name, archived_rows FROM archive_ledger_partitions(%s, %s)",
+                (LEDGER_RETENTION_MONTHS, LEDGER_DROP_ARCHIVED)
+            )
+            archived = cur.fetchall()
+            
+            cur.execute(
+                "DELETE FROM user_earnings_hourly WHERE hour < LOCALTIMESTAMP - make_interval(hours => %s)",
+                (EARNINGS_RETENTION_HOURS,)
+            )
+            purged_earnings = cur.rowcount
+            
+            conn.commit()
+            cur.close()
+            
+            return {
+                'statusCode': 200,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': json.dumps({
+                    'success': True,
+                    'partitions': partitions,
+                    'archived': [{'partition': a['partition_name'], 'rows': a['archived_rows']} for a in archived],
+                    'purgedEarningsBuckets': purged_earnings
+                })
             }
         
         else:
             cur.close()
-            conn.close()
             return {
                 'statusCode': 404,
                 'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
@@ -216,4 +281,8 @@ def handler(event: dict, context) -> dict:
             'statusCode': 500,
             'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
             'body': json.dumps({'error': str(e)})
-        }
\ No newline at end of file
+        }
+    
+    finally:
+        if conn is not None:
+            release_db_connection(conn)
@@ -0,0 +1,105 @@
+"""Подписанные HMAC токены сессии, проверяемые без обращения к БД"""
+import base64
+import hashlib
+import hmac
+import json
+import os
+import secrets
+import threading
+import time
+
+# Общий для всех функций секрет подписи: auth выпускает токены, остальные проверяют.
+# Без него функция не стартует, а не отвечает 500 на каждом запросе
+SESSION_SECRET = os.environ.get('SESSION_SECRET', '').encode()
+if not SESSION_SECRET:
+    raise RuntimeError('SESSION_SECRET is not set: add the token signing secret to the function environment')
+
+SESSION_TTL = int(os.environ.get('SESSION_TTL', str(24 * 3600)))
+# Как часто экземпляр перечитывает список отозванных токенов
+SESSION_REVOCATION_TTL = float(os.environ.get('SESSION_REVOCATION_TTL', '60'))
+
+_revoked = frozenset()
+_revoked_loaded_at = None
+_revoked_lock = threading.Lock()
+
+
+def _b64encode(raw: bytes) -> str:
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def _b64decode(data: str) -> bytes:
+    return base64.urlsafe_b64decode(data + '=' * (-len(data) % 4))
+
+
+def _sign(payload: str) -> str:
+    return _b64encode(hmac.new(SESSION_SECRET, payload.encode(), hashlib.sha256).digest())
+
+
+def issue_token(user_id: int, username: str, is_guest: bool, is_admin: bool) -> str:
+    """Выпуск токена с id, именем, флагами гостя и админа и сроком действия"""
+    claims = {
+        'uid': user_id,
+        'name': username,
+        'guest': bool(is_guest),
+        'admin': bool(is_admin),
+        'exp': int(time.time()) + SESSION_TTL,
+        'jti': secrets.token_urlsafe(9)
+    }
+    payload = _b64encode(json.dumps(claims, separators=(',', ':'), ensure_ascii=False).encode())
+    return f'{payload}.{_sign(payload)}'
+
+
+def verify_token(token: str):
+    """Утверждения токена или None, если подпись неверна или срок истёк"""
+    payload, _, signature = (token or '').partition('.')
+    if not payload or not signature:
+        return None
+    if not hmac.compare_digest(signature, _sign(payload)):
+        return None
+    try:
+        claims = json.loads(_b64decode(payload))
+    except ValueError:
+        return None
+    if claims.get('exp', 0) < time.time():
+        return None
+    return claims
+
+
+def _refresh_revocations(cur):
+    """Список отозванных токенов кэшируется на экземпляре на SESSION_REVOCATION_TTL секунд"""
+    global _revoked, _revoked_loaded_at
+    if _revoked_loaded_at is not None and time.monotonic() - _revoked_loaded_at < SESSION_REVOCATION_TTL:
+        return
+    with _revoked_lock:
+        if _revoked_loaded_at is not None and time.monotonic() - _revoked_loaded_at < SESSION_REVOCATION_TTL:
+            return
+        cur.execute("SELECT jti FROM session_revocations WHERE expires_at > NOW()")
+        _revoked = frozenset(r['jti'] for r in cur.fetchall())
+        _revoked_loaded_at = time.monotonic()
+
+
+def authenticate(event: dict, cur):
+    """Сессия из заголовка Authorization: Bearer <token> или None"""
+    headers = {k.lower(): v for k, v in (event.get('headers') or {}).items()}
+    auth = headers.get('authorization') or headers.get('x-authorization') or ''
+    scheme, _, token = auth.partition(' ')
+    if scheme.lower() != 'bearer':
+        return None
+    claims = verify_token(token.strip())
+    if claims is None:
+        return None
+    _refresh_revocations(cur)
+    if claims['jti'] in _revoked:
+        return None
+    return claims
+
+
+def revoke(cur, claims: dict):
+    """Отозвать токен до истечения его срока"""
+    global _revoked
+    cur.execute("""
+        INSERT INTO session_revocations (jti, user_id, expires_at)
+        VALUES (%s, %s, to_timestamp(%s))
+        ON CONFLICT (jti) DO NOTHING
+    """, (claims['jti'], claims['uid'], claims['exp']))
+    _revoked = _revoked | {claims['jti']}
@@ -0,0 +1,113 @@
+"""Снимок статистики сайта, обновляемый приращениями по новым строкам"""
+import os
+from presence import PRESENCE_TTL_MINUTES
+
+STATS_REFRESH_INTERVAL = int(os.environ.get('STATS_REFRESH_INTERVAL', '30'))
+# Строки видны с коммита, а id получают при вставке: строка медленной транзакции может
+# появиться ниже уже учтённой отметки. Отметка сдвигается только до строк старше этого
+# срока — их транзакции уже завершены; более свежие строки досчитываются при каждом чтении
+STATS_SETTLE_SECONDS = int(os.environ.get('STATS_SETTLE_SECONDS', '300'))
+
+# Новая отметка — наибольший id среди строк старше STATS_SETTLE_SECONDS; {base} — прежняя отметка
+_MARKS = """
+    WITH marks AS (
+        SELECT
+            COALESCE((SELECT MAX(id) FROM users WHERE id > {base}users_max_id
+                      AND created_at < LOCALTIMESTAMP - make_interval(secs => %(settle)s)), {base}users_max_id) AS users_max_id,
+            COALESCE((SELECT MAX(id) FROM chat_messages WHERE id > {base}messages_max_id
+                      AND created_at < LOCALTIMESTAMP - make_interval(secs => %(settle)s)), {base}messages_max_id) AS messages_max_id,
+            COALESCE((SELECT MAX(id) FROM user_titles WHERE id > {base}purchases_max_id
+                      AND purchased_at < LOCALTIMESTAMP - make_interval(secs => %(settle)s)), {base}purchases_max_id) AS purchases_max_id
+        FROM site_stats s WHERE s.id = 1
+    )
+"""
+
+# Таблицы только пополняются: к итогам прибавляются строки между прежней и новой отметкой
+_INCREMENTAL = _MARKS.format(base='s.') + """
+    UPDATE site_stats s SET
+        total_users = s.total_users + (SELECT COUNT(*) FROM users WHERE id > s.users_max_id AND id <= m.users_max_id),
+        users_max_id = m.users_max_id,
+        total_messages = s.total_messages + (SELECT COUNT(*) FROM chat_messages
+                                             WHERE id > s.messages_max_id AND id <= m.messages_max_id),
+        messages_max_id = m.messages_max_id,
+        total_purchases = s.total_purchases + (SELECT COUNT(*) FROM user_titles
+                                               WHERE id > s.purchases_max_id AND id <= m.purchases_max_id),
+        purchases_max_id = m.purchases_max_id,
+        {common}
+    FROM marks m
+    WHERE s.id = 1
+    RETURNING s.*, {live}
+"""
+
+_EXACT = _MARKS.format(base='0 * s.') + """
+    UPDATE site_stats s SET
+        total_users = (SELECT COUNT(*) FROM users WHERE id <= m.users_max_id),
+        users_max_id = m.users_max_id,
+        total_messages = (SELECT COUNT(*) FROM chat_messages WHERE id <= m.messages_max_id),
+        messages_max_id = m.messages_max_id,
+        total_purchases = (SELECT COUNT(*) FROM user_titles WHERE id <= m.purchases_max_id),
+        purchases_max_id = m.purchases_max_id,
+        {common}
+    FROM marks m
+    WHERE s.id = 1
+    RETURNING s.*, {live}
+"""
+
+# Строки выше отметки и непривязанные гостевые аккаунты пула с их стартовыми титулами
+_LIVE = """
+    (SELECT COUNT(*) FROM users WHERE id > s.users_max_id) AS fresh_users,
+    (SELECT COUNT(*) FROM chat_messages WHERE id > s.messages_max_id) AS fresh_messages,
+    (SELECT COUNT(*) FROM user_titles WHERE id > s.purchases_max_id) AS fresh_purchases,
+    (SELECT COUNT(*) FROM guest_pool) AS pool_depth,
+    (SELECT COUNT(*) FROM user_titles WHERE user_id IN (SELECT user_id FROM guest_pool)) AS pool_titles
+"""
+
+_COMMON = f"""
+        online_users = (
+            SELECT COUNT(*) FROM presence
+            WHERE last_seen > NOW() - make_interval(mins => {PRESENCE_TTL_MINUTES})
+        ),
+        top_users = (
+            SELECT COALESCE(json_agg(json_build_object(
+                'id', id, 'username', username, 'coins', coins, 'isGuest', is_guest
+            )), '[]'::JSON)
+            FROM (
+                SELECT id, username, coins, is_guest FROM users
+                WHERE id NOT IN (SELECT user_id FROM guest_pool)
+                ORDER BY coins DESC LIMIT 10
+            ) top
+        ),
+        refreshed_at = CURRENT_TIMESTAMP
+"""
+
+
+def read_stats(cur, exact: bool = False) -> dict:
+    """Снимок статистики; устаревший обновляется одним запросом, exact пересчитывает с нуля.
+
+    Итоги без гостевого пула: totalUsers, totalMessages, totalPurchases.
+    """
+    if exact:
+        cur.execute(_EXACT.format(common=_COMMON, live=_LIVE), {'settle': STATS_SETTLE_SECONDS})
+        return _totals(cur.fetchone())
+
+    # Обновляет только один запрос, остальные в это время читают прежний снимок
+    cur.execute("""
+        SELECT 1 FROM site_stats
+        WHERE id = 1 AND refreshed_at < NOW() - make_interval(secs => %s)
+        FOR UPDATE SKIP LOCKED
+    """, (STATS_REFRESH_INTERVAL,))
+    if cur.fetchone():
+        cur.execute(_INCREMENTAL.format(common=_COMMON, live=_LIVE), {'settle': STATS_SETTLE_SECONDS})
+    else:
+        cur.execute(f"SELECT s.*, {_LIVE} FROM site_stats s WHERE s.id = 1")
+    return _totals(cur.fetchone())
+
+
+def _totals(row) -> dict:
+    """Итоги снимка со свежими строками и без аккаунтов гостевого пула"""
+    return {
+        **row,
+        'total_users': row['total_users'] + row['fresh_users'] - row['pool_depth'],
+        'total_messages': row['total_messages'] + row['fresh_messages'],
+        'total_purchases': row['total_purchases'] + row['fresh_purchases'] - row['pool_titles']
+    }
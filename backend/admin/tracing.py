@@ -0,0 +1,151 @@
+"""Трассировка запросов к БД в рамках вызова функции: Server-Timing и JSON-лог"""
+import functools
+import json
+import os
+import re
+import threading
+import time
+from psycopg2 import extensions
+
+# Запросы дольше порога попадают в лог с нормализованным SQL
+SLOW_QUERY_MS = float(os.environ.get('SLOW_QUERY_MS', '200'))
+REQUEST_LOG = os.environ.get('REQUEST_LOG', '1') == '1'
+
+_local = threading.local()
+
+_STRINGS = re.compile(r"'(?:[^']|'')*'")
+_NUMBERS = re.compile(r'\b\d+(?:\.\d+)?\b')
+# Кортеж из плейсхолдеров; пробелы и запятые однозначны, поэтому выражение не откатывается экспоненциально
+_TUPLE = r'\(\s*\?(?:::\w+)?(?:\s*,\s*\?(?:::\w+)?)*\s*\)'
+_VALUE_LISTS = re.compile(rf'{_TUPLE}(?:\s*,\s*{_TUPLE})+')
+_SPACES = re.compile(r'\s+')
+
+
+def normalize_sql(query) -> str:
+    """SQL без литералов и лишних пробелов; развёрнутые VALUES сворачиваются"""
+    if isinstance(query, bytes):
+        query = query.decode(errors='replace')
+    query = _STRINGS.sub('?', query)
+    query = _NUMBERS.sub('?', query)
+    query = _VALUE_LISTS.sub('(...)', query)
+    return _SPACES.sub(' ', query).strip()
+
+
+class Trace:
+    """Метрики одного вызова handler()"""
+
+    def __init__(self, route: str):
+        self.route = route
+        self.started = time.perf_counter()
+        self.statements = []
+        self.connect_ms = 0.0
+
+    def record(self, query, elapsed: float, rows: int):
+        self.statements.append((elapsed, rows))
+        if elapsed >= SLOW_QUERY_MS:
+            print(json.dumps({
+                'slowQuery': normalize_sql(query),
+                'route': self.route,
+                'ms': round(elapsed, 2),
+                'rows': rows
+            }, ensure_ascii=False))
+
+    def server_timing(self, total: float) -> str:
+        db = sum(ms for ms, _ in self.statements)
+        metrics = [
+            f'db;dur={db:.2f}',
+            f'queries;desc="{len(self.statements)}"',
+            f'total;dur={total:.2f}'
+        ]
+        if self.connect_ms:
+            metrics.insert(2, f'connect;dur={self.connect_ms:.2f}')
+        return ', '.join(metrics)
+
+    def log(self, status: int, total: float):
+        print(json.dumps({
+            'request': self.route,
+            'status': status,
+            'totalMs': round(total, 2),
+            'dbMs': round(sum(ms for ms, _ in self.statements), 2),
+            'connectMs': round(self.connect_ms, 2),
+            'queries': len(self.statements),
+            'rows': sum(rows for _, rows in self.statements),
+            'statements': [[round(ms, 2), rows] for ms, rows in self.statements]
+        }))
+
+
+def current():
+    """Трассировка текущего вызова или None вне handler()"""
+    return getattr(_local, 'trace', None)
+
+
+def record_connect(elapsed: float):
+    """Время открытия подключения к БД в текущем вызове"""
+    trace = current()
+    if trace is not None:
+        trace.connect_ms += elapsed
+
+
+_traced_cursors = {}
+_traced_lock = threading.Lock()
+
+
+def _traced_cursor(factory):
+    """Подкласс курсора, замеряющий каждый execute"""
+    cls = _traced_cursors.get(factory)
+    if cls is not None:
+        return cls
+
+    def timed(method):
+        def wrapper(self, query, vars=None):
+            trace = current()
+            if trace is None:
+                return method(self, query, vars)
+            started = time.perf_counter()
+            try:
+                return method(self, query, vars)
+            finally:
+                trace.record(query, (time.perf_counter() - started) * 1000, max(self.rowcount, 0))
+        return wrapper
+
+    with _traced_lock:
+        cls = _traced_cursors.setdefault(factory, type(f'Traced{factory.__name__}', (factory,), {
+            'execute': timed(factory.execute),
+            'executemany': timed(factory.executemany)
+        }))
+    return cls
+
+
+class TracedConnection(extensions.connection):
+    """Подключение, курсоры которого пишут запросы в трассировку вызова"""
+
+    def cursor(self, *args, **kwargs):
+        factory = kwargs.get('cursor_factory') or self.cursor_factory or extensions.cursor
+        kwargs['cursor_factory'] = _traced_cursor(factory)
+        return super().cursor(*args, **kwargs)
+
+
+def traced(handler):
+    """Декоратор handler(): заголовок Server-Timing и строка JSON-лога на каждый вызов"""
+
+    @functools.wraps(handler)
+    def wrapper(event: dict, context) -> dict:
+        method = event.get('httpMethod', 'GET')
+        if method == 'OPTIONS':
+            return handler(event, context)
+        trace = _local.trace = Trace(f"{method} {event.get('path', '/')}")
+        try:
+            response = handler(event, context)
+        finally:
+            _local.trace = None
+        total = (time.perf_counter() - trace.started) * 1000
+        response['headers'] = {
+            **response.get('headers', {}),
+            'Server-Timing': trace.server_timing(total),
+            'Timing-Allow-Origin': '*'
+        }
+        if REQUEST_LOG:
+            trace.log(response.get('statusCode', 0), total)
+        return response
+
+    return wrapper
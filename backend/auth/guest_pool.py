@@ -0,0 +1,107 @@
+"""Пул заранее созданных гостевых аккаунтов с пополнением партиями"""
+import json
+import os
+import threading
+import time
+
+GUEST_POOL_BATCH = int(os.environ.get('GUEST_POOL_BATCH', '50'))
+GUEST_POOL_LOW_WATER = int(os.environ.get('GUEST_POOL_LOW_WATER', '20'))
+
+metrics = {
+    'claims': 0,
+    'emptyHits': 0,
+    'refills': 0,
+    'refilledAccounts': 0,
+    'refillMsLast': 0.0,
+    'depth': None
+}
+_refill_lock = threading.Lock()
+
+
+def _log(event: str):
+    print(json.dumps({'guestPool': event, **metrics}))
+
+
+def claim_guest(cur):
+    """Забрать готовый гостевой аккаунт; None, если пул пуст"""
+    cur.execute("""
+        WITH claimed AS (
+            DELETE FROM guest_pool
+            WHERE user_id = (
+                SELECT user_id FROM guest_pool
+                ORDER BY user_id
+                LIMIT 1
+                FOR UPDATE SKIP LOCKED
+            )
+            RETURNING user_id
+        )
+        UPDATE users u
+        SET last_active = CURRENT_TIMESTAMP, created_at = CURRENT_TIMESTAMP
+        FROM claimed
+        WHERE u.id = claimed.user_id
+        RETURNING u.id, u.username, u.coins, (SELECT COUNT(*) FROM guest_pool) - 1 AS depth
+    """)
+    guest = cur.fetchone()
+    if guest is None:
+        metrics['emptyHits'] += 1
+        metrics['depth'] = 0
+        _log('empty')
+        return None
+    metrics['claims'] += 1
+    metrics['depth'] = guest['depth']
+    return guest
+
+
+def refill(cur, count: int) -> int:
+    """Создать count полностью инициализированных гостей одним запросом"""
+    started = time.perf_counter()
+    cur.execute("""
+        WITH ids AS (
+            SELECT nextval('users_id_seq')::INTEGER AS id FROM generate_series(1, %s)
+        ), new_users AS (
+            INSERT INTO users (id, username, password_hash, is_guest, coins)
+            SELECT id, 'Гость' || id, '', TRUE, 100 FROM ids
+            ON CONFLICT (username) DO NOTHING
+            RETURNING id
+        ), newbie AS (
+            SELECT id FROM titles WHERE name = '[NEWBIE]'
+        ), starter_titles AS (
+            INSERT INTO user_titles (user_id, title_id)
+            SELECT nu.id, n.id FROM new_users nu CROSS JOIN newbie n
+        ), starter_counters AS (
+            INSERT INTO user_counters (user_id, titles_owned)
+            SELECT nu.id, (SELECT COUNT(*) FROM newbie) FROM new_users nu
+        )
+        INSERT INTO guest_pool (user_id)
+        SELECT id FROM new_users
+    """, (count,))
+    created = cur.rowcount
+    metrics['refills'] += 1
+    metrics['refilledAccounts'] += created
+    metrics['refillMsLast'] = round((time.perf_counter() - started) * 1000, 2)
+    if metrics['depth'] is not None:
+        metrics['depth'] += created
+    _log('refill')
+    return created
+
+
+def refill_if_low(conn, cur):
+    """Пополнить пул отдельной транзакцией, если он опустился ниже порога.
+
+    Вызывается после коммита выдачи гостя на том же подключении: фоновый поток
+    после ответа мог бы остановиться вместе с замороженным экземпляром, удерживая
+    блокировку и подключение пула. Ошибка пополнения не мешает выдаче.
+    """
+    depth = metrics['depth']
+    if depth is None or depth >= GUEST_POOL_LOW_WATER:
+        return
+    if not _refill_lock.acquire(blocking=False):
+        return
+    try:
+        refill(cur, GUEST_POOL_BATCH)
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        print(json.dumps({'guestPool': 'refill_failed', 'error': str(e)}))
+    finally:
+        _refill_lock.release()
@@ -1,24 +1,22 @@
 """API для регистрации и авторизации пользователей"""
 import json
-import os
 import hashlib
-import secrets
-import psycopg2
 from psycopg2.extras import RealDictCursor
+from db import get_db_connection, release_db_connection
+from counters import bump_counters
+from presence import touch
+import rules
+import streaks
+from session import issue_token, authenticate, revoke
+from tracing import traced
+from guest_pool import claim_guest, refill, refill_if_low, GUEST_POOL_BATCH
 from datetime import datetime, timedelta
 
-def get_db_connection():
-    """Создание подключения к базе данных"""
-    return psycopg2.connect(os.environ['DATABASE_URL'])
-
 def hash_password(password: str) -> str:
     """Хеширование пароля"""
     return hashlib.sha256(password.encode()).hexdigest()
 
-def generate_token() -> str:
-    """Генерация токена для сессии"""
-    return secrets.token_urlsafe(32)
-
+@traced
 def handler(event: dict, context) -> dict:
     """Обработчик запросов регистрации и авторизации"""
     
@@ -29,11 +27,13 @@ def handler(event: dict, context) -> dict:
             'headers': {
                 'Access-Control-Allow-Origin': '*',
                 'Access-Control-Allow-Methods': 'POST, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type'
+                'Access-Control-Allow-Headers': 'Content-Type, Authorization',
+                'Access-Control-Max-Age': '86400'
             },
             'body': ''
         }
     
+    conn = None
     try:
         body = json.loads(event.get('body', '{}'))
         action = body.get('action')
@@ -64,7 +64,6 @@ def handler(event: dict, context) -> dict:
             cur.execute("SELECT id FROM users WHERE username = %s", (username,))
             if cur.fetchone():
                 cur.close()
-                conn.close()
                 return {
                     'statusCode': 400,
                     'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
@@ -88,21 +87,14 @@ def handler(event: dict, context) -> dict:
                     (user_id, newbie_title['id'])
                 )
             
-            # Инициализация заданий
-            cur.execute("SELECT id FROM tasks")
-            tasks = cur.fetchall()
-            for task in tasks:
-                cur.execute(
-                    "INSERT INTO user_tasks (user_id, task_id, progress, completed) VALUES (%s, %s, 0, FALSE)",
-                    (user_id, task['id'])
-                )
+            bump_counters(cur, user_id, titles_owned=1 if newbie_title else 0)
+            touch(cur, user_id)
             
             conn.commit()
             
-            token = generate_token()
+            token = issue_token(user_id, username, False, False)
             
             cur.close()
-            conn.close()
             
             return {
                 'statusCode': 200,
@@ -142,21 +134,22 @@ def handler(event: dict, context) -> dict:
             
             if not user:
                 cur.close()
-                conn.close()
                 return {
                     'statusCode': 401,
                     'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
                     'body': json.dumps({'error': 'Неверное имя или пароль'})
                 }
             
-            # Обновление времени активности
+            # Обновление времени активности и серии посещений
             cur.execute("UPDATE users SET last_active = CURRENT_TIMESTAMP WHERE id = %s", (user['id'],))
+            touch(cur, user['id'])
+            visits = streaks.record_visits(cur, [user['id']])
+            completed_tasks = rules.evaluate(cur, streaks.visit_changes(visits)).get(user['id'], [])
             conn.commit()
             
-            token = generate_token()
+            token = issue_token(user['id'], user['username'], user['is_guest'], user['is_admin'])
             
             cur.close()
-            conn.close()
             
             return {
                 'statusCode': 200,
@@ -166,49 +159,44 @@ def handler(event: dict, context) -> dict:
                     'user': {
                         'id': user['id'],
                         'username': user['username'],
-                        'coins': user['coins'],
+                        'coins': user['coins'] + sum(t['reward'] for t in completed_tasks),
                         'isGuest': user['is_guest'],
                         'isAdmin': user['is_admin'],
                         'timeSpent': user['time_spent']
                     },
-                    'token': token
+                    'token': token,
+                    'completedTasks': completed_tasks
                 })
             }
         
         # Вход как гость
         elif action == 'guest':
-            guest_name = f"Гость{secrets.randbelow(9999):04d}"
-            
-            cur.execute(
-                "INSERT INTO users (username, password_hash, is_guest, coins) VALUES (%s, %s, TRUE, %s) RETURNING id",
-                (guest_name, '', 100)
-            )
-            user_id = cur.fetchone()['id']
+            guest = claim_guest(cur)
             
-            # Даём стартовый титул
-            cur.execute("SELECT id FROM titles WHERE name = '[NEWBIE]'")
-            newbie_title = cur.fetchone()
-            if newbie_title:
-                cur.execute(
-                    "INSERT INTO user_titles (user_id, title_id) VALUES (%s, %s)",
-                    (user_id, newbie_title['id'])
-                )
+            # Пул пуст — пополняем синхронно и забираем из свежей партии
+            if guest is None:
+                refill(cur, GUEST_POOL_BATCH)
+                guest = claim_guest(cur)
             
-            # Инициализация заданий
-            cur.execute("SELECT id FROM tasks")
-            tasks = cur.fetchall()
-            for task in tasks:
-                cur.execute(
-                    "INSERT INTO user_tasks (user_id, task_id, progress, completed) VALUES (%s, %s, 0, FALSE)",
-                    (user_id, task['id'])
-                )
+            if guest is None:
+                conn.rollback()
+                cur.close()
+                return {
+                    'statusCode': 503,
+                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'body': json.dumps({'error': 'Не удалось создать гостя, попробуйте ещё раз'})
+                }
             
+            touch(cur, guest['id'])
             conn.commit()
+            refill_if_low(conn, cur)
+            
+            user_id = guest['id']
+            guest_name = guest['username']
             
-            token = generate_token()
+            token = issue_token(user_id, guest_name, True, False)
             
             cur.close()
-            conn.close()
             
             return {
                 'statusCode': 200,
@@ -218,7 +206,7 @@ def handler(event: dict, context) -> dict:
                     'user': {
                         'id': user_id,
                         'username': guest_name,
-                        'coins': 100,
+                        'coins': guest['coins'],
                         'isGuest': True,
                         'isAdmin': False
                     },
@@ -226,9 +214,24 @@ def handler(event: dict, context) -> dict:
                 })
             }
         
+        # Выход: токен отзывается до истечения срока
+        elif action == 'logout':
+            session = authenticate(event, cur)
+            
+            if session:
+                revoke(cur, session)
+                conn.commit()
+            
+            cur.close()
+            
+            return {
+                'statusCode': 200,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': json.dumps({'success': True})
+            }
+        
         else:
             cur.close()
-            conn.close()
             return {
                 'statusCode': 400,
                 'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
@@ -240,4 +243,8 @@ def handler(event: dict, context) -> dict:
             'statusCode': 500,
             'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
             'body': json.dumps({'error': str(e)})
-        }
\ No newline at end of file
+        }
+    
+    finally:
+        if conn is not None:
+            release_db_connection(conn)
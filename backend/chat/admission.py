@@ -0,0 +1,173 @@
+"""Допуск запросов на запись: общий предел параллельности и пользовательские корзины токенов"""
+import functools
+import json
+import os
+import threading
+import time
+from db import pool
+
+# Окно, по которому экземпляр судит, тратит ли пользователь быстрее нормы корзины
+ADMISSION_SYNC_INTERVAL = float(os.environ.get('ADMISSION_SYNC_INTERVAL', '10'))
+ADMISSION_LOG_INTERVAL = float(os.environ.get('ADMISSION_LOG_INTERVAL', '10'))
+# Предел числа корзин в памяти; сверх него забываются давно простаивающие
+ADMISSION_MAX_TRACKED = int(os.environ.get('ADMISSION_MAX_TRACKED', '10000'))
+ADMISSION_IDLE_SECONDS = 300
+RETRY_AFTER_SECONDS = 1
+
+# Корзина -> (токенов в секунду, ёмкость)
+BUCKETS = {
+    'chat': (1.0, 5),
+    'action': (2.0, 20),
+    'heartbeat': (1 / 20, 3),
+    'purchase': (2.0, 10)
+}
+
+metrics = {
+    'admitted': 0,
+    'shed': 0,
+    'rateLimited': 0,
+    'rateLimitedByBucket': {name: 0 for name in BUCKETS},
+    'dbSyncs': 0
+}
+
+_lock = threading.Lock()
+_active = 0
+# (user_id, корзина) -> [токены, время пополнения, потрачено за окно, начало окна]
+_buckets = {}
+_logged_at = 0.0
+
+
+def _log(event: str, **fields):
+    """Строка лога с метриками не чаще раза в ADMISSION_LOG_INTERVAL секунд"""
+    global _logged_at
+    now = time.monotonic()
+    with _lock:
+        if now - _logged_at < ADMISSION_LOG_INTERVAL:
+            return
+        _logged_at = now
+        snapshot = {**metrics, 'rateLimitedByBucket': dict(metrics['rateLimitedByBucket'])}
+    print(json.dumps({'admission': event, **fields, **snapshot}))
+
+
+def too_many_requests() -> dict:
+    """Ответ 429 с подсказкой, когда повторить"""
+    return {
+        'statusCode': 429,
+        'headers': {
+            'Content-Type': 'application/json',
+            'Access-Control-Allow-Origin': '*',
+            'Retry-After': str(RETRY_AFTER_SECONDS)
+        },
+        'body': json.dumps({'error': 'Слишком много запросов'})
+    }
+
+
+def max_concurrent() -> int:
+    """Сколько запросов на запись экземпляр обрабатывает одновременно; остальные сразу получают 429.
+
+    ADMISSION_MAX_CONCURRENT, но не больше пула подключений: иначе допущенный запрос ждёт
+    getconn и получает 500 вместо быстрого 429. Читается на каждом запросе, поэтому
+    пул, увеличенный после импорта (нагрузочные прогоны), расширяет и допуск.
+    """
+    limit = os.environ.get('ADMISSION_MAX_CONCURRENT')
+    return min(int(limit), pool.max_size) if limit else pool.max_size
+
+
+def rate_limits_enabled() -> bool:
+    """Пользовательские корзины; ADMISSION_RATE_LIMITS=0 отключает их (нагрузочные прогоны)"""
+    return os.environ.get('ADMISSION_RATE_LIMITS', '1') != '0'
+
+
+def limit_writes(handler):
+    """Декоратор handler(): POST-запросы сверх max_concurrent() отбрасываются с 429 до похода в БД"""
+
+    @functools.wraps(handler)
+    def wrapper(event: dict, context) -> dict:
+        global _active
+        if event.get('httpMethod') != 'POST':
+            return handler(event, context)
+        limit = max_concurrent()
+        with _lock:
+            admitted = _active < limit
+            if admitted:
+                _active += 1
+                metrics['admitted'] += 1
+            else:
+                metrics['shed'] += 1
+        if not admitted:
+            _log('shed')
+            return too_many_requests()
+        try:
+            return handler(event, context)
+        finally:
+            with _lock:
+                _active -= 1
+
+    return wrapper
+
+
+def _sync(cur, user_id: int, bucket: str, spent: float) -> float:
+    """Списать потраченное локально из общей корзины в БД и вернуть её остаток"""
+    rate, burst = BUCKETS[bucket]
+    cur.execute("""
+        INSERT INTO rate_limits AS r (user_id, bucket, tokens, updated_at)
+        VALUES (%(uid)s, %(bucket)s, %(burst)s - %(spent)s, NOW())
+        ON CONFLICT (user_id, bucket) DO UPDATE SET
+            tokens = LEAST(%(burst)s, r.tokens + EXTRACT(EPOCH FROM NOW() - r.updated_at) * %(rate)s) - %(spent)s,
+            updated_at = NOW()
+        RETURNING tokens
+    """, {'uid': user_id, 'bucket': bucket, 'burst': burst, 'spent': spent, 'rate': rate})
+    row = cur.fetchone()
+    with _lock:
+        metrics['dbSyncs'] += 1
+    return float(row['tokens'] if isinstance(row, dict) else row[0])
+
+
+def allow(cur, user_id: int, bucket: str) -> bool:
+    """Списать токен из корзины пользователя; False — лимит исчерпан.
+
+    Решение принимается по корзине экземпляра без обращения к БД. С общей корзиной
+    в БД сверяется только пользователь у предела: отказанный локально или потративший
+    за окно ADMISSION_SYNC_INTERVAL больше, чем корзина пополняется за это время, —
+    и не чаще раза в окно. Ровный поток (heartbeat, обычный чат) в БД не пишет, а
+    всплески на разных экземплярах сводятся в общей корзине.
+    """
+    if not rate_limits_enabled():
+        return True
+    rate, burst = BUCKETS[bucket]
+    key = (user_id, bucket)
+    now = time.monotonic()
+    with _lock:
+        state = _buckets.get(key)
+        if state is None:
+            if len(_buckets) >= ADMISSION_MAX_TRACKED:
+                for stale in [k for k, s in _buckets.items() if now - s[1] > ADMISSION_IDLE_SECONDS]:
+                    del _buckets[stale]
+            state = _buckets[key] = [float(burst), now, 0.0, now]
+        state[0] = min(float(burst), state[0] + (now - state[1]) * rate)
+        state[1] = now
+        allowed = state[0] >= 1
+        if allowed:
+            state[0] -= 1
+            state[2] += 1
+        window = now - state[3]
+        due = False
+        if window >= ADMISSION_SYNC_INTERVAL:
+            due = not allowed or state[2] > rate * window
+            spent = state[2]
+            state[2] = 0.0
+            state[3] = now
+
+    if due:
+        shared = _sync(cur, user_id, bucket, spent)
+        with _lock:
+            state[0] = min(state[0], shared)
+        if allowed and shared < 0:
+            allowed = False
+
+    if not allowed:
+        with _lock:
+            metrics['rateLimited'] += 1
+            metrics['rateLimitedByBucket'][bucket] += 1
+        _log('rate_limited', bucket=bucket)
+    return allowed
@@ -0,0 +1,111 @@
+"""Окно последних сообщений чата в памяти тёплого экземпляра, уже закодированных в JSON"""
+import os
+import threading
+import time
+from collections import deque
+import queries
+from response import dumps, row_encoder, iso
+
+CHAT_CACHE_SIZE = int(os.environ.get('CHAT_CACHE_SIZE', '200'))
+# Опросы в пределах интервала разделяют одну проверку MAX(id)
+CHAT_CACHE_PROBE_INTERVAL = float(os.environ.get('CHAT_CACHE_PROBE_INTERVAL', '0.5'))
+# Окно периодически перечитывается целиком, чтобы подхватить изменения авторов (флаг администратора)
+CHAT_CACHE_MAX_AGE = float(os.environ.get('CHAT_CACHE_MAX_AGE', '60'))
+
+# Порядок ключей совпадает с колонками операторов messages_* из queries.py
+encode_messages = row_encoder(
+    ('id', None), ('userId', None), ('username', None), ('message', None),
+    ('createdAt', iso), ('isAdmin', None), ('title', None)
+)
+
+
+class MessageWindow:
+    """Кольцевой буфер (id, JSON) последних сообщений.
+
+    Буфер полон для всех id больше floor_id: опрос с sinceId >= floor_id
+    отдаётся из памяти, более старые страницы читаются из БД.
+    """
+
+    def __init__(self, size: int, probe_interval: float, max_age: float, encode):
+        self.size = size
+        self.probe_interval = probe_interval
+        self.max_age = max_age
+        self.encode = encode
+        self._items = deque(maxlen=size)
+        self._floor_id = None
+        self._head_id = 0
+        self._probed_at = None
+        self._built_at = None
+        self._lock = threading.Lock()
+        self.metrics = {'hits': 0, 'misses': 0, 'probes': 0, 'loads': 0}
+
+    def encode_rows(self, rows) -> list:
+        """Строки кортежного курсора -> [(id, JSON)]"""
+        return [(item['id'], dumps(item)) for item in self.encode(rows)]
+
+    def invalidate(self):
+        """Следующий запрос проверит MAX(id) без ожидания интервала"""
+        with self._lock:
+            self._probed_at = None
+
+    def refresh(self, cur, force: bool = False):
+        """Догрузить новые сообщения, если MAX(id) в БД ушёл вперёд; cur — кортежный курсор"""
+        with self._lock:
+            if not force and self._probed_at is not None and time.monotonic() - self._probed_at < self.probe_interval:
+                return
+            self._probed_at = time.monotonic()
+            head_id = self._head_id
+            loaded = self._floor_id is not None and self._probed_at - self._built_at < self.max_age
+
+        cur.execute("SELECT COALESCE(MAX(id), 0) FROM chat_messages")
+        max_id = cur.fetchone()[0]
+        if loaded and max_id <= head_id:
+            with self._lock:
+                self.metrics['probes'] += 1
+            return
+
+        rows = None
+        if loaded:
+            queries.execute(cur, 'messages_after', (head_id, self.size))
+            rows = cur.fetchall()
+        # Холодный старт, устаревшее окно или отставание на целое окно — окно строится заново из последних сообщений
+        rebuild = rows is None or len(rows) >= self.size
+        if rebuild:
+            queries.execute(cur, 'messages_latest', (self.size,))
+            rows = list(reversed(cur.fetchall()))
+        items = self.encode_rows(rows)
+
+        with self._lock:
+            self.metrics['probes'] += 1
+            self.metrics['loads'] += 1
+            if rebuild:
+                self._items.clear()
+                self._head_id = 0
+                self._built_at = time.monotonic()
+                # Окно полно выше первого загруженного id или целиком, если сообщений меньше окна
+                self._floor_id = items[0][0] - 1 if len(items) >= self.size else 0
+            for message_id, encoded in items:
+                if message_id <= self._head_id:
+                    continue
+                if len(self._items) == self.size:
+                    # Вытесняемое сообщение становится нижней границей окна
+                    self._floor_id = self._items[0][0]
+                self._items.append((message_id, encoded))
+                self._head_id = message_id
+
+    def read(self, after_id, limit: int):
+        """Сообщения из памяти: новее after_id или последние limit; None — окна не хватает"""
+        with self._lock:
+            if self._floor_id is None:
+                result = None
+            elif after_id is None:
+                result = list(self._items)[-limit:] if limit <= len(self._items) or self._floor_id == 0 else None
+            elif after_id >= self._floor_id:
+                result = [item for item in self._items if item[0] > after_id][:limit]
+            else:
+                result = None
+            self.metrics['hits' if result is not None else 'misses'] += 1
+        return result
+
+
+window = MessageWindow(CHAT_CACHE_SIZE, CHAT_CACHE_PROBE_INTERVAL, CHAT_CACHE_MAX_AGE, encode_messages)
@@ -0,0 +1,19 @@
+"""Счётчики активности пользователя, обновляемые в одной транзакции с событием"""
+
+
+def bump_counters(cur, user_id, messages_sent: int = 0, titles_owned: int = 0,
+                  tasks_completed: int = 0, coins_earned: int = 0) -> dict:
+    """Прибавить к счётчикам пользователя и вернуть их новые значения"""
+    cur.execute("""
+        INSERT INTO user_counters (user_id, messages_sent, titles_owned, tasks_completed, coins_earned)
+        VALUES (%s, %s, %s, %s, %s)
+        ON CONFLICT (user_id) DO UPDATE SET
+            messages_sent = user_counters.messages_sent + EXCLUDED.messages_sent,
+            titles_owned = user_counters.titles_owned + EXCLUDED.titles_owned,
+            tasks_completed = user_counters.tasks_completed + EXCLUDED.tasks_completed,
+            coins_earned = user_counters.coins_earned + EXCLUDED.coins_earned,
+            updated_at = CURRENT_TIMESTAMP
+        RETURNING messages_sent, titles_owned, tasks_completed, coins_earned
+    """, (user_id, messages_sent, titles_owned, tasks_completed, coins_earned))
+    return cur.fetchone()
+
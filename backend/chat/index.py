@@ -1,14 +1,72 @@
 """API для работы с чатом в реальном времени"""
+import base64
+import binascii
 import json
+import math
 import os
-import psycopg2
 from psycopg2.extras import RealDictCursor
+from db import get_db_connection, release_db_connection
+from listener import listener, CHAT_CHANNEL
+from counters import bump_counters
+from presence import touch
+from session import authenticate
+from tracing import traced
+from admission import limit_writes, allow, too_many_requests
+from response import raw_json_response
+import queries
+import rules
+import chat_cache
 from datetime import datetime
 
-def get_db_connection():
-    """Создание подключения к базе данных"""
-    return psycopg2.connect(os.environ['DATABASE_URL'])
+LONG_POLL_MAX_WAIT = float(os.environ.get('CHAT_LONG_POLL_MAX_WAIT', '25'))
+CHAT_PAGE_DEFAULT = 50
+CHAT_PAGE_MAX = int(os.environ.get('CHAT_PAGE_MAX', '100'))
 
+def encode_cursor(message_id: int) -> str:
+    """Непрозрачный курсор страницы по id сообщения"""
+    return base64.urlsafe_b64encode(f'c1:{message_id}'.encode()).decode().rstrip('=')
+
+def decode_cursor(cursor: str) -> int:
+    """Id сообщения из курсора; ValueError для чужих и испорченных курсоров"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+    except (binascii.Error, UnicodeDecodeError):
+        raise ValueError('bad cursor')
+    prefix, _, value = raw.partition(':')
+    if prefix != 'c1' or not value.isdigit():
+        raise ValueError('bad cursor')
+    return int(value)
+
+def page_limit(raw) -> int:
+    """Размер страницы с жёстким ограничением сверху"""
+    try:
+        limit = int(raw) if raw else CHAT_PAGE_DEFAULT
+    except ValueError:
+        limit = CHAT_PAGE_DEFAULT
+    return max(1, min(limit, CHAT_PAGE_MAX))
+
+def fetch_messages(cur, after_id, before_id, limit: int) -> list:
+    """Страница сообщений по возрастанию id: новее after_id, старее before_id или последние; cur — кортежный курсор"""
+    if after_id is not None:
+        queries.execute(cur, 'messages_after', (after_id, limit))
+        return cur.fetchall()
+    if before_id is not None:
+        queries.execute(cur, 'messages_before', (before_id, limit))
+    else:
+        queries.execute(cur, 'messages_latest', (limit,))
+    return list(reversed(cur.fetchall()))
+
+def read_messages(cur, after_id, before_id, limit: int, fresh: bool = False) -> list:
+    """[(id, JSON)] страницы: из окна последних сообщений в памяти, если его хватает, иначе из БД"""
+    if before_id is None:
+        chat_cache.window.refresh(cur, force=fresh)
+        items = chat_cache.window.read(after_id, limit)
+        if items is not None:
+            return items
+    return chat_cache.window.encode_rows(fetch_messages(cur, after_id, before_id, limit))
+
+@traced
+@limit_writes
 def handler(event: dict, context) -> dict:
     """Обработчик чат API"""
     
@@ -19,11 +77,13 @@ def handler(event: dict, context) -> dict:
             'headers': {
                 'Access-Control-Allow-Origin': '*',
                 'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type'
+                'Access-Control-Allow-Headers': 'Content-Type, Authorization',
+                'Access-Control-Max-Age': '86400'
             },
             'body': ''
         }
     
+    conn = None
     try:
         method = event.get('httpMethod', 'GET')
         body = json.loads(event.get('body', '{}')) if method == 'POST' else {}
@@ -34,129 +94,138 @@ def handler(event: dict, context) -> dict:
         
         # Получить сообщения
         if method == 'GET':
-            limit = int(query.get('limit', 50))
-            since_id = query.get('sinceId')
-            
-            if since_id:
-                cur.execute("""
-                    SELECT cm.id, cm.user_id, cm.username, cm.message, cm.created_at,
-                           u.is_admin
-                    FROM chat_messages cm
-                    LEFT JOIN users u ON cm.user_id = u.id
-                    WHERE cm.id > %s
-                    ORDER BY cm.created_at DESC
-                    LIMIT %s
-                """, (since_id, limit))
-            else:
-                cur.execute("""
-                    SELECT cm.id, cm.user_id, cm.username, cm.message, cm.created_at,
-                           u.is_admin
-                    FROM chat_messages cm
-                    LEFT JOIN users u ON cm.user_id = u.id
-                    ORDER BY cm.created_at DESC
-                    LIMIT %s
-                """, (limit,))
-            
-            messages = cur.fetchall()
+            limit = page_limit(query.get('limit'))
+            
+            # Курсоры after/before; sinceId — прежний вариант after с голым id
+            try:
+                after_id = decode_cursor(query['after']) if query.get('after') else None
+                before_id = decode_cursor(query['before']) if query.get('before') else None
+                if after_id is None and query.get('sinceId'):
+                    after_id = int(query['sinceId'])
+            except ValueError:
+                cur.close()
+                return {
+                    'statusCode': 400,
+                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'body': json.dumps({'error': 'Некорректный курсор'})
+                }
+            
+            try:
+                wait = float(query.get('wait') or 0)
+            except ValueError:
+                wait = math.nan
+            if not math.isfinite(wait) or wait < 0:
+                cur.close()
+                return {
+                    'statusCode': 400,
+                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'body': json.dumps({'error': 'Некорректный wait'})
+                }
+            wait = min(wait, LONG_POLL_MAX_WAIT) if after_id is not None else 0
+            
+            # Долгий опрос: подписка экземпляра устанавливается до выборки, чтобы не пропустить сообщение между ними
+            if wait > 0 and not listener.start():
+                wait = 0
+            
+            # Кортежный курсор: строки сразу кодируются в ответ без промежуточных словарей
+            rows_cur = conn.cursor()
+            try:
+                messages = read_messages(rows_cur, after_id, before_id, limit, fresh=wait > 0)
+            finally:
+                rows_cur.close()
+            
+            if wait > 0 and not messages:
+                # На время ожидания подключение возвращается в пул
+                cur.close()
+                release_db_connection(conn)
+                conn = None
+                if listener.wait(after_id, wait):
+                    conn = get_db_connection()
+                    cur = conn.cursor(cursor_factory=RealDictCursor)
+                    rows_cur = conn.cursor()
+                    try:
+                        messages = read_messages(rows_cur, after_id, before_id, limit, fresh=True)
+                    finally:
+                        rows_cur.close()
             
             cur.close()
-            conn.close()
             
-            return {
-                'statusCode': 200,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps([{
-                    'id': m['id'],
-                    'userId': m['user_id'],
-                    'username': m['username'],
-                    'message': m['message'],
-                    'isAdmin': m['is_admin'] or False,
-                    'createdAt': m['created_at'].isoformat() if m['created_at'] else None
-                } for m in reversed(messages)])
-            }
+            # Курсоры для прокрутки назад и опроса вперёд
+            headers = {'Access-Control-Expose-Headers': 'X-Cursor-Before, X-Cursor-After'}
+            if messages:
+                headers['X-Cursor-Before'] = encode_cursor(messages[0][0])
+                headers['X-Cursor-After'] = encode_cursor(messages[-1][0])
+            elif after_id is not None:
+                headers['X-Cursor-After'] = encode_cursor(after_id)
+            
+            return raw_json_response(event, 200, b'[' + b','.join(m[1] for m in messages) + b']', headers)
         
         # Отправить сообщение
         elif method == 'POST':
-            user_id = body.get('userId')
-            username = body.get('username')
+            session = authenticate(event, cur)
+            
+            if not session:
+                cur.close()
+                return {
+                    'statusCode': 401,
+                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'body': json.dumps({'error': 'Требуется вход'})
+                }
+            
+            user_id = session['uid']
+            username = session['name']
             message = body.get('message', '').strip()
             
-            if not user_id or not username or not message:
+            if not message:
                 cur.close()
-                conn.close()
                 return {
                     'statusCode': 400,
                     'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'error': 'userId, username and message required'})
+                    'body': json.dumps({'error': 'message required'})
                 }
             
             if len(message) > 500:
                 cur.close()
-                conn.close()
                 return {
                     'statusCode': 400,
                     'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
                     'body': json.dumps({'error': 'Сообщение слишком длинное'})
                 }
             
-            # Сохранение сообщения
-            cur.execute("""
-                INSERT INTO chat_messages (user_id, username, message)
-                VALUES (%s, %s, %s)
-                RETURNING id, created_at
-            """, (user_id, username, message))
+            if not allow(cur, user_id, 'chat'):
+                conn.commit()
+                cur.close()
+                return too_many_requests()
+            
+            # Сохранение сообщения вместе с данными автора для модели чтения
+            queries.execute(cur, 'insert_message', (user_id, username, message))
             
             result = cur.fetchone()
+            
+            if not result:
+                cur.close()
+                return {
+                    'statusCode': 404,
+                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'body': json.dumps({'error': 'User not found'})
+                }
+            
             message_id = result['id']
             created_at = result['created_at']
             
-            # Обновление прогресса заданий на чат
-            cur.execute("""
-                UPDATE user_tasks 
-                SET progress = (
-                    SELECT COUNT(*) FROM chat_messages WHERE user_id = %s
-                )
-                WHERE user_id = %s AND task_id IN (
-                    SELECT id FROM tasks WHERE task_type = 'chat'
-                ) AND completed = FALSE
-            """, (user_id, user_id))
-            
-            # Проверка завершения заданий
-            cur.execute("""
-                SELECT ut.id, t.reward, t.name
-                FROM user_tasks ut
-                JOIN tasks t ON ut.task_id = t.id
-                WHERE ut.user_id = %s AND ut.completed = FALSE AND ut.progress >= t.max_progress AND t.task_type = 'chat'
-            """, (user_id,))
-            
-            completed_tasks = cur.fetchall()
-            total_reward = sum(t['reward'] for t in completed_tasks)
-            
-            if completed_tasks:
-                cur.execute("""
-                    UPDATE user_tasks 
-                    SET completed = TRUE, completed_at = CURRENT_TIMESTAMP
-                    WHERE user_id = %s AND completed = FALSE AND progress >= (
-                        SELECT max_progress FROM tasks WHERE tasks.id = user_tasks.task_id
-                    ) AND task_id IN (SELECT id FROM tasks WHERE task_type = 'chat')
-                """, (user_id,))
-                
-                cur.execute("UPDATE users SET coins = coins + %s WHERE id = %s", (total_reward, user_id))
-                
-                for task in completed_tasks:
-                    cur.execute(
-                        "INSERT INTO coin_transactions (user_id, amount, transaction_type, description) VALUES (%s, %s, 'task_reward', %s)",
-                        (user_id, task['reward'], f"Награда за: {task['name']}")
-                    )
+            touch(cur, user_id)
             
-            conn.commit()
+            # Будим долгие опросы после коммита
+            cur.execute("SELECT pg_notify(%s, %s)", (CHAT_CHANNEL, str(message_id)))
+            
+            # Задания на чат по счётчику сообщений: завершаются только пересечённые пороги
+            sent = bump_counters(cur, user_id, messages_sent=1)['messages_sent']
+            completed_tasks = rules.evaluate(cur, {user_id: {'chat': (sent - 1, sent)}}).get(user_id, [])
             
-            # Получение обновленного баланса
-            cur.execute("SELECT coins, is_admin FROM users WHERE id = %s", (user_id,))
-            user = cur.fetchone()
+            conn.commit()
+            chat_cache.window.invalidate()
             
             cur.close()
-            conn.close()
             
             return {
                 'statusCode': 200,
@@ -168,17 +237,18 @@ def handler(event: dict, context) -> dict:
                         'userId': user_id,
                         'username': username,
                         'message': message,
-                        'isAdmin': user['is_admin'] or False,
+                        'isAdmin': result['author_is_admin'],
+                        'title': result['author_title'],
                         'createdAt': created_at.isoformat()
                     },
-                    'coins': user['coins'],
+                    # Баланс на момент отправки плюс награды этой же транзакции
+                    'coins': result['coins'] + sum(t['reward'] for t in completed_tasks),
                     'completedTasks': [{'name': t['name'], 'reward': t['reward']} for t in completed_tasks]
                 })
             }
         
         else:
             cur.close()
-            conn.close()
             return {
                 'statusCode': 405,
                 'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
@@ -190,4 +260,8 @@ def handler(event: dict, context) -> dict:
             'statusCode': 500,
             'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
             'body': json.dumps({'error': str(e)})
-        }
\ No newline at end of file
+        }
+    
+    finally:
+        if conn is not None:
+            release_db_connection(conn)
@@ -0,0 +1,82 @@
+"""Одно подключение LISTEN на экземпляр: будит долгие опросы чата, не занимая подключения пула"""
+import json
+import os
+import select
+import threading
+import time
+import psycopg2
+from psycopg2 import extensions
+
+CHAT_CHANNEL = 'chat_messages'
+# Проверка живости подключения при отсутствии уведомлений и пауза перед переподключением
+LISTEN_PING_INTERVAL = float(os.environ.get('CHAT_LISTEN_PING_INTERVAL', '30'))
+LISTEN_RECONNECT_DELAY = float(os.environ.get('CHAT_LISTEN_RECONNECT_DELAY', '1'))
+LISTEN_READY_TIMEOUT = 5
+
+
+class Listener:
+    """Фоновый поток с подпиской на канал и наибольшим id из полученных уведомлений"""
+
+    def __init__(self, channel: str):
+        self.channel = channel
+        self.latest_id = 0
+        # Растёт при обрыве подписки: уведомления могли потеряться, ожидающим пора перечитать
+        self.generation = 0
+        self._ready = False
+        self._thread = None
+        self._cond = threading.Condition()
+
+    def start(self) -> bool:
+        """Запустить поток при первом обращении; False — подписка не установилась за LISTEN_READY_TIMEOUT"""
+        with self._cond:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='chat-listener', daemon=True)
+                self._thread.start()
+            return self._cond.wait_for(lambda: self._ready, LISTEN_READY_TIMEOUT)
+
+    def wait(self, since_id: int, timeout: float) -> bool:
+        """Ждать уведомления о сообщении новее since_id не дольше timeout секунд"""
+        with self._cond:
+            generation = self.generation
+            return self._cond.wait_for(
+                lambda: self.latest_id > since_id or self.generation != generation, timeout
+            )
+
+    def _run(self):
+        while True:
+            conn = None
+            try:
+                conn = psycopg2.connect(os.environ['DATABASE_URL'])
+                conn.set_isolation_level(extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+                with conn.cursor() as cur:
+                    cur.execute(f"LISTEN {self.channel}")
+                with self._cond:
+                    self._ready = True
+                    self._cond.notify_all()
+                while True:
+                    if select.select([conn], [], [], LISTEN_PING_INTERVAL) == ([], [], []):
+                        with conn.cursor() as cur:
+                            cur.execute("SELECT 1")
+                        continue
+                    conn.poll()
+                    ids = [int(n.payload) for n in conn.notifies if n.payload.isdigit()]
+                    conn.notifies.clear()
+                    if ids:
+                        with self._cond:
+                            self.latest_id = max(self.latest_id, *ids)
+                            self._cond.notify_all()
+            except Exception as e:
+                print(json.dumps({'chatListener': 'disconnect', 'error': str(e)}))
+                with self._cond:
+                    self._ready = False
+                    self.generation += 1
+                    self._cond.notify_all()
+                if conn is not None:
+                    try:
+                        conn.close()
+                    except psycopg2.Error:
+                        pass
+                time.sleep(LISTEN_RECONNECT_DELAY)
+
+
+listener = Listener(CHAT_CHANNEL)
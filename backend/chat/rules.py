@@ -0,0 +1,141 @@
+"""Движок заданий: каталог tasks, проиндексированный по task_type, и пороги max_progress с двоичным поиском"""
+import bisect
+import os
+import threading
+import time
+import queries
+
+RULES_TTL = float(os.environ.get('CATALOG_TTL', '300'))
+# Окно задания на дневной заработок: 'day' — календарные сутки, 'rolling' — последние 24 часа
+EARNINGS_WINDOW = os.environ.get('EARNINGS_WINDOW', 'day')
+
+# Типы, прогресс которых — счётчик в users/user_counters/user_streaks/user_earnings_hourly
+COUNTER_TYPES = ('time', 'coins', 'chat', 'purchase', 'complete', 'visit', 'daily_earnings')
+# Типы, прогресс которых копится через /action в user_task_counters
+ACTION_TYPES = frozenset(('action', 'social', 'secret', 'special'))
+
+
+def rule_key(task: dict):
+    """Ключ индекса: тип задания, а для заданий на конкретный титул — (тип, title_id)"""
+    return task['task_type'] if task.get('title_id') is None else (task['task_type'], task['title_id'])
+
+
+class Rules:
+    """Задания по ключам rule_key: отсортированные пороги и задания в том же порядке"""
+
+    def __init__(self, tasks: list):
+        self.loaded_at = time.monotonic()
+        self._thresholds = {}
+        self._tasks = {}
+        for task in sorted(tasks, key=lambda t: (t['max_progress'], t['id'])):
+            self._thresholds.setdefault(rule_key(task), []).append(task['max_progress'])
+            self._tasks.setdefault(rule_key(task), []).append(task)
+
+    def crossed(self, key, old, new: int) -> list:
+        """Задания ключа с порогом в (old, new]; old=None — все пороги не выше new"""
+        thresholds = self._thresholds.get(key)
+        if not thresholds:
+            return []
+        lo = 0 if old is None else bisect.bisect_right(thresholds, old)
+        hi = bisect.bisect_right(thresholds, new)
+        return self._tasks[key][lo:hi]
+
+
+_rules = None
+_lock = threading.Lock()
+
+
+def get_rules(cur) -> Rules:
+    """Индекс заданий из памяти; из БД читается при холодном старте и по истечении RULES_TTL"""
+    global _rules
+    rules = _rules
+    if rules is not None and time.monotonic() - rules.loaded_at < RULES_TTL:
+        return rules
+    with _lock:
+        if _rules is not None and time.monotonic() - _rules.loaded_at < RULES_TTL:
+            return _rules
+        cur.execute("SELECT id, name, task_type, title_id, reward, max_progress FROM tasks")
+        _rules = Rules([dict(t) for t in cur.fetchall()])
+        return _rules
+
+
+def evaluate(cur, changes: dict) -> dict:
+    """Завершить задания, пороги которых пересекли счётчики, и начислить награды.
+
+    changes — {user_id: {rule_key: (старое значение, новое)}}; пишутся только строки
+    пересечённых заданий. Награды двигают счётчики coins и complete, поэтому они
+    и заработок за день проверяются следующим проходом, пока новые задания завершаются.
+    Возвращает {user_id: [{name, reward}]}; cur — RealDictCursor.
+    """
+    rules = get_rules(cur)
+    completed = {}
+    while changes:
+        crossed = [
+            (uid, task, min(new, task['max_progress']))
+            for uid, values in sorted(changes.items())
+            for key, (old, new) in values.items()
+            for task in rules.crossed(key, old, new)
+        ]
+        if not crossed:
+            break
+        queries.execute(cur, 'complete_tasks', tuple(list(column) for column in zip(
+            *[(uid, task['id'], progress) for uid, task, progress in crossed]
+        )))
+        done = {(r['user_id'], r['task_id']) for r in cur.fetchall()}
+        if not done:
+            break
+
+        newly = {}
+        for uid, task, _ in crossed:
+            if (uid, task['id']) in done:
+                newly.setdefault(uid, []).append({'name': task['name'], 'reward': task['reward']})
+        rewards = {uid: sum(t['reward'] for t in tasks) for uid, tasks in newly.items()}
+        # По возрастанию id: множественные UPDATE блокируют строки в одном порядке на всех экземплярах
+        user_ids = sorted(newly)
+
+        queries.execute(cur, 'add_coins', (user_ids, [rewards[uid] for uid in user_ids]))
+        coins = {r['id']: r['coins'] for r in cur.fetchall()}
+        ledger = [(uid, t['reward'], t['name']) for uid in user_ids for t in newly[uid]]
+        queries.execute(cur, 'insert_task_rewards', tuple(list(column) for column in zip(*ledger)))
+        queries.execute(cur, 'add_task_rewards', (user_ids, [len(newly[uid]) for uid in user_ids],
+                                                  [rewards[uid] for uid in user_ids]))
+        tasks_completed = {r['user_id']: r['tasks_completed'] for r in cur.fetchall()}
+        # Награды журнала уже разнесены триггером по часовым корзинам заработка
+        queries.execute(cur, 'daily_earnings', (user_ids, EARNINGS_WINDOW))
+        earned = {r['user_id']: r['earned'] for r in cur.fetchall()}
+
+        for uid, tasks in newly.items():
+            completed.setdefault(uid, []).extend(tasks)
+        # Баланс и заработок меняются и вне движка (покупки, подарки), поэтому проверяются по всем порогам
+        changes = {
+            uid: {
+                'coins': (None, coins[uid]),
+                'complete': (tasks_completed[uid] - len(newly[uid]), tasks_completed[uid]),
+                'daily_earnings': (None, earned.get(uid, 0))
+            }
+            for uid in user_ids if uid in coins
+        }
+    return completed
+
+
+def counter_values(state: dict) -> dict:
+    """Текущие значения счётчиков по типам из строки task_state"""
+    values = {task_type: state[task_type] or 0 for task_type in COUNTER_TYPES}
+    values.update(state['generic'] or {})
+    return values
+
+
+def task_progress(tasks: list, rows: dict, values: dict) -> dict:
+    """Прогресс заданий для выдачи: {task_id: (progress, completed)}.
+
+    Завершённые берутся из user_tasks, незавершённые — из счётчика типа,
+    а если у типа счётчика нет — из строки user_tasks.
+    """
+    progress = {}
+    for task in tasks:
+        value, done = rows.get(task['id'], (0, False))
+        if not done and task['task_type'] in values:
+            value = min(values[task['task_type']], task['max_progress'])
+        if done or value:
+            progress[task['id']] = (value, done)
+    return progress
@@ -0,0 +1,65 @@
+"""Кэш каталога титулов и заданий в памяти тёплого экземпляра функции"""
+import hashlib
+import json
+import os
+import threading
+import time
+
+CATALOG_TTL = float(os.environ.get('CATALOG_TTL', '300'))
+
+
+class Catalog:
+    """Снимок таблиц titles и tasks с версией, вычисленной по содержимому"""
+
+    def __init__(self, titles: list, tasks: list):
+        self.titles = titles
+        self.tasks = tasks
+        self.loaded_at = time.monotonic()
+        payload = json.dumps([titles, tasks], sort_keys=True, ensure_ascii=False)
+        self.version = hashlib.sha1(payload.encode()).hexdigest()[:16]
+
+
+_catalog = None
+_lock = threading.Lock()
+
+
+def get_catalog(cur) -> Catalog:
+    """Каталог из памяти; из БД читается при холодном старте и по истечении CATALOG_TTL"""
+    global _catalog
+    catalog = _catalog
+    if catalog is not None and time.monotonic() - catalog.loaded_at < CATALOG_TTL:
+        return catalog
+
+    with _lock:
+        if _catalog is not None and time.monotonic() - _catalog.loaded_at < CATALOG_TTL:
+            return _catalog
+        cur.execute("""
+            SELECT id, name, description, price, sort_order
+            FROM titles
+            ORDER BY sort_order
+        """)
+        titles = [dict(t) for t in cur.fetchall()]
+        cur.execute("""
+            SELECT id, name, description, task_type, reward, max_progress, sort_order
+            FROM tasks
+            ORDER BY sort_order
+        """)
+        tasks = [dict(t) for t in cur.fetchall()]
+        _catalog = Catalog(titles, tasks)
+        return _catalog
+
+
+def make_etag(catalog: Catalog, *user_state) -> str:
+    """ETag ответа: версия каталога плюс хэш пользовательского состояния"""
+    digest = hashlib.sha1(json.dumps(user_state, sort_keys=True).encode()).hexdigest()[:16]
+    return f'W/"{catalog.version}-{digest}"'
+
+
+def etag_matches(event: dict, etag: str) -> bool:
+    """Совпадает ли ETag с заголовком If-None-Match запроса"""
+    headers = {k.lower(): v for k, v in (event.get('headers') or {}).items()}
+    header = headers.get('if-none-match')
+    if not header:
+        return False
+    candidates = [c.strip() for c in header.split(',')]
+    return '*' in candidates or etag in candidates or etag[2:] in candidates
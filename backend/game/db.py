@@ -0,0 +1,176 @@
+"""Пул подключений к PostgreSQL, общий для всех вызовов тёплого экземпляра функции"""
+import json
+import os
+import select
+import threading
+import time
+import psycopg2
+from psycopg2 import extensions
+from tracing import TracedConnection, record_connect
+
+POOL_MAX_SIZE = int(os.environ.get('DB_POOL_MAX_SIZE', '4'))
+POOL_WAIT_TIMEOUT = float(os.environ.get('DB_POOL_WAIT_TIMEOUT', '5'))
+POOL_CHECK_INTERVAL = float(os.environ.get('DB_POOL_CHECK_INTERVAL', '30'))
+
+
+class PoolTimeout(Exception):
+    """Не удалось получить подключение из пула за отведённое время"""
+
+
+class ConnectionPool:
+    """Пул подключений с проверкой здоровья и переподключением"""
+
+    def __init__(self, max_size: int, wait_timeout: float, check_interval: float):
+        self.max_size = max_size
+        self.wait_timeout = wait_timeout
+        self.check_interval = check_interval
+        self._idle = []
+        self._in_use = 0
+        self._cond = threading.Condition()
+        self.metrics = {
+            'connects': 0,
+            'connectMsTotal': 0.0,
+            'connectMsLast': 0.0,
+            'acquires': 0,
+            'waits': 0,
+            'waitMsTotal': 0.0,
+            'timeouts': 0,
+            'reconnects': 0,
+            'discarded': 0
+        }
+
+    def _log(self, event: str, **fields):
+        """Структурированная строка лога с текущими метриками пула"""
+        print(json.dumps({'dbPool': event, **fields, **self.stats()}))
+
+    def _connect(self):
+        """Открытие нового подключения с замером времени"""
+        started = time.perf_counter()
+        conn = psycopg2.connect(os.environ['DATABASE_URL'], connection_factory=TracedConnection)
+        elapsed = (time.perf_counter() - started) * 1000
+        record_connect(elapsed)
+        with self._cond:
+            self.metrics['connects'] += 1
+            self.metrics['connectMsTotal'] += elapsed
+            self.metrics['connectMsLast'] = elapsed
+        self._log('connect', connectMs=round(elapsed, 2))
+        return conn
+
+    def _is_healthy(self, conn, idle_since: float) -> bool:
+        """Проверка подключения из простаивающих.
+
+        Простаивающему подключению сервер ничего не присылает: данные в сокете значат
+        обрыв (FATAL при перезапуске сервера или EOF) и проверяются без обращения к серверу.
+        Простаивавшие дольше интервала проверки дополнительно проверяются запросом.
+        """
+        if conn.closed:
+            return False
+        try:
+            if select.select([conn], [], [], 0)[0]:
+                return False
+        except (OSError, ValueError):
+            return False
+        if time.monotonic() - idle_since < self.check_interval:
+            return True
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def getconn(self):
+        """Получение подключения: из простаивающих, новое или после ожидания"""
+        deadline = time.monotonic() + self.wait_timeout
+        waited_from = None
+        with self._cond:
+            self.metrics['acquires'] += 1
+            while self._in_use >= self.max_size:
+                if waited_from is None:
+                    waited_from = time.monotonic()
+                    self.metrics['waits'] += 1
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self.metrics['timeouts'] += 1
+                    raise PoolTimeout('Database connection pool exhausted')
+                self._cond.wait(remaining)
+            if waited_from is not None:
+                self.metrics['waitMsTotal'] += (time.monotonic() - waited_from) * 1000
+            self._in_use += 1
+            conn, idle_since = self._idle.pop() if self._idle else (None, None)
+
+        try:
+            if conn is not None and not self._is_healthy(conn, idle_since):
+                # Сервер перезапускался или соединение оборвано — переподключаемся
+                self._close_quietly(conn)
+                with self._cond:
+                    self.metrics['reconnects'] += 1
+                self._log('reconnect')
+                conn = None
+            if conn is None:
+                try:
+                    conn = self._connect()
+                except psycopg2.OperationalError:
+                    # Сервер мог ещё не закончить перезапуск — одна повторная попытка
+                    self._log('connect_retry')
+                    conn = self._connect()
+        except Exception:
+            with self._cond:
+                self._in_use -= 1
+                self._cond.notify()
+            raise
+        return conn
+
+    def putconn(self, conn):
+        """Возврат подключения в пул; сломанные соединения закрываются, открытые транзакции откатываются"""
+        discard = conn.closed != 0
+        if not discard:
+            try:
+                if conn.info.transaction_status != extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+            except psycopg2.Error:
+                discard = True
+        with self._cond:
+            self._in_use -= 1
+            if discard:
+                self.metrics['discarded'] += 1
+                # Оборванное подключение — признак перезапуска сервера: остальные проверяются запросом
+                self._idle = [(idle, 0.0) for idle, _ in self._idle]
+            else:
+                self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+        if discard:
+            self._close_quietly(conn)
+            self._log('discard')
+
+    def stats(self) -> dict:
+        """Снимок метрик пула"""
+        connects = self.metrics['connects']
+        return {
+            'inUse': self._in_use,
+            'idle': len(self._idle),
+            'maxSize': self.max_size,
+            **self.metrics,
+            'connectMsAvg': round(self.metrics['connectMsTotal'] / connects, 2) if connects else 0.0
+        }
+
+    @staticmethod
+    def _close_quietly(conn):
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+
+
+pool = ConnectionPool(POOL_MAX_SIZE, POOL_WAIT_TIMEOUT, POOL_CHECK_INTERVAL)
+
+
+def get_db_connection():
+    """Получение подключения из пула"""
+    return pool.getconn()
+
+
+def release_db_connection(conn):
+    """Возврат подключения в пул"""
+    pool.putconn(conn)
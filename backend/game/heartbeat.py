@@ -0,0 +1,158 @@
+"""Буферизация heartbeat-запросов /update-time с пакетной записью в БД"""
+import atexit
+import json
+import os
+import threading
+import time
+from psycopg2.extras import RealDictCursor
+from db import get_db_connection, release_db_connection
+from presence import touch_many
+import queries
+import rules
+import streaks
+
+# Минуты копятся и пишутся раз в интервал фоновым сбросом; 0 — каждый heartbeat записывается сразу
+FLUSH_INTERVAL = float(os.environ.get('HEARTBEAT_FLUSH_INTERVAL', '10'))
+FLUSH_MAX_USERS = int(os.environ.get('HEARTBEAT_FLUSH_MAX_USERS', '500'))
+# Недоставленные уведомления о заданиях старше срока удаляются при сбросе
+NOTICE_TTL_HOURS = int(os.environ.get('HEARTBEAT_NOTICE_TTL_HOURS', '24'))
+
+
+class HeartbeatBuffer:
+    """Накопитель минут по пользователям до следующего сброса"""
+
+    def __init__(self, flush_interval: float, max_users: int):
+        self.flush_interval = flush_interval
+        self.max_users = max_users
+        self._pending = {}
+        self._oldest = None
+        self._lock = threading.Lock()
+
+    def add(self, user_id: int, minutes: int):
+        """Добавить минуты пользователя в буфер"""
+        with self._lock:
+            self._pending[user_id] = self._pending.get(user_id, 0) + minutes
+            if self._oldest is None:
+                self._oldest = time.monotonic()
+
+    def due(self) -> bool:
+        """Пора ли сбрасывать буфер"""
+        with self._lock:
+            if not self._pending:
+                return False
+            return (len(self._pending) >= self.max_users
+                    or time.monotonic() - self._oldest >= self.flush_interval)
+
+    def drain(self) -> dict:
+        """Забрать накопленные минуты"""
+        with self._lock:
+            pending, self._pending, self._oldest = self._pending, {}, None
+            return pending
+
+    def restore(self, pending: dict):
+        """Вернуть минуты в буфер после неудачной записи"""
+        with self._lock:
+            for user_id, minutes in pending.items():
+                self._pending[user_id] = self._pending.get(user_id, 0) + minutes
+            if self._pending and self._oldest is None:
+                self._oldest = time.monotonic()
+
+    def empty(self) -> bool:
+        """Пуст ли буфер"""
+        with self._lock:
+            return not self._pending
+
+    def pending(self, user_id: int) -> int:
+        """Ещё не записанные минуты пользователя"""
+        with self._lock:
+            return self._pending.get(user_id, 0)
+
+
+def flush(cur, pending: dict):
+    """Записать минуты нескольких пользователей набором множественных запросов.
+
+    Пользователи идут по возрастанию id: параллельные сбросы разных экземпляров
+    блокируют строки users в одном порядке и не ловят взаимоблокировку.
+    Завершённые задания становятся уведомлениями в task_notices.
+    """
+    user_ids = sorted(pending)
+    queries.execute(cur, 'add_time_spent', (user_ids, [pending[uid] for uid in user_ids]))
+    time_spent = {r['id']: r['time_spent'] for r in cur.fetchall()}
+    if not time_spent:
+        return
+    user_ids = sorted(time_spent)
+    touch_many(cur, user_ids)
+
+    # Пересечённые пороги заданий на время и серию посещений, завершение и награды одним проходом
+    changes = {uid: {'time': (time_spent[uid] - pending[uid], time_spent[uid])} for uid in user_ids}
+    for uid, visit in streaks.visit_changes(streaks.record_visits(cur, user_ids)).items():
+        changes[uid].update(visit)
+    completed = rules.evaluate(cur, changes)
+
+    notices = [(uid, t['name'], t['reward']) for uid in sorted(completed) for t in completed[uid]]
+    if notices:
+        queries.execute(cur, 'insert_notices', tuple(list(column) for column in zip(*notices)))
+    cur.execute(
+        "DELETE FROM task_notices WHERE created_at < LOCALTIMESTAMP - make_interval(hours => %s)",
+        (NOTICE_TTL_HOURS,)
+    )
+
+
+def flush_buffer(conn, cur):
+    """Сбросить буфер в транзакции conn; при ошибке минуты возвращаются в буфер"""
+    pending = buffer.drain()
+    if not pending:
+        return
+    try:
+        flush(cur, pending)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        buffer.restore(pending)
+        raise
+
+
+def _flush_now():
+    """Сброс на собственном подключении из пула — для таймера и остановки экземпляра"""
+    if buffer.empty():
+        return
+    conn = None
+    try:
+        conn = get_db_connection()
+        cur = conn.cursor(cursor_factory=RealDictCursor)
+        flush_buffer(conn, cur)
+        cur.close()
+    except Exception as e:
+        print(json.dumps({'heartbeat': 'flush_failed', 'error': str(e)}))
+    finally:
+        if conn is not None:
+            release_db_connection(conn)
+
+
+class FlushTimer:
+    """Фоновый поток, сбрасывающий буфер раз в интервал, даже если heartbeat больше не приходят"""
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def ensure_started(self):
+        """Запустить поток при первом буферизованном heartbeat"""
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='heartbeat-flush', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            if buffer.due():
+                _flush_now()
+
+
+buffer = HeartbeatBuffer(FLUSH_INTERVAL, FLUSH_MAX_USERS)
+timer = FlushTimer(FLUSH_INTERVAL)
+
+# Перед остановкой экземпляра накопленные минуты записываются
+atexit.register(_flush_now)
@@ -1,13 +1,83 @@
 """API для работы с титулами, заданиями и игровыми действиями"""
 import json
 import os
-import psycopg2
 from psycopg2.extras import RealDictCursor
+from db import get_db_connection, release_db_connection
+from catalog import get_catalog, make_etag, etag_matches
+import heartbeat
+import queries
+import rules
+from session import authenticate
+from tracing import traced
+from admission import limit_writes, allow, too_many_requests
+from response import json_response
 
-def get_db_connection():
-    """Создание подключения к базе данных"""
-    return psycopg2.connect(os.environ['DATABASE_URL'])
+# Ответы с ETag браузер обязан перепроверять, а клиенту нужен доступ к заголовку
+CACHE_HEADERS = {
+    'Cache-Control': 'private, no-cache',
+    'Access-Control-Allow-Origin': '*',
+    'Access-Control-Expose-Headers': 'ETag'
+}
 
+# Коды отказа purchase_title -> HTTP-статус и сообщение
+PURCHASE_ERRORS = {
+    'already_owned': (400, 'Уже куплен'),
+    'title_not_found': (404, 'Титул не найден'),
+    'user_not_found': (404, 'User not found'),
+    'insufficient_funds': (400, 'Недостаточно ТитулКоинов')
+}
+
+# Предел событий в одном запросе /action
+ACTION_BATCH_MAX = int(os.environ.get('ACTION_BATCH_MAX', '100'))
+# Допустимые значения value одного события и minutes одного heartbeat; клиент дробит
+# накопленные суммы на события не больше ACTION_VALUE_MAX и пачки не длиннее ACTION_BATCH_MAX
+ACTION_VALUE_MAX = int(os.environ.get('ACTION_VALUE_MAX', '10'))
+HEARTBEAT_MAX_MINUTES = int(os.environ.get('HEARTBEAT_MAX_MINUTES', '5'))
+
+def is_count(value, upper: int) -> bool:
+    """Целое от 1 до upper включительно (bool не считается числом)"""
+    return isinstance(value, int) and not isinstance(value, bool) and 1 <= value <= upper
+
+def aggregate_actions(events) -> dict:
+    """Суммы value по типам действий из rules.ACTION_TYPES; None, если пачка некорректна"""
+    if not isinstance(events, list) or len(events) > ACTION_BATCH_MAX:
+        return None
+    totals = {}
+    for e in events:
+        if not isinstance(e, dict):
+            return None
+        action_type, value = e.get('actionType'), e.get('value', 1)
+        if not isinstance(action_type, str) or action_type not in rules.ACTION_TYPES or not is_count(value, ACTION_VALUE_MAX):
+            return None
+        # Сумма пачки ограничена ACTION_BATCH_MAX * ACTION_VALUE_MAX, частоту пачек держит корзина action
+        totals[action_type] = totals.get(action_type, 0) + value
+    return totals
+
+# Страница чата в /bootstrap, как по умолчанию в функции чата
+BOOTSTRAP_CHAT_PAGE = int(os.environ.get('BOOTSTRAP_CHAT_PAGE', '50'))
+
+def titles_payload(catalog, owned: set) -> list:
+    """Титулы каталога с признаком покупки"""
+    return [{**t, 'owned': t['id'] in owned} for t in catalog.titles]
+
+def tasks_payload(catalog, progress: dict) -> list:
+    """Задания каталога с прогрессом пользователя"""
+    return [{
+        **t,
+        'progress': progress.get(t['id'], (0, False))[0],
+        'completed': progress.get(t['id'], (0, False))[1]
+    } for t in catalog.tasks]
+
+def not_modified(etag: str) -> dict:
+    """Ответ 304 без тела"""
+    return {
+        'statusCode': 304,
+        'headers': {**CACHE_HEADERS, 'ETag': etag},
+        'body': ''
+    }
+
+@traced
+@limit_writes
 def handler(event: dict, context) -> dict:
     """Обработчик игровых API запросов"""
     
@@ -18,11 +88,13 @@ def handler(event: dict, context) -> dict:
             'headers': {
                 'Access-Control-Allow-Origin': '*',
                 'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type'
+                'Access-Control-Allow-Headers': 'Content-Type, Authorization, If-None-Match',
+                'Access-Control-Max-Age': '86400'
             },
             'body': ''
         }
     
+    conn = None
     try:
         method = event.get('httpMethod', 'GET')
         path = event.get('path', '/')
@@ -32,28 +104,32 @@ def handler(event: dict, context) -> dict:
         conn = get_db_connection()
         cur = conn.cursor(cursor_factory=RealDictCursor)
         
-        user_id = query.get('userId') or body.get('userId')
+        session = authenticate(event, cur)
         
-        if not user_id:
+        if not session:
             cur.close()
-            conn.close()
             return {
-                'statusCode': 400,
+                'statusCode': 401,
                 'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'error': 'userId required'})
+                'body': json.dumps({'error': 'Требуется вход'})
             }
         
+        user_id = session['uid']
+        
         # Получить профиль пользователя
         if path == '/profile' and method == 'GET':
             cur.execute("""
-                SELECT id, username, coins, is_guest, is_admin, time_spent, created_at, last_active
-                FROM users WHERE id = %s
+                SELECT u.id, u.username, u.coins, u.is_guest, u.is_admin, u.time_spent, u.created_at, u.last_active,
+                       COALESCE(current_streak(s.streak_start, s.last_day), 0) AS current_streak,
+                       COALESCE(s.longest, 0) AS longest_streak
+                FROM users u
+                LEFT JOIN user_streaks s ON s.user_id = u.id
+                WHERE u.id = %s
             """, (user_id,))
             user = cur.fetchone()
             
             if not user:
                 cur.close()
-                conn.close()
                 return {
                     'statusCode': 404,
                     'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
@@ -61,7 +137,6 @@ def handler(event: dict, context) -> dict:
                 }
             
             cur.close()
-            conn.close()
             
             return {
                 'statusCode': 200,
@@ -73,6 +148,8 @@ def handler(event: dict, context) -> dict:
                     'isGuest': user['is_guest'],
                     'isAdmin': user['is_admin'],
                     'timeSpent': user['time_spent'],
+                    'currentStreak': user['current_streak'],
+                    'longestStreak': user['longest_streak'],
                     'createdAt': user['created_at'].isoformat() if user['created_at'] else None,
                     'lastActive': user['last_active'].isoformat() if user['last_active'] else None
                 })
@@ -80,22 +157,92 @@ def handler(event: dict, context) -> dict:
         
         # Получить все титулы с информацией о покупке
         elif path == '/titles' and method == 'GET':
+            catalog = get_catalog(cur)
+            cur.execute("SELECT title_id FROM user_titles WHERE user_id = %s", (user_id,))
+            owned = {r['title_id'] for r in cur.fetchall()}
+            
+            cur.close()
+            
+            etag = make_etag(catalog, 'titles', sorted(owned))
+            if etag_matches(event, etag):
+                return not_modified(etag)
+            
+            return json_response(event, 200, titles_payload(catalog, owned), {**CACHE_HEADERS, 'ETag': etag})
+        
+        # Всё для первой загрузки страницы одним запросом к БД; неизменённые по If-None-Match разделы опускаются
+        elif path == '/bootstrap' and method == 'GET':
+            catalog = get_catalog(cur)
             cur.execute("""
-                SELECT t.id, t.name, t.description, t.price, t.sort_order,
-                       EXISTS(SELECT 1 FROM user_titles WHERE user_id = %s AND title_id = t.id) as owned
-                FROM titles t
-                ORDER BY t.sort_order
-            """, (user_id,))
-            titles = cur.fetchall()
+                SELECT
+                    (SELECT json_build_object(
+                        'id', u.id, 'username', u.username, 'coins', u.coins, 'isGuest', u.is_guest,
+                        'isAdmin', u.is_admin, 'timeSpent', u.time_spent,
+                        'currentStreak', COALESCE(current_streak(s.streak_start, s.last_day), 0),
+                        'longestStreak', COALESCE(s.longest, 0),
+                        'createdAt', u.created_at, 'lastActive', u.last_active
+                     ) FROM users u LEFT JOIN user_streaks s ON s.user_id = u.id
+                     WHERE u.id = %(uid)s) AS profile,
+                    (SELECT COALESCE(json_agg(title_id ORDER BY title_id), '[]')
+                     FROM user_titles WHERE user_id = %(uid)s) AS owned,
+                    (SELECT COALESCE(json_agg(json_build_array(task_id, progress, completed) ORDER BY task_id), '[]')
+                     FROM user_tasks WHERE user_id = %(uid)s) AS progress,
+                    (SELECT json_build_object(
+                        'time', u.time_spent, 'coins', u.coins, 'chat', c.messages_sent,
+                        'purchase', c.titles_owned, 'complete', c.tasks_completed,
+                        'visit', (SELECT current_streak(streak_start, last_day)
+                                  FROM user_streaks WHERE user_id = u.id),
+                        'daily_earnings', daily_earnings(u.id, %(window)s),
+                        'generic', (SELECT json_object_agg(task_type, value)
+                                    FROM user_task_counters WHERE user_id = u.id)
+                     ) FROM users u LEFT JOIN user_counters c ON c.user_id = u.id
+                     WHERE u.id = %(uid)s) AS counters,
+                    (SELECT COALESCE(json_agg(json_build_object(
+                        'id', m.id, 'userId', m.user_id, 'username', m.username, 'message', m.message,
+                        'isAdmin', m.author_is_admin, 'title', m.author_title, 'createdAt', m.created_at
+                     ) ORDER BY m.id), '[]')
+                     FROM (
+                        SELECT id, user_id, username, message, created_at, author_is_admin, author_title
+                        FROM chat_messages
+                        ORDER BY id DESC
+                        LIMIT %(chat_limit)s
+                     ) m) AS chat
+            """, {'uid': user_id, 'chat_limit': BOOTSTRAP_CHAT_PAGE, 'window': rules.EARNINGS_WINDOW})
+            state = cur.fetchone()
             
             cur.close()
-            conn.close()
             
-            return {
-                'statusCode': 200,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps([dict(t) for t in titles])
+            if not state['profile']:
+                return {
+                    'statusCode': 404,
+                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'body': json.dumps({'error': 'User not found'})
+                }
+            
+            owned = set(state['owned'])
+            rows = {task_id: (value or 0, done or False) for task_id, value, done in state['progress']}
+            progress = rules.task_progress(catalog.tasks, rows, rules.counter_values(state['counters']))
+            chat = state['chat']
+            
+            sections = {
+                'profile': (make_etag(catalog, 'profile', state['profile']), lambda: state['profile']),
+                'titles': (make_etag(catalog, 'titles', sorted(owned)), lambda: titles_payload(catalog, owned)),
+                'tasks': (make_etag(catalog, 'tasks', sorted(progress.items())), lambda: tasks_payload(catalog, progress)),
+                'chat': (make_etag(catalog, 'chat', chat[-1]['id'] if chat else 0), lambda: chat)
+            }
+            etags = {name: etag for name, (etag, _) in sections.items()}
+            
+            # Общий ETag — для 304, когда не изменилось ничего
+            etag = make_etag(catalog, 'bootstrap', etags)
+            if etag_matches(event, etag):
+                return not_modified(etag)
+            
+            payload = {
+                name: None if etag_matches(event, section_etag) else build()
+                for name, (section_etag, build) in sections.items()
             }
+            payload['etags'] = etags
+            
+            return json_response(event, 200, payload, {**CACHE_HEADERS, 'ETag': etag})
         
         # Купить титул
         elif path == '/buy-title' and method == 'POST':
@@ -103,228 +250,163 @@ def handler(event: dict, context) -> dict:
             
             if not title_id:
                 cur.close()
-                conn.close()
                 return {
                     'statusCode': 400,
                     'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
                     'body': json.dumps({'error': 'titleId required'})
                 }
             
-            # Проверка, куплен ли уже
-            cur.execute("SELECT 1 FROM user_titles WHERE user_id = %s AND title_id = %s", (user_id, title_id))
-            if cur.fetchone():
+            if not allow(cur, user_id, 'purchase'):
+                conn.commit()
                 cur.close()
-                conn.close()
-                return {
-                    'statusCode': 400,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'error': 'Уже куплен'})
-                }
-            
-            # Получение цены
-            cur.execute("SELECT price, name FROM titles WHERE id = %s", (title_id,))
-            title = cur.fetchone()
-            
-            if not title:
-                cur.close()
-                conn.close()
-                return {
-                    'statusCode': 404,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'error': 'Титул не найден'})
-                }
+                return too_many_requests()
+            
+            # Вся покупка — один вызов хранимой функции с блокировкой баланса
+            cur.execute("SELECT * FROM purchase_title(%s, %s)", (user_id, title_id))
+            purchase = cur.fetchone()
+            
+            completed_tasks = []
+            new_coins = purchase['new_coins']
+            if purchase['result'] == 'ok':
+                # Счётчик включает стартовый титул, порог которого при регистрации не проверялся,
+                # поэтому проверяются все пороги до числа титулов; завершённые пропускает complete_tasks
+                completed_tasks = rules.evaluate(cur, {user_id: {
+                    'purchase': (None, purchase['titles_owned']),
+                    ('special_purchase', int(title_id)): (0, 1)
+                }}).get(user_id, [])
+                new_coins += sum(t['reward'] for t in completed_tasks)
+            conn.commit()
             
-            # Проверка баланса
-            cur.execute("SELECT coins FROM users WHERE id = %s", (user_id,))
-            user = cur.fetchone()
+            cur.close()
             
-            if user['coins'] < title['price']:
-                cur.close()
-                conn.close()
+            if purchase['result'] != 'ok':
+                status, error = PURCHASE_ERRORS[purchase['result']]
                 return {
-                    'statusCode': 400,
+                    'statusCode': status,
                     'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'error': 'Недостаточно ТитулКоинов'})
+                    'body': json.dumps({'error': error})
                 }
             
-            # Покупка
-            cur.execute("UPDATE users SET coins = coins - %s WHERE id = %s", (title['price'], user_id))
-            cur.execute("INSERT INTO user_titles (user_id, title_id) VALUES (%s, %s)", (user_id, title_id))
-            cur.execute(
-                "INSERT INTO coin_transactions (user_id, amount, transaction_type, description) VALUES (%s, %s, 'purchase', %s)",
-                (user_id, -title['price'], f"Покупка титула {title['name']}")
-            )
-            
-            # Обновление прогресса заданий на покупку
-            cur.execute("""
-                UPDATE user_tasks SET progress = (
-                    SELECT COUNT(*) FROM user_titles WHERE user_id = %s
-                )
-                WHERE user_id = %s AND task_id IN (
-                    SELECT id FROM tasks WHERE task_type = 'purchase'
-                )
-            """, (user_id, user_id))
-            
-            # Проверка завершения заданий
-            cur.execute("""
-                UPDATE user_tasks 
-                SET completed = TRUE, completed_at = CURRENT_TIMESTAMP
-                WHERE user_id = %s AND completed = FALSE AND progress >= (
-                    SELECT max_progress FROM tasks WHERE tasks.id = user_tasks.task_id
-                )
-            """, (user_id,))
-            
-            conn.commit()
-            
-            # Получение нового баланса
-            cur.execute("SELECT coins FROM users WHERE id = %s", (user_id,))
-            new_coins = cur.fetchone()['coins']
-            
-            cur.close()
-            conn.close()
-            
             return {
                 'statusCode': 200,
                 'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
                 'body': json.dumps({
                     'success': True,
                     'coins': new_coins,
-                    'message': f'Титул {title["name"]} куплен!'
+                    'message': f'Титул {purchase["title_name"]} куплен!',
+                    'completedTasks': completed_tasks
                 })
             }
         
         # Получить задания с прогрессом
         elif path == '/tasks' and method == 'GET':
-            cur.execute("""
-                SELECT t.id, t.name, t.description, t.task_type, t.reward, t.max_progress, t.sort_order,
-                       COALESCE(ut.progress, 0) as progress,
-                       COALESCE(ut.completed, FALSE) as completed
-                FROM tasks t
-                LEFT JOIN user_tasks ut ON t.id = ut.task_id AND ut.user_id = %s
-                ORDER BY t.sort_order
-            """, (user_id,))
-            tasks = cur.fetchall()
+            catalog = get_catalog(cur)
+            cur.execute("SELECT task_id, progress, completed FROM user_tasks WHERE user_id = %s", (user_id,))
+            rows = {r['task_id']: (r['progress'] or 0, r['completed'] or False) for r in cur.fetchall()}
+            queries.execute(cur, 'task_state', (user_id, rules.EARNINGS_WINDOW))
+            state = cur.fetchone()
             
             cur.close()
-            conn.close()
             
-            return {
-                'statusCode': 200,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps([dict(t) for t in tasks])
-            }
+            if not state:
+                return {
+                    'statusCode': 404,
+                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'body': json.dumps({'error': 'User not found'})
+                }
+            
+            progress = rules.task_progress(catalog.tasks, rows, rules.counter_values(state))
+            
+            etag = make_etag(catalog, 'tasks', sorted(progress.items()))
+            if etag_matches(event, etag):
+                return not_modified(etag)
+            
+            return json_response(event, 200, tasks_payload(catalog, progress), {**CACHE_HEADERS, 'ETag': etag})
         
         # Обновить прогресс времени
         elif path == '/update-time' and method == 'POST':
             minutes = body.get('minutes', 0)
             
-            cur.execute("UPDATE users SET time_spent = time_spent + %s WHERE id = %s", (minutes, user_id))
+            if not is_count(minutes, HEARTBEAT_MAX_MINUTES):
+                cur.close()
+                return {
+                    'statusCode': 400,
+                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'body': json.dumps({'error': f'minutes должно быть от 1 до {HEARTBEAT_MAX_MINUTES}'})
+                }
             
-            # Обновление прогресса заданий на время
-            cur.execute("""
-                UPDATE user_tasks SET progress = (
-                    SELECT time_spent FROM users WHERE id = %s
-                )
-                WHERE user_id = %s AND task_id IN (
-                    SELECT id FROM tasks WHERE task_type = 'time'
-                ) AND completed = FALSE
-            """, (user_id, user_id))
-            
-            # Проверка завершения и начисление монет
-            cur.execute("""
-                SELECT ut.id, t.reward, t.name
-                FROM user_tasks ut
-                JOIN tasks t ON ut.task_id = t.id
-                WHERE ut.user_id = %s AND ut.completed = FALSE AND ut.progress >= t.max_progress
-            """, (user_id,))
+            if not allow(cur, user_id, 'heartbeat'):
+                conn.commit()
+                cur.close()
+                return too_many_requests()
             
-            completed_tasks = cur.fetchall()
-            total_reward = sum(t['reward'] for t in completed_tasks)
-            
-            if completed_tasks:
-                cur.execute("""
-                    UPDATE user_tasks 
-                    SET completed = TRUE, completed_at = CURRENT_TIMESTAMP
-                    WHERE user_id = %s AND completed = FALSE AND progress >= (
-                        SELECT max_progress FROM tasks WHERE tasks.id = user_tasks.task_id
-                    )
-                """, (user_id,))
-                
-                cur.execute("UPDATE users SET coins = coins + %s WHERE id = %s", (total_reward, user_id))
-                
-                for task in completed_tasks:
-                    cur.execute(
-                        "INSERT INTO coin_transactions (user_id, amount, transaction_type, description) VALUES (%s, %s, 'task_reward', %s)",
-                        (user_id, task['reward'], f"Награда за: {task['name']}")
-                    )
+            heartbeat.buffer.add(int(user_id), minutes)
             
-            conn.commit()
+            # Сбрасываем накопленные минуты всех пользователей экземпляра одним пакетом;
+            # иначе их запишет фоновый сброс по истечении интервала
+            if heartbeat.buffer.due():
+                heartbeat.flush_buffer(conn, cur)
+            else:
+                heartbeat.timer.ensure_started()
             
-            cur.execute("SELECT coins, time_spent FROM users WHERE id = %s", (user_id,))
-            user = cur.fetchone()
+            # Баланс, время и задания, завершённые любым экземпляром с прошлого heartbeat
+            queries.execute(cur, 'take_heartbeat', (user_id,))
+            result = cur.fetchone()
+            conn.commit()
             
             cur.close()
-            conn.close()
+            
+            if not result:
+                return {
+                    'statusCode': 404,
+                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'body': json.dumps({'error': 'User not found'})
+                }
             
             return {
                 'statusCode': 200,
                 'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
                 'body': json.dumps({
                     'success': True,
-                    'coins': user['coins'],
-                    'timeSpent': user['time_spent'],
-                    'completedTasks': [{'name': t['name'], 'reward': t['reward']} for t in completed_tasks]
+                    'coins': result['coins'],
+                    'timeSpent': result['time_spent'] + heartbeat.buffer.pending(int(user_id)),
+                    'completedTasks': result['completed']
                 })
             }
         
-        # Выполнить действие (открыть вкладку, и т.д.)
+        # Выполнить действия (открыть вкладку, и т.д.): одно событие или пачка событий
         elif path == '/action' and method == 'POST':
-            action_type = body.get('actionType')
-            value = body.get('value', 1)
+            events = body.get('events')
+            if events is None:
+                events = [{'actionType': body.get('actionType'), 'value': body.get('value', 1)}]
             
-            cur.execute("""
-                UPDATE user_tasks 
-                SET progress = progress + %s
-                WHERE user_id = %s AND task_id IN (
-                    SELECT id FROM tasks WHERE task_type = %s
-                ) AND completed = FALSE
-            """, (value, user_id, action_type))
-            
-            # Проверка завершения
-            cur.execute("""
-                SELECT ut.id, t.reward, t.name
-                FROM user_tasks ut
-                JOIN tasks t ON ut.task_id = t.id
-                WHERE ut.user_id = %s AND ut.completed = FALSE AND ut.progress >= t.max_progress
-            """, (user_id,))
+            totals = aggregate_actions(events)
+            if totals is None:
+                cur.close()
+                return {
+                    'statusCode': 400,
+                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'body': json.dumps({'error': 'Некорректные события'})
+                }
+            
+            if not allow(cur, user_id, 'action'):
+                conn.commit()
+                cur.close()
+                return too_many_requests()
             
-            completed_tasks = cur.fetchall()
-            total_reward = sum(t['reward'] for t in completed_tasks)
-            
-            if completed_tasks:
-                cur.execute("""
-                    UPDATE user_tasks 
-                    SET completed = TRUE, completed_at = CURRENT_TIMESTAMP
-                    WHERE user_id = %s AND completed = FALSE AND progress >= (
-                        SELECT max_progress FROM tasks WHERE tasks.id = user_tasks.task_id
-                    )
-                """, (user_id,))
-                
-                cur.execute("UPDATE users SET coins = coins + %s WHERE id = %s", (total_reward, user_id))
-                
-                for task in completed_tasks:
-                    cur.execute(
-                        "INSERT INTO coin_transactions (user_id, amount, transaction_type, description) VALUES (%s, %s, 'task_reward', %s)",
-                        (user_id, task['reward'], f"Награда за: {task['name']}")
-                    )
+            completed_tasks = []
+            if totals:
+                # Счётчики типов растут одним upsert, завершаются только пересечённые пороги
+                queries.execute(cur, 'add_type_counters', (user_id, list(totals), list(totals.values())))
+                changes = {r['task_type']: (r['value'] - totals[r['task_type']], r['value']) for r in cur.fetchall()}
+                completed_tasks = rules.evaluate(cur, {user_id: changes}).get(user_id, [])
             
             conn.commit()
             
-            cur.execute("SELECT coins FROM users WHERE id = %s", (user_id,))
+            queries.execute(cur, 'user_coins', (user_id,))
             new_coins = cur.fetchone()['coins']
             
             cur.close()
-            conn.close()
             
             return {
                 'statusCode': 200,
@@ -338,7 +420,6 @@ def handler(event: dict, context) -> dict:
         
         else:
             cur.close()
-            conn.close()
             return {
                 'statusCode': 404,
                 'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
@@ -350,4 +431,8 @@ def handler(event: dict, context) -> dict:
             'statusCode': 500,
             'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
             'body': json.dumps({'error': str(e)})
-        }
\ No newline at end of file
+        }
+    
+    finally:
+        if conn is not None:
+            release_db_connection(conn)
@@ -0,0 +1,41 @@
+"""Учёт присутствия онлайн в нежурналируемой таблице presence с истечением по времени"""
+import os
+import time
+from psycopg2.extras import execute_values
+
+PRESENCE_TTL_MINUTES = int(os.environ.get('PRESENCE_TTL_MINUTES', '5'))
+# Повторная отметка чаще этого интервала не пишется, чтобы не плодить версии строк
+PRESENCE_TOUCH_SECONDS = int(os.environ.get('PRESENCE_TOUCH_SECONDS', '30'))
+PRESENCE_PURGE_INTERVAL = float(os.environ.get('PRESENCE_PURGE_INTERVAL', '60'))
+
+_last_purge = 0.0
+
+
+def touch(cur, user_id):
+    """Отметить пользователя онлайн"""
+    touch_many(cur, [user_id])
+
+
+def touch_many(cur, user_ids: list):
+    """Отметить онлайн нескольких пользователей одним запросом"""
+    if not user_ids:
+        return
+    execute_values(cur, """
+        INSERT INTO presence (user_id, last_seen)
+        SELECT v.user_id, CURRENT_TIMESTAMP FROM (VALUES %s) AS v(user_id)
+        ON CONFLICT (user_id) DO UPDATE
+        SET last_seen = EXCLUDED.last_seen
+        WHERE presence.last_seen < EXCLUDED.last_seen - make_interval(secs => {touch})
+    """.format(touch=PRESENCE_TOUCH_SECONDS), [(u,) for u in sorted({int(u) for u in user_ids})], template='(%s::int)')
+
+
+def purge_expired(cur):
+    """Удалить истёкшие отметки не чаще раза в PRESENCE_PURGE_INTERVAL на экземпляр"""
+    global _last_purge
+    if time.monotonic() - _last_purge < PRESENCE_PURGE_INTERVAL:
+        return
+    _last_purge = time.monotonic()
+    cur.execute(
+        "DELETE FROM presence WHERE last_seen < NOW() - make_interval(mins => %s)",
+        (PRESENCE_TTL_MINUTES,)
+    )
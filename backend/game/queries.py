@@ -0,0 +1,138 @@
+"""Горячие запросы как серверные подготовленные операторы"""
+import threading
+import weakref
+
+# Имя -> (типы параметров, текст оператора)
+STATEMENTS = {
+    'user_coins': ('int', """
+        SELECT coins FROM users WHERE id = $1
+    """),
+    'add_time_spent': ('int[], int[]', """
+        UPDATE users u SET time_spent = u.time_spent + v.minutes
+        FROM unnest($1, $2) AS v(user_id, minutes)
+        WHERE u.id = v.user_id
+        RETURNING u.id, u.time_spent
+    """),
+    'task_state': ('int, text', """
+        SELECT u.time_spent AS time, u.coins,
+               COALESCE(c.messages_sent, 0) AS chat,
+               COALESCE(c.titles_owned, 0) AS purchase,
+               COALESCE(c.tasks_completed, 0) AS complete,
+               COALESCE(current_streak(s.streak_start, s.last_day), 0) AS visit,
+               daily_earnings(u.id, $2) AS daily_earnings,
+               (SELECT json_object_agg(task_type, value) FROM user_task_counters WHERE user_id = u.id) AS generic
+        FROM users u
+        LEFT JOIN user_counters c ON c.user_id = u.id
+        LEFT JOIN user_streaks s ON s.user_id = u.id
+        WHERE u.id = $1
+    """),
+    'add_type_counters': ('int, text[], int[]', """
+        INSERT INTO user_task_counters AS c (user_id, task_type, value)
+        SELECT $1, v.task_type, v.amount
+        FROM unnest($2, $3) AS v(task_type, amount)
+        ON CONFLICT (user_id, task_type) DO UPDATE
+        SET value = c.value + EXCLUDED.value, updated_at = CURRENT_TIMESTAMP
+        RETURNING c.task_type, c.value
+    """),
+    'complete_tasks': ('int[], int[], int[]', """
+        INSERT INTO user_tasks AS ut (user_id, task_id, progress, completed, completed_at)
+        SELECT v.user_id, v.task_id, v.progress, TRUE, CURRENT_TIMESTAMP
+        FROM unnest($1, $2, $3) AS v(user_id, task_id, progress)
+        ON CONFLICT (user_id, task_id) DO UPDATE
+        SET progress = EXCLUDED.progress, completed = TRUE, completed_at = EXCLUDED.completed_at
+        WHERE ut.completed = FALSE
+        RETURNING ut.user_id, ut.task_id
+    """),
+    'add_coins': ('int[], int[]', """
+        UPDATE users u SET coins = u.coins + v.amount
+        FROM unnest($1, $2) AS v(user_id, amount)
+        WHERE u.id = v.user_id
+        RETURNING u.id, u.coins
+    """),
+    'daily_earnings': ('int[], text', """
+        SELECT v.user_id, daily_earnings(v.user_id, $2) AS earned
+        FROM unnest($1) AS v(user_id)
+    """),
+    'add_task_rewards': ('int[], int[], int[]', """
+        INSERT INTO user_counters AS c (user_id, tasks_completed, coins_earned)
+        SELECT v.user_id, v.tasks, v.coins
+        FROM unnest($1, $2, $3) AS v(user_id, tasks, coins)
+        ON CONFLICT (user_id) DO UPDATE SET
+            tasks_completed = c.tasks_completed + EXCLUDED.tasks_completed,
+            coins_earned = c.coins_earned + EXCLUDED.coins_earned,
+            updated_at = CURRENT_TIMESTAMP
+        RETURNING c.user_id, c.tasks_completed
+    """),
+    'insert_notices': ('int[], text[], int[]', """
+        INSERT INTO task_notices (user_id, name, reward)
+        SELECT * FROM unnest($1, $2, $3)
+    """),
+    'take_heartbeat': ('int', """
+        WITH delivered AS (
+            DELETE FROM task_notices WHERE user_id = $1
+            RETURNING id, name, reward
+        )
+        SELECT u.coins, u.time_spent,
+               (SELECT COALESCE(json_agg(json_build_object('name', name, 'reward', reward) ORDER BY id), '[]')
+                FROM delivered) AS completed
+        FROM users u WHERE u.id = $1
+    """),
+    'insert_task_rewards': ('int[], int[], text[]', """
+        INSERT INTO coin_transactions (user_id, amount, transaction_type, description)
+        SELECT v.user_id, v.reward, 'task_reward', 'Награда за: ' || v.name
+        FROM unnest($1, $2, $3) AS v(user_id, reward, name)
+    """),
+    'insert_message': ('int, text, text', """
+        WITH author AS (
+            SELECT COALESCE(u.is_admin, FALSE) AS is_admin, u.coins,
+                   (SELECT t.name FROM user_titles ut JOIN titles t ON t.id = ut.title_id
+                    WHERE ut.user_id = u.id ORDER BY t.price DESC, t.sort_order DESC LIMIT 1) AS title
+            FROM users u WHERE u.id = $1
+        ), inserted AS (
+            INSERT INTO chat_messages (user_id, username, message, author_is_admin, author_title)
+            SELECT $1, $2, $3, is_admin, title FROM author
+            RETURNING id, created_at, author_is_admin, author_title
+        )
+        SELECT inserted.*, author.coins FROM inserted, author
+    """),
+    'messages_after': ('int, int', """
+        SELECT id, user_id, username, message, created_at, author_is_admin, author_title
+        FROM chat_messages
+        WHERE id > $1
+        ORDER BY id
+        LIMIT $2
+    """),
+    'messages_before': ('int, int', """
+        SELECT id, user_id, username, message, created_at, author_is_admin, author_title
+        FROM chat_messages
+        WHERE id < $1
+        ORDER BY id DESC
+        LIMIT $2
+    """),
+    'messages_latest': ('int', """
+        SELECT id, user_id, username, message, created_at, author_is_admin, author_title
+        FROM chat_messages
+        ORDER BY id DESC
+        LIMIT $1
+    """),
+}
+
+# Подготовленные операторы живут в сессии БД, поэтому учитываются по подключению
+_prepared = weakref.WeakKeyDictionary()
+_lock = threading.Lock()
+
+
+def execute(cur, name: str, params: tuple = ()):
+    """EXECUTE подготовленного оператора; PREPARE — при первом использовании на подключении"""
+    conn = cur.connection
+    with _lock:
+        prepared = _prepared.setdefault(conn, set())
+    if name not in prepared:
+        types, sql = STATEMENTS[name]
+        cur.execute(f"PREPARE {name} ({types}) AS {sql}")
+        prepared.add(name)
+    if params:
+        cur.execute(f"EXECUTE {name} ({', '.join(['%s'] * len(params))})", params)
+    else:
+        cur.execute(f"EXECUTE {name}")
+
@@ -0,0 +1,92 @@
+"""Сборка JSON-ответов: кодировщики строк для кортежных курсоров, быстрый JSON и сжатие"""
+import base64
+import gzip
+import json
+import os
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESS_MIN_BYTES = int(os.environ.get('RESPONSE_COMPRESS_MIN_BYTES', '1024'))
+GZIP_LEVEL = int(os.environ.get('RESPONSE_GZIP_LEVEL', '5'))
+BROTLI_QUALITY = int(os.environ.get('RESPONSE_BROTLI_QUALITY', '4'))
+
+BASE_HEADERS = {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'}
+
+
+def iso(value):
+    """Дата в ISO 8601 или None"""
+    return value.isoformat() if value is not None else None
+
+
+def row_encoder(*columns):
+    """Кодировщик строк кортежного курсора: columns — пары (ключ JSON, преобразование или None) в порядке SELECT"""
+    keys = tuple(key for key, _ in columns)
+    converters = tuple((i, key, convert) for i, (key, convert) in enumerate(columns) if convert)
+
+    def encode(rows) -> list:
+        items = []
+        for row in rows:
+            item = dict(zip(keys, row))
+            for i, key, convert in converters:
+                item[key] = convert(row[i])
+            items.append(item)
+        return items
+
+    return encode
+
+
+def dumps(payload) -> bytes:
+    """JSON в UTF-8: orjson, если установлен, иначе компактный stdlib json"""
+    if orjson is not None:
+        return orjson.dumps(payload)
+    return json.dumps(payload, ensure_ascii=False, separators=(',', ':')).encode()
+
+
+def _accepted_encodings(event: dict) -> set:
+    headers = {k.lower(): v for k, v in (event.get('headers') or {}).items()}
+    accepted = set()
+    for part in (headers.get('accept-encoding') or '').split(','):
+        name, _, params = part.strip().partition(';')
+        if name and params.strip().replace(' ', '') not in ('q=0', 'q=0.0'):
+            accepted.add(name.lower())
+    return accepted
+
+
+def encode_body(event: dict, raw: bytes):
+    """Тело ответа и заголовки сжатия по Accept-Encoding; мелкие ответы не сжимаются"""
+    if len(raw) < COMPRESS_MIN_BYTES:
+        return {'body': raw.decode()}, {}
+    accepted = _accepted_encodings(event)
+    if brotli is not None and 'br' in accepted:
+        compressed, encoding = brotli.compress(raw, quality=BROTLI_QUALITY), 'br'
+    elif 'gzip' in accepted:
+        compressed, encoding = gzip.compress(raw, compresslevel=GZIP_LEVEL, mtime=0), 'gzip'
+    else:
+        return {'body': raw.decode()}, {'Vary': 'Accept-Encoding'}
+    return (
+        {'body': base64.b64encode(compressed).decode(), 'isBase64Encoded': True},
+        {'Content-Encoding': encoding, 'Vary': 'Accept-Encoding'}
+    )
+
+
+def json_response(event: dict, status: int, payload, headers: dict = None) -> dict:
+    """Ответ функции с JSON-телом, при необходимости сжатым"""
+    return raw_json_response(event, status, dumps(payload), headers)
+
+
+def raw_json_response(event: dict, status: int, raw: bytes, headers: dict = None) -> dict:
+    """Ответ с уже закодированным JSON-телом"""
+    body, extra = encode_body(event, raw)
+    return {
+        'statusCode': status,
+        'headers': {**BASE_HEADERS, **(headers or {}), **extra},
+        **body
+    }
@@ -0,0 +1,28 @@
+"""Серии ежедневных посещений: запись «начало серии / последний день» обновляется за O(1)"""
+
+
+def record_visits(cur, user_ids: list) -> dict:
+    """Отметить посещение сегодня; {user_id: текущая серия} для тех, у кого наступил новый день.
+
+    Повторные посещения в тот же день строку не переписывают; пропуск дня
+    начинает серию заново.
+    """
+    if not user_ids:
+        return {}
+    cur.execute("""
+        INSERT INTO user_streaks AS s (user_id, streak_start, last_day, longest)
+        SELECT v.user_id, visit_day(), visit_day(), 1 FROM unnest(%s::int[]) AS v(user_id)
+        ON CONFLICT (user_id) DO UPDATE SET
+            streak_start = CASE WHEN s.last_day = EXCLUDED.last_day - 1 THEN s.streak_start ELSE EXCLUDED.last_day END,
+            last_day = EXCLUDED.last_day,
+            longest = GREATEST(s.longest, CASE WHEN s.last_day = EXCLUDED.last_day - 1
+                                               THEN EXCLUDED.last_day - s.streak_start + 1 ELSE 1 END)
+        WHERE s.last_day < EXCLUDED.last_day
+        RETURNING s.user_id, s.last_day - s.streak_start + 1 AS streak
+    """, (sorted({int(u) for u in user_ids}),))
+    return {r['user_id']: r['streak'] for r in cur.fetchall()}
+
+
+def visit_changes(streaks: dict) -> dict:
+    """Изменения счётчика visit для движка заданий: серия выросла на день или началась заново"""
+    return {uid: {'visit': (streak - 1, streak)} for uid, streak in streaks.items()}
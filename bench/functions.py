@@ -0,0 +1,23 @@
+"""Загрузка модулей функций backend/<функция> без смешивания одноимённых копий в sys.modules"""
+import importlib
+import os
+import sys
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+
+def load_function(name: str, module: str = 'index'):
+    """Модуль функции и {имя: модуль} её собственных одноимённых модулей (db, session, rules…)"""
+    directory = os.path.abspath(os.path.join(ROOT, 'backend', name))
+    local = {f[:-3] for f in os.listdir(directory) if f.endswith('.py')}
+    saved = {m: sys.modules.pop(m) for m in local if m in sys.modules}
+    sys.path.insert(0, directory)
+    try:
+        loaded = importlib.import_module(module)
+        modules = {m: sys.modules[m] for m in local if m in sys.modules}
+    finally:
+        sys.path.remove(directory)
+        for m in local:
+            sys.modules.pop(m, None)
+        sys.modules.update(saved)
+    return loaded, modules
@@ -0,0 +1,223 @@
+"""Нагрузочный прогон функций: смеси трафика через handler() напрямую против локальной БД
+
+Запуск против локальной БД с применёнными миграциями:
+
+    DATABASE_URL=postgresql://localhost/chiken python bench/load.py --mix steady,purchase-burst --requests 2000
+
+Каждая функция backend/*/index.py импортируется со своими db.py, session.py и
+прочими модулями (одноимённые модули разных функций не смешиваются в sys.modules).
+По каждой смеси печатается JSON: p50/p95/p99, запросов в секунду, SQL-запросов
+на запрос (из заголовка Server-Timing) и открытых подключений к БД — для
+сравнения между коммитами:
+
+    python bench/load.py --output before.json && git checkout ... && python bench/load.py --output after.json
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import random
+import re
+import secrets
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import psycopg2
+
+from functions import ROOT, load_function
+
+FUNCTIONS = ('auth', 'game', 'chat', 'admin')
+START_COINS = 10 ** 9
+
+# Доля запросов в смеси; steady — 3-секундные опросы чата к минутным heartbeat
+MIXES = {
+    'steady': {'chat-poll': 20, 'heartbeat': 1, 'chat-send': 1},
+    'purchase-burst': {'purchase': 1},
+    'guest-storm': {'guest': 1},
+    'mixed': {'chat-poll': 20, 'heartbeat': 1, 'chat-send': 1, 'purchase': 2, 'guest': 1, 'bootstrap': 1, 'action': 2}
+}
+
+# Число SQL-запросов функции сообщают в заголовке Server-Timing
+QUERIES_METRIC = re.compile(r'(?:^|,\s*)queries;desc="(\d+)"')
+
+
+def queries_in(response: dict) -> int:
+    match = QUERIES_METRIC.search(response.get('headers', {}).get('Server-Timing', ''))
+    return int(match.group(1)) if match else 0
+
+
+class Bench:
+    """Функции, тестовые пользователи и генераторы событий"""
+
+    def __init__(self, users: int, threads: int):
+        self.functions = {}
+        for name in FUNCTIONS:
+            module, modules = load_function(name)
+            modules['db'].pool.max_size = threads
+            self.functions[name] = (module, modules)
+        self.issue_token = self.functions['game'][1]['session'].issue_token
+
+        conn = psycopg2.connect(os.environ['DATABASE_URL'])
+        with conn.cursor() as cur:
+            cur.execute("SELECT id FROM titles")
+            self.title_ids = [r[0] for r in cur.fetchall()]
+            cur.execute("SELECT COALESCE(MAX(id), 0) FROM chat_messages")
+            self.last_message_id = cur.fetchone()[0]
+            self.tokens = []
+            for _ in range(users):
+                username = f"bench_{secrets.token_hex(6)}"
+                cur.execute(
+                    "INSERT INTO users (username, password_hash, is_guest, coins) VALUES (%s, '', TRUE, %s) RETURNING id",
+                    (username, START_COINS)
+                )
+                self.tokens.append(self.issue_token(cur.fetchone()[0], username, True, False))
+        conn.commit()
+        conn.close()
+
+    def event(self, route: str, rng: random.Random) -> tuple:
+        """(функция, event) для маршрута смеси"""
+        auth = {'Authorization': f'Bearer {rng.choice(self.tokens)}'}
+        if route == 'chat-poll':
+            return 'chat', {'httpMethod': 'GET', 'path': '/', 'headers': {},
+                            'queryStringParameters': {'sinceId': str(self.last_message_id)}}
+        if route == 'chat-send':
+            return 'chat', {'httpMethod': 'POST', 'path': '/', 'headers': auth,
+                            'body': json.dumps({'message': f'bench {rng.random():.6f}'})}
+        if route == 'heartbeat':
+            return 'game', {'httpMethod': 'POST', 'path': '/update-time', 'headers': auth,
+                            'body': json.dumps({'minutes': 1})}
+        if route == 'purchase':
+            return 'game', {'httpMethod': 'POST', 'path': '/buy-title', 'headers': auth,
+                            'body': json.dumps({'titleId': rng.choice(self.title_ids)})}
+        if route == 'bootstrap':
+            return 'game', {'httpMethod': 'GET', 'path': '/bootstrap', 'headers': auth}
+        if route == 'action':
+            return 'game', {'httpMethod': 'POST', 'path': '/action', 'headers': auth,
+                            'body': json.dumps({'events': [{'actionType': 'action', 'value': 1}]})}
+        if route == 'guest':
+            return 'auth', {'httpMethod': 'POST', 'path': '/', 'headers': {},
+                            'body': json.dumps({'action': 'guest'})}
+        raise ValueError(route)
+
+    def call(self, route: str, rng: random.Random) -> tuple:
+        """Один вызов handler(): (статус, мс, SQL-запросов)"""
+        name, event = self.event(route, rng)
+        event.setdefault('queryStringParameters', {})
+        started = time.perf_counter()
+        response = self.functions[name][0].handler(event, None)
+        elapsed = (time.perf_counter() - started) * 1000
+        if route == 'chat-send' and response['statusCode'] == 200:
+            self.last_message_id = max(self.last_message_id, json.loads(response['body'])['message']['id'])
+        return response['statusCode'], elapsed, queries_in(response)
+
+    def connects(self) -> int:
+        return sum(modules['db'].pool.metrics['connects'] for _, modules in self.functions.values())
+
+
+def percentile(values: list, p: float) -> float:
+    ordered = sorted(values)
+    return round(ordered[min(len(ordered) - 1, int(len(ordered) * p))], 2) if ordered else 0.0
+
+
+def summarize(samples: list) -> dict:
+    latencies = [s[1] for s in samples]
+    return {
+        'count': len(samples),
+        'p50': percentile(latencies, 0.50),
+        'p95': percentile(latencies, 0.95),
+        'p99': percentile(latencies, 0.99),
+        'queriesPerRequest': round(sum(s[2] for s in samples) / len(samples), 2) if samples else 0.0
+    }
+
+
+def run_mix(bench: Bench, mix: str, requests: int, threads: int, seed: int) -> dict:
+    """Прогон смеси: requests вызовов в threads потоков"""
+    rng = random.Random(seed)
+    weights = MIXES[mix]
+    routes = rng.choices(list(weights), weights=list(weights.values()), k=requests)
+    seeds = [rng.random() for _ in routes]
+
+    samples = {route: [] for route in weights}
+    statuses = {}
+    lock = threading.Lock()
+
+    def run(job):
+        route, job_seed = job
+        status, elapsed, queries = bench.call(route, random.Random(job_seed))
+        with lock:
+            samples[route].append((status, elapsed, queries))
+            statuses[status] = statuses.get(status, 0) + 1
+
+    connects_before = bench.connects()
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        list(executor.map(run, zip(routes, seeds)))
+    elapsed = time.perf_counter() - started
+
+    every = [s for route_samples in samples.values() for s in route_samples]
+    overall = summarize(every)
+    return {
+        'requests': requests,
+        'threads': threads,
+        'seconds': round(elapsed, 3),
+        'rps': round(requests / elapsed, 1),
+        'statuses': statuses,
+        'latencyMs': {k: overall[k] for k in ('p50', 'p95', 'p99')},
+        'queriesPerRequest': overall['queriesPerRequest'],
+        'connectionsOpened': bench.connects() - connects_before,
+        'routes': {route: summarize(route_samples) for route, route_samples in samples.items() if route_samples}
+    }
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ''
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--mix', default=','.join(MIXES), help='смеси через запятую: ' + ', '.join(MIXES))
+    parser.add_argument('--requests', type=int, default=1000)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='дополнительно записать отчёт в файл')
+    parser.add_argument('--rate-limits', action='store_true',
+                        help='оставить пользовательские корзины допуска (по умолчанию отключены)')
+    args = parser.parse_args()
+
+    mixes = [m.strip() for m in args.mix.split(',') if m.strip()]
+    unknown = [m for m in mixes if m not in MIXES]
+    if unknown:
+        parser.error(f"unknown mix: {', '.join(unknown)}")
+
+    # Токены подписываются тем же секретом, которым их проверяют функции
+    os.environ.setdefault('SESSION_SECRET', secrets.token_hex(16))
+    # Прогон меряет функции, а не отказы: корзины пользователей отключены, предел параллельности
+    # допуска следует за пулом, расширенным до числа потоков
+    os.environ['ADMISSION_RATE_LIMITS'] = '1' if args.rate_limits else '0'
+
+    # JSON-логи функций (пул, гостевые аккаунты) не смешиваются с отчётом
+    with contextlib.redirect_stdout(io.StringIO()):
+        bench = Bench(args.users, args.threads)
+        results = {mix: run_mix(bench, mix, args.requests, args.threads, args.seed) for mix in mixes}
+
+    report = {'commit': git_commit(), 'mixes': results}
+    output = json.dumps(report, indent=2, ensure_ascii=False)
+    print(output)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    # 429 без --rate-limits значит, что допуск отбрасывал запросы и замеры неполны
+    failed = (500,) if args.rate_limits else (500, 429)
+    sys.exit(1 if any(r['statuses'].get(status) for r in results.values() for status in failed) else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,152 @@
+"""Нагрузочная проверка /buy-title: пропускная способность и корректность при параллельных покупателях
+
+Запуск против локальной БД с применёнными миграциями:
+
+    DATABASE_URL=postgresql://localhost/chiken python bench/purchase_concurrency.py --users 20 --threads 16
+
+Каждый пользователь получает монеты на все титулы, затем потоки одновременно
+покупают одни и те же титулы (имитация двойных кликов). В конце проверяется,
+что у каждого титул куплен ровно один раз, баланс не ушёл в минус и совпадает
+с суммой записей в coin_transactions.
+"""
+import argparse
+import json
+import os
+import random
+import secrets
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import psycopg2
+from psycopg2.extras import RealDictCursor
+
+# Токены подписываются тем же секретом, которым их проверяет функция
+os.environ.setdefault('SESSION_SECRET', secrets.token_hex(16))
+# Проверяется атомарность покупки: каждый повторный клик должен дойти до БД, а не получить 429
+os.environ['ADMISSION_RATE_LIMITS'] = '0'
+
+from functions import load_function  # noqa: E402
+
+game, modules = load_function('game')
+issue_token = modules['session'].issue_token
+
+START_COINS = 200000
+TOKENS = {}
+
+
+def create_users(conn, count: int) -> list:
+    """Тестовые пользователи с балансом на все титулы"""
+    ids = []
+    with conn.cursor() as cur:
+        for _ in range(count):
+            username = f"bench_{secrets.token_hex(6)}"
+            cur.execute(
+                "INSERT INTO users (username, password_hash, is_guest, coins) VALUES (%s, '', TRUE, %s) RETURNING id",
+                (username, START_COINS)
+            )
+            user_id = cur.fetchone()[0]
+            TOKENS[user_id] = issue_token(user_id, username, True, False)
+            ids.append(user_id)
+    conn.commit()
+    return ids
+
+
+def buy(user_id: int, title_id: int) -> tuple:
+    """Один вызов handler(); возвращает (статус, длительность в мс)"""
+    event = {
+        'httpMethod': 'POST',
+        'path': '/buy-title',
+        'headers': {'Authorization': f'Bearer {TOKENS[user_id]}'},
+        'body': json.dumps({'titleId': title_id}),
+        'queryStringParameters': {}
+    }
+    started = time.perf_counter()
+    response = game.handler(event, None)
+    return response['statusCode'], (time.perf_counter() - started) * 1000
+
+
+def check(conn, user_ids: list) -> list:
+    """Инварианты после прогона; возвращает список нарушений"""
+    problems = []
+    with conn.cursor(cursor_factory=RealDictCursor) as cur:
+        cur.execute("""
+            SELECT u.id, u.coins,
+                   (SELECT COALESCE(SUM(amount), 0) FROM coin_transactions ct WHERE ct.user_id = u.id) AS ledger,
+                   (SELECT COUNT(*) FROM user_titles ut WHERE ut.user_id = u.id) AS titles,
+                   (SELECT COUNT(DISTINCT title_id) FROM user_titles ut WHERE ut.user_id = u.id) AS distinct_titles
+            FROM users u WHERE u.id = ANY(%s)
+        """, (user_ids,))
+        for row in cur.fetchall():
+            if row['coins'] < 0:
+                problems.append(f"user {row['id']}: negative balance {row['coins']}")
+            if row['coins'] != START_COINS + row['ledger']:
+                problems.append(f"user {row['id']}: balance {row['coins']} != {START_COINS} + ledger {row['ledger']}")
+            if row['titles'] != row['distinct_titles']:
+                problems.append(f"user {row['id']}: duplicate titles")
+    return problems
+
+
+def percentile(values: list, p: float) -> float:
+    ordered = sorted(values)
+    return round(ordered[min(len(ordered) - 1, int(len(ordered) * p))], 2) if ordered else 0.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=20)
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--clicks', type=int, default=3, help='повторных покупок одного титула')
+    args = parser.parse_args()
+
+    # Пул функции рассчитан на один запрос за раз; для теста даём подключение каждому потоку
+    modules['db'].pool.max_size = args.threads
+
+    conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    with conn.cursor() as cur:
+        cur.execute("SELECT id FROM titles")
+        title_ids = [r[0] for r in cur.fetchall()]
+    user_ids = create_users(conn, args.users)
+
+    jobs = [(u, t) for u in user_ids for t in title_ids for _ in range(args.clicks)]
+    random.shuffle(jobs)
+
+    statuses = {}
+    latencies = []
+    lock = threading.Lock()
+
+    def run(job):
+        status, elapsed = buy(*job)
+        with lock:
+            statuses[status] = statuses.get(status, 0) + 1
+            latencies.append(elapsed)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.threads) as executor:
+        list(executor.map(run, jobs))
+    elapsed = time.perf_counter() - started
+
+    problems = check(conn, user_ids)
+    conn.close()
+    if statuses.get(429):
+        problems.append(f"{statuses[429]} requests rejected with 429: the race was not exercised")
+
+    print(json.dumps({
+        'requests': len(jobs),
+        'threads': args.threads,
+        'seconds': round(elapsed, 3),
+        'rps': round(len(jobs) / elapsed, 1),
+        'statuses': statuses,
+        'latencyMs': {
+            'p50': percentile(latencies, 0.50),
+            'p95': percentile(latencies, 0.95),
+            'p99': percentile(latencies, 0.99)
+        },
+        'violations': problems
+    }, indent=2, ensure_ascii=False))
+    sys.exit(1 if problems or statuses.get(500) else 0)
+
+
+if __name__ == '__main__':
+    main()
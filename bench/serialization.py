@@ -0,0 +1,128 @@
+"""Микробенчмарк сериализации ответов: прежний путь через словари и json.dumps против response.py
+
+Запуск без БД, на синтетических строках:
+
+    python bench/serialization.py --iterations 2000
+
+Для страницы чата (50 сообщений) и списка заданий (60 строк) сравниваются
+байты тела (без сжатия и на проводе с gzip/br) и процессорное время на запрос.
+Прежний путь включает построение словарей, как это делает RealDictCursor.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backend', 'chat'))
+import response  # noqa: E402
+
+MESSAGE_COLUMNS = ('id', 'user_id', 'username', 'message', 'created_at', 'is_admin')
+TASK_COLUMNS = ('id', 'name', 'description', 'task_type', 'reward', 'max_progress', 'sort_order', 'progress', 'completed')
+
+
+def chat_rows(count: int) -> list:
+    started = datetime(2026, 1, 1, 12, 0, 0)
+    return [
+        (1000 + i, 10 + i % 7, f'Гость{10 + i % 7}', f'Сообщение номер {i}: привет всем в чате!',
+         started + timedelta(seconds=i * 13, microseconds=i * 997), None if i % 5 else True)
+        for i in range(count)
+    ]
+
+
+def task_rows(count: int) -> list:
+    return [
+        (i, f'Задание {i}', f'Выполните действие {i} и получите награду', ('time', 'chat', 'purchase')[i % 3],
+         100 * i, 10 * (i + 1), i, i * 3, i % 4 == 0)
+        for i in range(count)
+    ]
+
+
+def legacy_chat(rows: list) -> str:
+    messages = [dict(zip(MESSAGE_COLUMNS, r)) for r in rows]
+    return json.dumps([{
+        'id': m['id'],
+        'userId': m['user_id'],
+        'username': m['username'],
+        'message': m['message'],
+        'isAdmin': m['is_admin'] or False,
+        'createdAt': m['created_at'].isoformat() if m['created_at'] else None
+    } for m in messages])
+
+
+def legacy_tasks(rows: list) -> str:
+    tasks = [dict(zip(TASK_COLUMNS, r)) for r in rows]
+    return json.dumps([{
+        'id': t['id'],
+        'name': t['name'],
+        'description': t['description'],
+        'taskType': t['task_type'],
+        'reward': t['reward'],
+        'maxProgress': t['max_progress'],
+        'progress': t['progress'] or 0,
+        'completed': t['completed'] or False
+    } for t in tasks])
+
+
+encode_chat = response.row_encoder(
+    ('id', None), ('userId', None), ('username', None), ('message', None),
+    ('createdAt', response.iso), ('isAdmin', bool)
+)
+encode_tasks = response.row_encoder(
+    ('id', None), ('name', None), ('description', None), ('taskType', None), ('reward', None),
+    ('maxProgress', None), ('sortOrder', None), ('progress', None), ('completed', None)
+)
+
+
+def measure(fn, iterations: int) -> tuple:
+    """Процессорное время на вызов в микросекундах и результат последнего вызова"""
+    result = fn()
+    started = time.process_time()
+    for _ in range(iterations):
+        result = fn()
+    return round((time.process_time() - started) / iterations * 1e6, 1), result
+
+
+def wire_bytes(result: dict) -> int:
+    return len(result['body'].encode())
+
+
+def compare(name: str, rows: list, legacy, encoder, iterations: int) -> dict:
+    legacy_us, legacy_body = measure(lambda: legacy(rows), iterations)
+    raw_us, raw = measure(lambda: response.dumps(encoder(rows)), iterations)
+    report = {
+        'rows': len(rows),
+        'legacy': {'cpuUs': legacy_us, 'bytes': len(legacy_body.encode())},
+        'layer': {'cpuUs': raw_us, 'bytes': len(raw)}
+    }
+    for encoding in ('gzip', 'br'):
+        if encoding == 'br' and response.brotli is None:
+            continue
+        event = {'headers': {'Accept-Encoding': encoding}}
+        us, result = measure(lambda: response.json_response(event, 200, encoder(rows)), iterations)
+        report[f'layer+{encoding}'] = {
+            'cpuUs': us,
+            'bytes': wire_bytes(result),
+            'encoding': result['headers'].get('Content-Encoding')
+        }
+    return {name: report}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--iterations', type=int, default=2000)
+    args = parser.parse_args()
+
+    report = {
+        'json': 'orjson' if response.orjson is not None else 'stdlib',
+        'brotli': response.brotli is not None,
+        'compressMinBytes': response.COMPRESS_MIN_BYTES
+    }
+    report.update(compare('chat', chat_rows(50), legacy_chat, encode_chat, args.iterations))
+    report.update(compare('tasks', task_rows(60), legacy_tasks, encode_tasks, args.iterations))
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,25 @@
+-- Счётчики активности пользователя вместо пересчёта COUNT(*) при каждом событии
+CREATE TABLE IF NOT EXISTS user_counters (
+    user_id INTEGER PRIMARY KEY REFERENCES users(id),
+    messages_sent INTEGER NOT NULL DEFAULT 0,
+    titles_owned INTEGER NOT NULL DEFAULT 0,
+    tasks_completed INTEGER NOT NULL DEFAULT 0,
+    coins_earned BIGINT NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_chat_messages_user ON chat_messages(user_id);
+
+-- Заполнение по накопленной истории
+INSERT INTO user_counters (user_id, messages_sent, titles_owned, tasks_completed, coins_earned)
+SELECT u.id,
+       COALESCE(cm.cnt, 0),
+       COALESCE(ut.cnt, 0),
+       COALESCE(tk.cnt, 0),
+       COALESCE(ct.earned, 0)
+FROM users u
+LEFT JOIN (SELECT user_id, COUNT(*) AS cnt FROM chat_messages GROUP BY user_id) cm ON cm.user_id = u.id
+LEFT JOIN (SELECT user_id, COUNT(*) AS cnt FROM user_titles GROUP BY user_id) ut ON ut.user_id = u.id
+LEFT JOIN (SELECT user_id, COUNT(*) AS cnt FROM user_tasks WHERE completed = TRUE GROUP BY user_id) tk ON tk.user_id = u.id
+LEFT JOIN (SELECT user_id, SUM(amount) AS earned FROM coin_transactions WHERE amount > 0 GROUP BY user_id) ct ON ct.user_id = u.id
+ON CONFLICT (user_id) DO NOTHING;
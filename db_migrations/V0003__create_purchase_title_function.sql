@@ -0,0 +1,76 @@
+-- Атомарная покупка титула за один вызов: блокировка баланса, списание,
+-- запись владения и транзакции, продвижение заданий на покупку и награды
+CREATE OR REPLACE FUNCTION purchase_title(p_user_id INTEGER, p_title_id INTEGER)
+RETURNS TABLE (result TEXT, new_coins INTEGER, title_name TEXT, completed_tasks JSON)
+LANGUAGE plpgsql AS $$
+DECLARE
+    v_price INTEGER;
+    v_name TEXT;
+    v_coins INTEGER;
+    v_owned INTEGER;
+    v_completed JSON;
+    v_reward INTEGER;
+    v_count INTEGER;
+BEGIN
+    SELECT t.price, t.name INTO v_price, v_name FROM titles t WHERE t.id = p_title_id;
+    IF NOT FOUND THEN
+        RETURN QUERY SELECT 'title_not_found'::TEXT, NULL::INTEGER, NULL::TEXT, '[]'::JSON;
+        RETURN;
+    END IF;
+
+    -- Блокировка строки пользователя сериализует параллельные покупки одного игрока
+    SELECT u.coins INTO v_coins FROM users u WHERE u.id = p_user_id FOR UPDATE;
+    IF NOT FOUND THEN
+        RETURN QUERY SELECT 'user_not_found'::TEXT, NULL::INTEGER, v_name, '[]'::JSON;
+        RETURN;
+    END IF;
+
+    IF EXISTS (SELECT 1 FROM user_titles ut WHERE ut.user_id = p_user_id AND ut.title_id = p_title_id) THEN
+        RETURN QUERY SELECT 'already_owned'::TEXT, v_coins, v_name, '[]'::JSON;
+        RETURN;
+    END IF;
+
+    IF v_coins < v_price THEN
+        RETURN QUERY SELECT 'insufficient_funds'::TEXT, v_coins, v_name, '[]'::JSON;
+        RETURN;
+    END IF;
+
+    UPDATE users u SET coins = u.coins - v_price WHERE u.id = p_user_id RETURNING u.coins INTO v_coins;
+    INSERT INTO user_titles (user_id, title_id) VALUES (p_user_id, p_title_id);
+    INSERT INTO coin_transactions (user_id, amount, transaction_type, description)
+    VALUES (p_user_id, -v_price, 'purchase', 'Покупка титула ' || v_name);
+
+    INSERT INTO user_counters AS c (user_id, titles_owned) VALUES (p_user_id, 1)
+    ON CONFLICT (user_id) DO UPDATE SET titles_owned = c.titles_owned + 1, updated_at = CURRENT_TIMESTAMP
+    RETURNING c.titles_owned INTO v_owned;
+
+    -- Продвижение заданий на покупку и сбор выполненных
+    WITH advanced AS (
+        UPDATE user_tasks ut
+        SET progress = v_owned,
+            completed = v_owned >= t.max_progress,
+            completed_at = CASE WHEN v_owned >= t.max_progress THEN CURRENT_TIMESTAMP END
+        FROM tasks t
+        WHERE ut.task_id = t.id AND ut.user_id = p_user_id
+              AND t.task_type = 'purchase' AND ut.completed = FALSE
+        RETURNING ut.completed AS done, t.name AS task_name, t.reward AS task_reward
+    )
+    SELECT COALESCE(json_agg(json_build_object('name', task_name, 'reward', task_reward)) FILTER (WHERE done), '[]'::JSON),
+           COALESCE(SUM(task_reward) FILTER (WHERE done), 0),
+           COUNT(*) FILTER (WHERE done)
+    INTO v_completed, v_reward, v_count
+    FROM advanced;
+
+    IF v_count > 0 THEN
+        UPDATE users u SET coins = u.coins + v_reward WHERE u.id = p_user_id RETURNING u.coins INTO v_coins;
+        INSERT INTO coin_transactions (user_id, amount, transaction_type, description)
+        SELECT p_user_id, (e->>'reward')::INTEGER, 'task_reward', 'Награда за: ' || (e->>'name')
+        FROM json_array_elements(v_completed) e;
+        UPDATE user_counters c
+        SET tasks_completed = c.tasks_completed + v_count, coins_earned = c.coins_earned + v_reward
+        WHERE c.user_id = p_user_id;
+    END IF;
+
+    RETURN QUERY SELECT 'ok'::TEXT, v_coins, v_name, v_completed;
+END;
+$$;
@@ -0,0 +1,5 @@
+-- Пул заранее созданных гостевых аккаунтов: вход гостя — один захват строки
+CREATE TABLE IF NOT EXISTS guest_pool (
+    user_id INTEGER PRIMARY KEY REFERENCES users(id),
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
@@ -0,0 +1,82 @@
+-- Разреженный прогресс заданий: строка user_tasks существует только при ненулевом прогрессе
+
+-- Удаление нулевых строк, созданных при регистрации
+DELETE FROM user_tasks WHERE completed = FALSE AND COALESCE(progress, 0) = 0;
+
+-- purchase_title: прогресс заданий на покупку пишется через upsert
+CREATE OR REPLACE FUNCTION purchase_title(p_user_id INTEGER, p_title_id INTEGER)
+RETURNS TABLE (result TEXT, new_coins INTEGER, title_name TEXT, completed_tasks JSON)
+LANGUAGE plpgsql AS $$
+DECLARE
+    v_price INTEGER;
+    v_name TEXT;
+    v_coins INTEGER;
+    v_owned INTEGER;
+    v_completed JSON;
+    v_reward INTEGER;
+    v_count INTEGER;
+BEGIN
+    SELECT t.price, t.name INTO v_price, v_name FROM titles t WHERE t.id = p_title_id;
+    IF NOT FOUND THEN
+        RETURN QUERY SELECT 'title_not_found'::TEXT, NULL::INTEGER, NULL::TEXT, '[]'::JSON;
+        RETURN;
+    END IF;
+
+    -- Блокировка строки пользователя сериализует параллельные покупки одного игрока
+    SELECT u.coins INTO v_coins FROM users u WHERE u.id = p_user_id FOR UPDATE;
+    IF NOT FOUND THEN
+        RETURN QUERY SELECT 'user_not_found'::TEXT, NULL::INTEGER, v_name, '[]'::JSON;
+        RETURN;
+    END IF;
+
+    IF EXISTS (SELECT 1 FROM user_titles ut WHERE ut.user_id = p_user_id AND ut.title_id = p_title_id) THEN
+        RETURN QUERY SELECT 'already_owned'::TEXT, v_coins, v_name, '[]'::JSON;
+        RETURN;
+    END IF;
+
+    IF v_coins < v_price THEN
+        RETURN QUERY SELECT 'insufficient_funds'::TEXT, v_coins, v_name, '[]'::JSON;
+        RETURN;
+    END IF;
+
+    UPDATE users u SET coins = u.coins - v_price WHERE u.id = p_user_id RETURNING u.coins INTO v_coins;
+    INSERT INTO user_titles (user_id, title_id) VALUES (p_user_id, p_title_id);
+    INSERT INTO coin_transactions (user_id, amount, transaction_type, description)
+    VALUES (p_user_id, -v_price, 'purchase', 'Покупка титула ' || v_name);
+
+    INSERT INTO user_counters AS c (user_id, titles_owned) VALUES (p_user_id, 1)
+    ON CONFLICT (user_id) DO UPDATE SET titles_owned = c.titles_owned + 1, updated_at = CURRENT_TIMESTAMP
+    RETURNING c.titles_owned INTO v_owned;
+
+    -- Продвижение заданий на покупку и сбор выполненных
+    WITH advanced AS (
+        INSERT INTO user_tasks AS ut (user_id, task_id, progress, completed, completed_at)
+        SELECT p_user_id, t.id, v_owned, v_owned >= t.max_progress,
+               CASE WHEN v_owned >= t.max_progress THEN CURRENT_TIMESTAMP END
+        FROM tasks t
+        WHERE t.task_type = 'purchase'
+        ON CONFLICT (user_id, task_id) DO UPDATE
+        SET progress = EXCLUDED.progress, completed = EXCLUDED.completed, completed_at = EXCLUDED.completed_at
+        WHERE ut.completed = FALSE
+        RETURNING ut.task_id, ut.completed AS done
+    )
+    SELECT COALESCE(json_agg(json_build_object('name', t.name, 'reward', t.reward)) FILTER (WHERE a.done), '[]'::JSON),
+           COALESCE(SUM(t.reward) FILTER (WHERE a.done), 0),
+           COUNT(*) FILTER (WHERE a.done)
+    INTO v_completed, v_reward, v_count
+    FROM advanced a
+    JOIN tasks t ON t.id = a.task_id;
+
+    IF v_count > 0 THEN
+        UPDATE users u SET coins = u.coins + v_reward WHERE u.id = p_user_id RETURNING u.coins INTO v_coins;
+        INSERT INTO coin_transactions (user_id, amount, transaction_type, description)
+        SELECT p_user_id, (e->>'reward')::INTEGER, 'task_reward', 'Награда за: ' || (e->>'name')
+        FROM json_array_elements(v_completed) e;
+        UPDATE user_counters c
+        SET tasks_completed = c.tasks_completed + v_count, coins_earned = c.coins_earned + v_reward
+        WHERE c.user_id = p_user_id;
+    END IF;
+
+    RETURN QUERY SELECT 'ok'::TEXT, v_coins, v_name, v_completed;
+END;
+$$;
@@ -0,0 +1,18 @@
+-- Снимок статистики сайта для /stats: обновляется приращениями по новым строкам
+CREATE TABLE IF NOT EXISTS site_stats (
+    id INTEGER PRIMARY KEY DEFAULT 1 CHECK (id = 1),
+    total_users BIGINT NOT NULL DEFAULT 0,
+    total_messages BIGINT NOT NULL DEFAULT 0,
+    total_purchases BIGINT NOT NULL DEFAULT 0,
+    online_users INTEGER NOT NULL DEFAULT 0,
+    top_users JSON NOT NULL DEFAULT '[]',
+    users_max_id INTEGER NOT NULL DEFAULT 0,
+    messages_max_id INTEGER NOT NULL DEFAULT 0,
+    purchases_max_id INTEGER NOT NULL DEFAULT 0,
+    refreshed_at TIMESTAMP NOT NULL DEFAULT '-infinity'
+);
+
+INSERT INTO site_stats (id) VALUES (1) ON CONFLICT (id) DO NOTHING;
+
+-- Топ по монетам без сортировки всей таблицы
+CREATE INDEX IF NOT EXISTS idx_users_coins ON users(coins DESC);
@@ -0,0 +1,13 @@
+-- Присутствие онлайн: компактная нежурналируемая таблица, строки старше окна удаляются
+CREATE UNLOGGED TABLE IF NOT EXISTS presence (
+    user_id INTEGER PRIMARY KEY,
+    last_seen TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_presence_last_seen ON presence(last_seen DESC);
+
+-- Начальное заполнение из последних входов
+INSERT INTO presence (user_id, last_seen)
+SELECT id, last_active FROM users
+WHERE last_active > NOW() - INTERVAL '5 minutes'
+ON CONFLICT (user_id) DO NOTHING;
@@ -0,0 +1,3 @@
+-- Постраничная выдача чата по id: покрывающий индекс для диапазонов id > / id <
+CREATE INDEX IF NOT EXISTS idx_chat_messages_id_covering
+    ON chat_messages (id) INCLUDE (user_id, username, message, created_at);
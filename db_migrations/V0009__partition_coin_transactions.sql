@@ -0,0 +1,111 @@
+-- Помесячное секционирование журнала coin_transactions,
+-- архивирование старых секций в помесячные сводки по пользователям
+
+ALTER TABLE coin_transactions RENAME TO coin_transactions_legacy;
+ALTER INDEX coin_transactions_pkey RENAME TO coin_transactions_legacy_pkey;
+ALTER INDEX IF EXISTS idx_coin_transactions_user RENAME TO idx_coin_transactions_legacy_user;
+ALTER SEQUENCE coin_transactions_id_seq OWNED BY NONE;
+
+CREATE TABLE coin_transactions (
+    id INTEGER NOT NULL DEFAULT nextval('coin_transactions_id_seq'),
+    user_id INTEGER REFERENCES users(id),
+    amount INTEGER NOT NULL,
+    transaction_type VARCHAR(50) NOT NULL,
+    description TEXT,
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (id, created_at)
+) PARTITION BY RANGE (created_at);
+
+ALTER SEQUENCE coin_transactions_id_seq OWNED BY coin_transactions.id;
+
+-- Страховочная секция: остаётся пустой, пока секции создаются заранее
+CREATE TABLE IF NOT EXISTS coin_transactions_default PARTITION OF coin_transactions DEFAULT;
+
+-- История пользователя: последние записи по (user_id, created_at) в каждой секции
+CREATE INDEX IF NOT EXISTS idx_coin_transactions_user_created ON coin_transactions (user_id, created_at DESC);
+
+-- Секция за месяц, содержащий p_month
+CREATE OR REPLACE FUNCTION ensure_ledger_partition(p_month DATE)
+RETURNS TEXT
+LANGUAGE plpgsql AS $$
+DECLARE
+    v_start DATE := date_trunc('month', p_month)::DATE;
+    v_name TEXT := 'coin_transactions_y' || to_char(v_start, 'YYYY') || 'm' || to_char(v_start, 'MM');
+BEGIN
+    IF to_regclass(v_name) IS NULL THEN
+        EXECUTE format(
+            'CREATE TABLE %I PARTITION OF coin_transactions FOR VALUES FROM (%L) TO (%L)',
+            v_name, v_start, (v_start + INTERVAL '1 month')::DATE
+        );
+    END IF;
+    RETURN v_name;
+END;
+$$;
+
+SELECT ensure_ledger_partition(m::DATE)
+FROM generate_series(
+    date_trunc('month', COALESCE((SELECT MIN(created_at) FROM coin_transactions_legacy), CURRENT_TIMESTAMP)),
+    date_trunc('month', CURRENT_TIMESTAMP) + INTERVAL '3 months',
+    INTERVAL '1 month'
+) m;
+
+INSERT INTO coin_transactions (id, user_id, amount, transaction_type, description, created_at)
+SELECT id, user_id, amount, transaction_type, description, COALESCE(created_at, CURRENT_TIMESTAMP)
+FROM coin_transactions_legacy;
+
+DROP TABLE coin_transactions_legacy;
+
+-- Помесячные сводки по пользователям для отсоединённых секций
+CREATE TABLE IF NOT EXISTS coin_transactions_monthly (
+    user_id INTEGER NOT NULL,
+    month DATE NOT NULL,
+    transaction_type VARCHAR(50) NOT NULL,
+    total_amount BIGINT NOT NULL DEFAULT 0,
+    entries INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (user_id, month, transaction_type)
+);
+
+-- Свернуть секции старше p_keep_months месяцев в сводки и отсоединить их
+CREATE OR REPLACE FUNCTION archive_ledger_partitions(p_keep_months INTEGER, p_drop BOOLEAN DEFAULT FALSE)
+RETURNS TABLE (partition_name TEXT, archived_rows BIGINT)
+LANGUAGE plpgsql AS $$
+DECLARE
+    v_cutoff DATE := (date_trunc('month', CURRENT_TIMESTAMP) - make_interval(months => p_keep_months))::DATE;
+    v_part RECORD;
+    v_month DATE;
+    v_rows BIGINT;
+BEGIN
+    FOR v_part IN
+        SELECT c.relname::TEXT AS relname
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'coin_transactions'::REGCLASS
+              AND c.relname ~ '_y[0-9]{4}m[0-9]{2}$'
+        ORDER BY c.relname
+    LOOP
+        v_month := to_date(substring(v_part.relname FROM 'y([0-9]{4}m[0-9]{2})$'), 'YYYY"m"MM');
+        CONTINUE WHEN v_month >= v_cutoff;
+
+        EXECUTE format('SELECT COUNT(*) FROM %I', v_part.relname) INTO v_rows;
+        EXECUTE format($sql$
+            INSERT INTO coin_transactions_monthly AS m (user_id, month, transaction_type, total_amount, entries)
+            SELECT user_id, %L::DATE, transaction_type, SUM(amount), COUNT(*)
+            FROM %I
+            WHERE user_id IS NOT NULL
+            GROUP BY user_id, transaction_type
+            ON CONFLICT (user_id, month, transaction_type) DO UPDATE
+            SET total_amount = m.total_amount + EXCLUDED.total_amount,
+                entries = m.entries + EXCLUDED.entries
+        $sql$, v_month, v_part.relname);
+
+        EXECUTE format('ALTER TABLE coin_transactions DETACH PARTITION %I', v_part.relname);
+        IF p_drop THEN
+            EXECUTE format('DROP TABLE %I', v_part.relname);
+        END IF;
+
+        partition_name := v_part.relname;
+        archived_rows := v_rows;
+        RETURN NEXT;
+    END LOOP;
+END;
+$$;
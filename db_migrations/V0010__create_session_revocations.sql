@@ -0,0 +1,9 @@
+-- Отозванные токены сессии; строки нужны только до истечения срока токена
+CREATE TABLE IF NOT EXISTS session_revocations (
+    jti VARCHAR(32) PRIMARY KEY,
+    user_id INTEGER,
+    expires_at TIMESTAMP NOT NULL,
+    revoked_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_session_revocations_expires ON session_revocations(expires_at);
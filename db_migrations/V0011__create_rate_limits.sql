@@ -0,0 +1,9 @@
+-- Общие для всех экземпляров корзины токенов пользователей.
+-- UNLOGGED: после сбоя корзины просто начинаются заново полными
+CREATE UNLOGGED TABLE IF NOT EXISTS rate_limits (
+    user_id INTEGER NOT NULL,
+    bucket VARCHAR(20) NOT NULL,
+    tokens DOUBLE PRECISION NOT NULL,
+    updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (user_id, bucket)
+);
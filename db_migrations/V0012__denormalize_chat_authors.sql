@@ -0,0 +1,43 @@
+-- Модель чтения чата: данные автора хранятся в сообщении, опрос читает одну таблицу без JOIN users
+ALTER TABLE chat_messages ADD COLUMN IF NOT EXISTS author_is_admin BOOLEAN NOT NULL DEFAULT FALSE;
+ALTER TABLE chat_messages ADD COLUMN IF NOT EXISTS author_title VARCHAR(100);
+
+UPDATE chat_messages cm
+SET author_is_admin = TRUE
+FROM users u
+WHERE u.id = cm.user_id AND u.is_admin;
+
+-- Титул автора — самый дорогой из купленных на момент отправки
+UPDATE chat_messages cm
+SET author_title = top.name
+FROM (
+    SELECT DISTINCT ON (ut.user_id) ut.user_id, t.name
+    FROM user_titles ut
+    JOIN titles t ON t.id = ut.title_id
+    ORDER BY ut.user_id, t.price DESC, t.sort_order DESC
+) top
+WHERE top.user_id = cm.user_id;
+
+-- Смена флага администратора переписывает его в сообщениях автора
+CREATE OR REPLACE FUNCTION sync_chat_author_admin()
+RETURNS TRIGGER
+LANGUAGE plpgsql AS $$
+BEGIN
+    UPDATE chat_messages
+    SET author_is_admin = COALESCE(NEW.is_admin, FALSE)
+    WHERE user_id = NEW.id AND author_is_admin <> COALESCE(NEW.is_admin, FALSE);
+    RETURN NEW;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS trg_users_admin_chat ON users;
+CREATE TRIGGER trg_users_admin_chat
+    AFTER UPDATE OF is_admin ON users
+    FOR EACH ROW
+    WHEN (OLD.is_admin IS DISTINCT FROM NEW.is_admin)
+    EXECUTE FUNCTION sync_chat_author_admin();
+
+-- Покрывающий индекс с данными автора: диапазон по id читается только из индекса
+CREATE INDEX IF NOT EXISTS idx_chat_messages_id_read_model
+    ON chat_messages (id) INCLUDE (user_id, username, message, created_at, author_is_admin, author_title);
+DROP INDEX IF EXISTS idx_chat_messages_id_covering;
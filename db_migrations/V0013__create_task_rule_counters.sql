@@ -0,0 +1,67 @@
+-- Движок заданий: счётчики типов без собственного источника и purchase_title без заданий
+
+-- Счётчики типов, которые копятся через /action (action, social, secret, special)
+CREATE TABLE IF NOT EXISTS user_task_counters (
+    user_id INTEGER NOT NULL REFERENCES users(id),
+    task_type VARCHAR(50) NOT NULL,
+    value INTEGER NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (user_id, task_type)
+);
+
+-- Прогресс прибавлялся ко всем заданиям типа, поэтому счётчик — максимум по его строкам
+INSERT INTO user_task_counters (user_id, task_type, value)
+SELECT ut.user_id, t.task_type, MAX(ut.progress)
+FROM user_tasks ut
+JOIN tasks t ON t.id = ut.task_id
+WHERE t.task_type IN ('action', 'social', 'secret', 'special') AND ut.progress > 0
+GROUP BY ut.user_id, t.task_type
+ON CONFLICT (user_id, task_type) DO NOTHING;
+
+-- Задания на покупку теперь завершает движок по возвращаемому titles_owned
+DROP FUNCTION IF EXISTS purchase_title(INTEGER, INTEGER);
+
+CREATE FUNCTION purchase_title(p_user_id INTEGER, p_title_id INTEGER)
+RETURNS TABLE (result TEXT, new_coins INTEGER, title_name TEXT, titles_owned INTEGER)
+LANGUAGE plpgsql AS $$
+DECLARE
+    v_price INTEGER;
+    v_name TEXT;
+    v_coins INTEGER;
+    v_owned INTEGER;
+BEGIN
+    SELECT t.price, t.name INTO v_price, v_name FROM titles t WHERE t.id = p_title_id;
+    IF NOT FOUND THEN
+        RETURN QUERY SELECT 'title_not_found'::TEXT, NULL::INTEGER, NULL::TEXT, NULL::INTEGER;
+        RETURN;
+    END IF;
+
+    -- Блокировка строки пользователя сериализует параллельные покупки одного игрока
+    SELECT u.coins INTO v_coins FROM users u WHERE u.id = p_user_id FOR UPDATE;
+    IF NOT FOUND THEN
+        RETURN QUERY SELECT 'user_not_found'::TEXT, NULL::INTEGER, v_name, NULL::INTEGER;
+        RETURN;
+    END IF;
+
+    IF EXISTS (SELECT 1 FROM user_titles ut WHERE ut.user_id = p_user_id AND ut.title_id = p_title_id) THEN
+        RETURN QUERY SELECT 'already_owned'::TEXT, v_coins, v_name, NULL::INTEGER;
+        RETURN;
+    END IF;
+
+    IF v_coins < v_price THEN
+        RETURN QUERY SELECT 'insufficient_funds'::TEXT, v_coins, v_name, NULL::INTEGER;
+        RETURN;
+    END IF;
+
+    UPDATE users u SET coins = u.coins - v_price WHERE u.id = p_user_id RETURNING u.coins INTO v_coins;
+    INSERT INTO user_titles (user_id, title_id) VALUES (p_user_id, p_title_id);
+    INSERT INTO coin_transactions (user_id, amount, transaction_type, description)
+    VALUES (p_user_id, -v_price, 'purchase', 'Покупка титула ' || v_name);
+
+    INSERT INTO user_counters AS c (user_id, titles_owned) VALUES (p_user_id, 1)
+    ON CONFLICT (user_id) DO UPDATE SET titles_owned = c.titles_owned + 1, updated_at = CURRENT_TIMESTAMP
+    RETURNING c.titles_owned INTO v_owned;
+
+    RETURN QUERY SELECT 'ok'::TEXT, v_coins, v_name, v_owned;
+END;
+$$;
@@ -0,0 +1,27 @@
+-- Серии ежедневных посещений: начало текущей серии и последний день вместо истории визитов
+CREATE TABLE IF NOT EXISTS user_streaks (
+    user_id INTEGER PRIMARY KEY REFERENCES users(id),
+    streak_start DATE NOT NULL,
+    last_day DATE NOT NULL,
+    longest INTEGER NOT NULL DEFAULT 1
+);
+
+-- Календарный день посещения; граница суток — по московскому времени
+CREATE OR REPLACE FUNCTION visit_day() RETURNS DATE
+LANGUAGE sql STABLE AS $$
+    SELECT (NOW() AT TIME ZONE 'Europe/Moscow')::DATE
+$$;
+
+-- Текущая серия: обнуляется, если пропущен день после last_day
+CREATE OR REPLACE FUNCTION current_streak(p_start DATE, p_last DATE) RETURNS INTEGER
+LANGUAGE sql STABLE AS $$
+    SELECT CASE WHEN p_last >= visit_day() - 1 THEN p_last - p_start + 1 ELSE 0 END
+$$;
+
+-- Заполнение по последней активности: серия в один день
+INSERT INTO user_streaks (user_id, streak_start, last_day, longest)
+SELECT id, (last_active::TIMESTAMPTZ AT TIME ZONE 'Europe/Moscow')::DATE,
+       (last_active::TIMESTAMPTZ AT TIME ZONE 'Europe/Moscow')::DATE, 1
+FROM users
+WHERE last_active IS NOT NULL
+ON CONFLICT (user_id) DO NOTHING;
@@ -0,0 +1,48 @@
+-- Заработок пользователя по часам: суммы за день без суммирования журнала coin_transactions
+CREATE TABLE IF NOT EXISTS user_earnings_hourly (
+    user_id INTEGER NOT NULL REFERENCES users(id),
+    hour TIMESTAMP NOT NULL,
+    amount BIGINT NOT NULL DEFAULT 0,
+    PRIMARY KEY (user_id, hour)
+);
+
+-- Каждое положительное начисление журнала прибавляется к часовой корзине
+CREATE OR REPLACE FUNCTION record_earnings() RETURNS TRIGGER
+LANGUAGE plpgsql AS $$
+BEGIN
+    INSERT INTO user_earnings_hourly AS e (user_id, hour, amount)
+    VALUES (NEW.user_id, date_trunc('hour', NEW.created_at), NEW.amount)
+    ON CONFLICT (user_id, hour) DO UPDATE SET amount = e.amount + EXCLUDED.amount;
+    RETURN NULL;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS trg_coin_transactions_earnings ON coin_transactions;
+CREATE TRIGGER trg_coin_transactions_earnings
+AFTER INSERT ON coin_transactions
+FOR EACH ROW WHEN (NEW.amount > 0 AND NEW.user_id IS NOT NULL)
+EXECUTE FUNCTION record_earnings();
+
+-- Заработок за окно: 'day' — календарные сутки по московскому времени, 'rolling' — последние 24 часовые корзины
+CREATE OR REPLACE FUNCTION daily_earnings(p_user_id INTEGER, p_window TEXT) RETURNS BIGINT
+LANGUAGE sql STABLE AS $$
+    SELECT COALESCE(SUM(e.amount), 0)::BIGINT
+    FROM user_earnings_hourly e
+    WHERE e.user_id = p_user_id
+      AND e.hour >= CASE WHEN p_window = 'rolling'
+                         THEN date_trunc('hour', LOCALTIMESTAMP) - INTERVAL '23 hours'
+                         ELSE (visit_day()::TIMESTAMP AT TIME ZONE 'Europe/Moscow')::TIMESTAMP
+                    END
+$$;
+
+-- Заполнение по журналу за последние сутки с запасом
+INSERT INTO user_earnings_hourly (user_id, hour, amount)
+SELECT user_id, date_trunc('hour', created_at), SUM(amount)
+FROM coin_transactions
+WHERE amount > 0 AND user_id IS NOT NULL AND created_at >= LOCALTIMESTAMP - INTERVAL '2 days'
+GROUP BY user_id, date_trunc('hour', created_at)
+ON CONFLICT (user_id, hour) DO NOTHING;
+
+-- Задание на дневной заработок получает свой тип: у extreme разные метрики
+UPDATE tasks SET task_type = 'daily_earnings'
+WHERE task_type = 'extreme' AND name = 'Заработать 10000 за день';
@@ -0,0 +1,12 @@
+-- Уведомления о заданиях, завершённых при сбросе буфера heartbeat: их забирает следующий heartbeat
+-- пользователя на любом экземпляре. Нежурналируемая: потеря при сбое стоит только всплывающего сообщения
+CREATE UNLOGGED TABLE IF NOT EXISTS task_notices (
+    id BIGSERIAL PRIMARY KEY,
+    user_id INTEGER NOT NULL REFERENCES users(id),
+    name TEXT NOT NULL,
+    reward INTEGER NOT NULL,
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_task_notices_user ON task_notices (user_id);
+CREATE INDEX IF NOT EXISTS idx_task_notices_created ON task_notices (created_at);
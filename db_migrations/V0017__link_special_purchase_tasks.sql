@@ -0,0 +1,11 @@
+-- Задания на покупку конкретного титула: связь с титулом для движка заданий
+ALTER TABLE tasks ADD COLUMN IF NOT EXISTS title_id INTEGER REFERENCES titles(id);
+
+UPDATE tasks t SET title_id = ti.id
+FROM (VALUES
+    ('Купить легендарный титул', '[LEGEND]'),
+    ('Купить королевский титул', '[KING]'),
+    ('Купить титул создателя', '[CREATOR]')
+) AS m(task_name, title_name)
+JOIN titles ti ON ti.name = m.title_name
+WHERE t.task_type = 'special_purchase' AND t.name = m.task_name;
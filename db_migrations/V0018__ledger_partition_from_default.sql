@@ -0,0 +1,44 @@
+-- ensure_ledger_partition переносит строки месяца из секции по умолчанию.
+-- Если обслуживание журнала пропущено дольше запаса секций наперёд, новые записи попадают
+-- в coin_transactions_default, и прежняя версия падала на создании секции этого месяца
+-- ("updated partition constraint for default partition would be violated")
+CREATE OR REPLACE FUNCTION ensure_ledger_partition(p_month DATE)
+RETURNS TEXT
+LANGUAGE plpgsql AS $$
+DECLARE
+    v_start DATE := date_trunc('month', p_month)::DATE;
+    v_end DATE := (date_trunc('month', p_month) + INTERVAL '1 month')::DATE;
+    v_name TEXT := 'coin_transactions_y' || to_char(v_start, 'YYYY') || 'm' || to_char(v_start, 'MM');
+BEGIN
+    IF to_regclass(v_name) IS NOT NULL THEN
+        RETURN v_name;
+    END IF;
+
+    IF NOT EXISTS (
+        SELECT 1 FROM coin_transactions_default WHERE created_at >= v_start AND created_at < v_end
+    ) THEN
+        EXECUTE format(
+            'CREATE TABLE %I PARTITION OF coin_transactions FOR VALUES FROM (%L) TO (%L)',
+            v_name, v_start, v_end
+        );
+        RETURN v_name;
+    END IF;
+
+    -- Секция наполняется отдельной таблицей и присоединяется; триггеры журнала при переносе не срабатывают
+    LOCK TABLE coin_transactions_default IN ACCESS EXCLUSIVE MODE;
+    EXECUTE format('CREATE TABLE %I (LIKE coin_transactions INCLUDING DEFAULTS)', v_name);
+    EXECUTE format($sql$
+        WITH moved AS (
+            DELETE FROM coin_transactions_default
+            WHERE created_at >= %L AND created_at < %L
+            RETURNING *
+        )
+        INSERT INTO %I SELECT * FROM moved
+    $sql$, v_start, v_end, v_name);
+    EXECUTE format(
+        'ALTER TABLE coin_transactions ATTACH PARTITION %I FOR VALUES FROM (%L) TO (%L)',
+        v_name, v_start, v_end
+    );
+    RETURN v_name;
+END;
+$$;
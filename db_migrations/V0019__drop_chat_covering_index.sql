@@ -0,0 +1,5 @@
+-- Покрывающий индекс копировал текст сообщения и данные автора: удваивал объём и стоимость
+-- вставки, а длинная строка могла превысить предел размера кортежа btree.
+-- Диапазоны id > / id < читаются по первичному ключу
+DROP INDEX IF EXISTS idx_chat_messages_id_read_model;
+DROP INDEX IF EXISTS idx_chat_messages_id_covering;
@@ -5,6 +5,7 @@ import { TooltipProvider } from "@/components/ui/tooltip";
 import { QueryClient, QueryClientProvider } from "@tanstack/react-query";
 import Login from './pages/Login';
 import Index from './pages/Index';
+import { api, setUnauthorizedHandler } from './lib/api';
 
 const queryClient = new QueryClient();
 
@@ -21,8 +22,11 @@ const App = () => {
 
   useEffect(() => {
     const savedUser = localStorage.getItem('user');
-    if (savedUser) {
+    // Без токена сессия недействительна: сервер определяет пользователя только по нему
+    if (savedUser && localStorage.getItem('token')) {
       setUser(JSON.parse(savedUser));
+    } else {
+      localStorage.removeItem('user');
     }
   }, []);
 
@@ -30,12 +34,24 @@ const App = () => {
     setUser(userData);
   };
 
-  const handleLogout = () => {
+  const clearSession = () => {
     localStorage.removeItem('user');
     localStorage.removeItem('token');
+    sessionStorage.removeItem('bootstrap');
     setUser(null);
   };
 
+  const handleLogout = () => {
+    api.logout().catch(() => undefined);
+    clearSession();
+  };
+
+  // Любой 401 — токен истёк или не прошёл проверку: возвращаемся на экран входа
+  useEffect(() => {
+    setUnauthorizedHandler(clearSession);
+    return () => setUnauthorizedHandler(null);
+  }, []);
+
   return (
     <QueryClientProvider client={queryClient}>
       <TooltipProvider>
@@ -6,6 +6,26 @@ const API_URLS = {
   admin: 'https://functions.poehali.dev/63254041-9aa4-41b3-8950-8cd75747d44c',
 };
 
+// Подписанный токен сессии из localStorage; сервер берёт id пользователя из него
+const authHeaders = (): Record<string, string> => {
+  const token = localStorage.getItem('token');
+  return token ? { Authorization: `Bearer ${token}` } : {};
+};
+
+// Истёкший или неподписанный токен: сервер отвечает 401, сессию нужно завершить
+let onUnauthorized: (() => void) | null = null;
+
+export const setUnauthorizedHandler = (handler: (() => void) | null) => {
+  onUnauthorized = handler;
+};
+
+// Запрос от имени пользователя; на 401 вызывается обработчик выхода
+const send = async (url: string, init?: RequestInit) => {
+  const res = await fetch(url, init);
+  if (res.status === 401) onUnauthorized?.();
+  return res;
+};
+
 export const api = {
   // Регистрация
   register: async (username: string, password: string) => {
@@ -37,86 +57,122 @@ export const api = {
     return res.json();
   },
 
+  // Выход с отзывом токена
+  logout: async () => {
+    const res = await fetch(API_URLS.auth, {
+      method: 'POST',
+      headers: { 'Content-Type': 'application/json', ...authHeaders() },
+      body: JSON.stringify({ action: 'logout' }),
+    });
+    return res.json();
+  },
+
+  // Первая загрузка: профиль, титулы, задания и чат одним запросом.
+  // Разделы, не изменившиеся по ETag, сервер опускает — берём их из кэша сессии;
+  // общий ETag ответа даёт 304, когда не изменилось ничего
+  bootstrap: async () => {
+    const cached = JSON.parse(sessionStorage.getItem('bootstrap') || 'null');
+    const known: string[] = cached ? [cached.etag, ...Object.values(cached.etags)].filter(Boolean) : [];
+    const headers: Record<string, string> = { ...authHeaders() };
+    if (known.length > 0) headers['If-None-Match'] = known.join(', ');
+    const res = await send(`${API_URLS.game}/bootstrap`, { headers, cache: 'no-store' });
+    if (res.status === 304 && cached) return cached;
+    const data = await res.json();
+    if (data.error) return data;
+    for (const section of ['profile', 'titles', 'tasks', 'chat']) {
+      if (data[section] === null) data[section] = cached?.[section] ?? null;
+    }
+    data.etag = res.headers.get('ETag');
+    sessionStorage.setItem('bootstrap', JSON.stringify(data));
+    return data;
+  },
+
   // Получить титулы
-  getTitles: async (userId: number) => {
-    const res = await fetch(`${API_URLS.game}/titles?userId=${userId}`);
+  getTitles: async () => {
+    const res = await send(`${API_URLS.game}/titles`, { headers: authHeaders() });
     return res.json();
   },
 
   // Купить титул
-  buyTitle: async (userId: number, titleId: number) => {
-    const res = await fetch(`${API_URLS.game}/buy-title`, {
+  buyTitle: async (titleId: number) => {
+    const res = await send(`${API_URLS.game}/buy-title`, {
       method: 'POST',
-      headers: { 'Content-Type': 'application/json' },
-      body: JSON.stringify({ userId, titleId }),
+      headers: { 'Content-Type': 'application/json', ...authHeaders() },
+      body: JSON.stringify({ titleId }),
     });
     return res.json();
   },
 
   // Получить задания
-  getTasks: async (userId: number) => {
-    const res = await fetch(`${API_URLS.game}/tasks?userId=${userId}`);
+  getTasks: async () => {
+    const res = await send(`${API_URLS.game}/tasks`, { headers: authHeaders() });
     return res.json();
   },
 
   // Обновить время
-  updateTime: async (userId: number, minutes: number) => {
-    const res = await fetch(`${API_URLS.game}/update-time`, {
+  updateTime: async (minutes: number) => {
+    const res = await send(`${API_URLS.game}/update-time`, {
       method: 'POST',
-      headers: { 'Content-Type': 'application/json' },
-      body: JSON.stringify({ userId, minutes }),
+      headers: { 'Content-Type': 'application/json', ...authHeaders() },
+      body: JSON.stringify({ minutes }),
     });
     return res.json();
   },
 
   // Выполнить действие
-  doAction: async (userId: number, actionType: string, value: number = 1) => {
-    const res = await fetch(`${API_URLS.game}/action`, {
+  doAction: async (actionType: string, value: number = 1) => {
+    return api.doActions([{ actionType, value }]);
+  },
+
+  // Выполнить пачку действий одним запросом
+  doActions: async (events: { actionType: string; value: number }[]) => {
+    const res = await send(`${API_URLS.game}/action`, {
       method: 'POST',
-      headers: { 'Content-Type': 'application/json' },
-      body: JSON.stringify({ userId, actionType, value }),
+      headers: { 'Content-Type': 'application/json', ...authHeaders() },
+      body: JSON.stringify({ events }),
     });
     return res.json();
   },
 
-  // Получить сообщения чата
-  getMessages: async (sinceId?: number) => {
-    const url = sinceId 
-      ? `${API_URLS.chat}?sinceId=${sinceId}` 
-      : API_URLS.chat;
-    const res = await fetch(url);
+  // Получить сообщения чата (wait — долгий опрос в секундах, только вместе с sinceId)
+  getMessages: async (sinceId?: number, wait?: number) => {
+    const params = new URLSearchParams();
+    if (sinceId !== undefined) params.set('sinceId', String(sinceId));
+    if (sinceId !== undefined && wait) params.set('wait', String(wait));
+    const query = params.toString();
+    const res = await fetch(query ? `${API_URLS.chat}?${query}` : API_URLS.chat);
     return res.json();
   },
 
   // Отправить сообщение
-  sendMessage: async (userId: number, username: string, message: string) => {
-    const res = await fetch(API_URLS.chat, {
+  sendMessage: async (message: string) => {
+    const res = await send(API_URLS.chat, {
       method: 'POST',
-      headers: { 'Content-Type': 'application/json' },
-      body: JSON.stringify({ userId, username, message }),
+      headers: { 'Content-Type': 'application/json', ...authHeaders() },
+      body: JSON.stringify({ message }),
     });
     return res.json();
   },
 
   // Админ: получить онлайн пользователей
-  getOnlineUsers: async (adminId: number) => {
-    const res = await fetch(`${API_URLS.admin}/online?adminId=${adminId}`);
+  getOnlineUsers: async () => {
+    const res = await send(`${API_URLS.admin}/online`, { headers: authHeaders() });
     return res.json();
   },
 
   // Админ: выдать монеты
-  giveCoins: async (adminId: number, targetUserId: number, amount: number) => {
-    const res = await fetch(`${API_URLS.admin}/give-coins`, {
+  giveCoins: async (targetUserId: number, amount: number) => {
+    const res = await send(`${API_URLS.admin}/give-coins`, {
       method: 'POST',
-      headers: { 'Content-Type': 'application/json' },
-      body: JSON.stringify({ adminId, targetUserId, amount }),
+      headers: { 'Content-Type': 'application/json', ...authHeaders() },
+      body: JSON.stringify({ targetUserId, amount }),
     });
     return res.json();
   },
 
   // Админ: статистика
-  getStats: async (adminId: number) => {
-    const res = await fetch(`${API_URLS.admin}/stats?adminId=${adminId}`);
+  getStats: async () => {
+    const res = await send(`${API_URLS.admin}/stats`, { headers: authHeaders() });
     return res.json();
   },
 };
@@ -1,4 +1,4 @@
-import { useState, useEffect, useCallback } from 'react';
+import { useState, useEffect, useCallback, useRef } from 'react';
 import { Card } from '@/components/ui/card';
 import { Button } from '@/components/ui/button';
 import { Badge } from '@/components/ui/badge';
@@ -49,9 +49,23 @@ interface Message {
   username: string;
   message: string;
   isAdmin: boolean;
+  title?: string | null;
   createdAt: string;
 }
 
+const CHAT_LONG_POLL_WAIT = 25;
+const CHAT_RETRY_DELAY = 3000;
+const ACTION_FLUSH_DELAY = 1500;
+// Пределы /action на сервере: value одного события и число событий в запросе
+const ACTION_VALUE_MAX = 10;
+const ACTION_BATCH_MAX = 100;
+
+const mergeMessages = (current: Message[], incoming: Message[]) => {
+  const known = new Set(current.map((m) => m.id));
+  const fresh = incoming.filter((m) => !known.has(m.id));
+  return fresh.length > 0 ? [...current, ...fresh].sort((a, b) => a.id - b.id) : current;
+};
+
 export default function Index({ user, onLogout }: IndexProps) {
   const [coins, setCoins] = useState(user.coins);
   const [titles, setTitles] = useState<Title[]>([]);
@@ -64,12 +78,20 @@ export default function Index({ user, onLogout }: IndexProps) {
   const [adminPanel, setAdminPanel] = useState(false);
   const [adminAmount, setAdminAmount] = useState(0);
   const [onlineUsers, setOnlineUsers] = useState<User[]>([]);
+  const lastMessageIdRef = useRef<number | undefined>(undefined);
+  const pendingActionsRef = useRef<Record<string, number>>({});
+  const actionTimerRef = useRef<ReturnType<typeof setTimeout> | null>(null);
   const { toast } = useToast();
 
+  useEffect(() => {
+    lastMessageIdRef.current = messages.length > 0 ? messages[messages.length - 1].id : lastMessageIdRef.current;
+  }, [messages]);
+
   // Загрузка данных
   const loadTitles = useCallback(async () => {
     try {
-      const data = await api.getTitles(user.id);
+      const data = await api.getTitles();
+      if (!Array.isArray(data)) throw new Error(data?.error);
       setTitles(data);
     } catch {
       toast({ title: 'Ошибка', description: 'Не удалось загрузить титулы', variant: 'destructive' });
@@ -78,7 +100,8 @@ export default function Index({ user, onLogout }: IndexProps) {
 
   const loadTasks = useCallback(async () => {
     try {
-      const data = await api.getTasks(user.id);
+      const data = await api.getTasks();
+      if (!Array.isArray(data)) throw new Error(data?.error);
       setTasks(data);
     } catch {
       toast({ title: 'Ошибка', description: 'Не удалось загрузить задания', variant: 'destructive' });
@@ -88,23 +111,39 @@ export default function Index({ user, onLogout }: IndexProps) {
   const loadMessages = useCallback(async () => {
     try {
       const data = await api.getMessages();
+      if (!Array.isArray(data)) throw new Error(data?.error);
       setMessages(data);
+      lastMessageIdRef.current = data.length > 0 ? data[data.length - 1].id : 0;
     } catch {
       toast({ title: 'Ошибка', description: 'Не удалось загрузить чат', variant: 'destructive' });
     }
   }, [toast]);
 
+  // Первая загрузка одним запросом; при ошибке — прежние отдельные загрузки
   useEffect(() => {
-    loadTitles();
-    loadTasks();
-    loadMessages();
+    const bootstrap = async () => {
+      try {
+        const data = await api.bootstrap();
+        if (!Array.isArray(data.titles) || !Array.isArray(data.tasks) || !Array.isArray(data.chat)) throw new Error(data.error);
+        if (data.profile) setCoins(data.profile.coins);
+        setTitles(data.titles);
+        setTasks(data.tasks);
+        setMessages(data.chat);
+        lastMessageIdRef.current = data.chat.length > 0 ? data.chat[data.chat.length - 1].id : 0;
+      } catch {
+        loadTitles();
+        loadTasks();
+        loadMessages();
+      }
+    };
+    bootstrap();
   }, [loadTitles, loadTasks, loadMessages]);
 
   // Обновление времени каждую минуту
   useEffect(() => {
     const interval = setInterval(async () => {
       try {
-        const result = await api.updateTime(user.id, 1);
+        const result = await api.updateTime(1);
         if (result.coins) setCoins(result.coins);
         if (result.completedTasks?.length > 0) {
           result.completedTasks.forEach((task: { name: string; reward: number }) => {
@@ -119,21 +158,51 @@ export default function Index({ user, onLogout }: IndexProps) {
     return () => clearInterval(interval);
   }, [user.id, toast, loadTasks]);
 
-  // Обновление чата каждые 3 секунды
+  // Обновление чата долгим опросом: сервер держит запрос, пока не появится новое сообщение
   useEffect(() => {
-    const interval = setInterval(loadMessages, 3000);
-    return () => clearInterval(interval);
-  }, [loadMessages]);
+    let cancelled = false;
+    const poll = async () => {
+      while (!cancelled) {
+        const sinceId = lastMessageIdRef.current;
+        if (sinceId === undefined) {
+          await new Promise((resolve) => setTimeout(resolve, CHAT_RETRY_DELAY));
+          continue;
+        }
+        try {
+          const started = Date.now();
+          const data = await api.getMessages(sinceId, CHAT_LONG_POLL_WAIT);
+          // Ошибка сервера приходит объектом — ждём, как при сбое сети
+          if (!Array.isArray(data)) throw new Error(data?.error);
+          if (!cancelled && data.length > 0) {
+            setMessages((prev) => mergeMessages(prev, data));
+          } else if (Date.now() - started < CHAT_RETRY_DELAY) {
+            // Сервер ответил пустым списком без ожидания — не опрашиваем вхолостую
+            await new Promise((resolve) => setTimeout(resolve, CHAT_RETRY_DELAY));
+          }
+        } catch (error) {
+          console.error('Chat poll error:', error);
+          await new Promise((resolve) => setTimeout(resolve, CHAT_RETRY_DELAY));
+        }
+      }
+    };
+    poll();
+    return () => {
+      cancelled = true;
+    };
+  }, []);
 
   const handleBuyTitle = async () => {
     if (!selectedTitle) return;
     try {
-      const result = await api.buyTitle(user.id, selectedTitle.id);
+      const result = await api.buyTitle(selectedTitle.id);
       if (result.error) {
         toast({ title: 'Ошибка', description: result.error, variant: 'destructive' });
       } else {
         setCoins(result.coins);
         toast({ title: '🎉 Поздравляем!', description: result.message });
+        result.completedTasks?.forEach((task: { name: string; reward: number }) => {
+          toast({ title: '✅ Задание выполнено!', description: `${task.name} (+${task.reward} монет)` });
+        });
         loadTitles();
         loadTasks();
         setShowBuyDialog(false);
@@ -148,9 +217,9 @@ export default function Index({ user, onLogout }: IndexProps) {
     e.preventDefault();
     if (!newMessage.trim()) return;
     try {
-      const result = await api.sendMessage(user.id, user.username, newMessage);
+      const result = await api.sendMessage(newMessage);
       if (result.success) {
-        setMessages([...messages, result.message]);
+        setMessages((prev) => mergeMessages(prev, [result.message]));
         setNewMessage('');
         if (result.coins) setCoins(result.coins);
         if (result.completedTasks?.length > 0) {
@@ -159,6 +228,8 @@ export default function Index({ user, onLogout }: IndexProps) {
           });
           loadTasks();
         }
+      } else if (result.error) {
+        toast({ title: 'Ошибка', description: result.error, variant: 'destructive' });
       }
     } catch (error) {
       console.error('Send message error:', error);
@@ -166,18 +237,57 @@ export default function Index({ user, onLogout }: IndexProps) {
     }
   };
 
-  const handleTabChange = async (value: string) => {
-    setCurrentTab(value);
-    try {
-      await api.doAction(user.id, 'action', 1);
-    } catch (error) {
-      console.error('Action error:', error);
+  // Действия копятся и уходят на сервер пачкой; суммы дробятся под пределы сервера
+  const flushActions = useCallback(async () => {
+    actionTimerRef.current = null;
+    const events: { actionType: string; value: number }[] = [];
+    for (const [actionType, total] of Object.entries(pendingActionsRef.current)) {
+      for (let left = total; left > 0; left -= ACTION_VALUE_MAX) {
+        events.push({ actionType, value: Math.min(left, ACTION_VALUE_MAX) });
+      }
+    }
+    pendingActionsRef.current = {};
+    for (let i = 0; i < events.length; i += ACTION_BATCH_MAX) {
+      try {
+        const result = await api.doActions(events.slice(i, i + ACTION_BATCH_MAX));
+        if (result.coins) setCoins(result.coins);
+        if (result.completedTasks?.length > 0) {
+          result.completedTasks.forEach((task: { name: string; reward: number }) => {
+            toast({ title: '✅ Задание выполнено!', description: `${task.name} (+${task.reward} монет)` });
+          });
+          loadTasks();
+        }
+      } catch (error) {
+        console.error('Action error:', error);
+      }
+    }
+  }, [toast, loadTasks]);
+
+  const queueAction = (actionType: string, value: number = 1) => {
+    pendingActionsRef.current[actionType] = (pendingActionsRef.current[actionType] || 0) + value;
+    if (actionTimerRef.current === null) {
+      actionTimerRef.current = setTimeout(flushActions, ACTION_FLUSH_DELAY);
     }
   };
 
+  // Несохранённые действия отправляются при уходе со страницы
+  useEffect(() => {
+    return () => {
+      if (actionTimerRef.current !== null) {
+        clearTimeout(actionTimerRef.current);
+        flushActions();
+      }
+    };
+  }, [flushActions]);
+
+  const handleTabChange = (value: string) => {
+    setCurrentTab(value);
+    queueAction('action', 1);
+  };
+
   const handleAdminGiveCoins = async (targetId: number) => {
     try {
-      const result = await api.giveCoins(user.id, targetId, adminAmount);
+      const result = await api.giveCoins(targetId, adminAmount);
       if (result.success) {
         toast({ title: '✅ Успешно', description: result.message });
         setAdminAmount(0);
@@ -316,6 +426,7 @@ export default function Index({ user, onLogout }: IndexProps) {
                       <div className="flex items-center gap-2 mb-1">
                         <span className={`font-bold ${msg.isAdmin ? 'text-red-400' : 'text-purple-400'}`}>{msg.username}</span>
                         {msg.isAdmin && <Badge className="bg-red-500/20 text-red-400">ADMIN</Badge>}
+                        {msg.title && <Badge className="bg-purple-500/20 text-purple-300">{msg.title}</Badge>}
                       </div>
                       <p className="text-gray-300">{msg.message}</p>
                     </div>
@@ -0,0 +1,33 @@
+"""Модули функций для тестов через общий загрузчик bench/functions.py и вызов handler()"""
+import importlib.util
+import json
+import os
+import secrets
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'bench'))
+from functions import load_function  # noqa: E402
+
+# Токены подписываются тем же секретом, которым их проверяют функции
+os.environ.setdefault('SESSION_SECRET', secrets.token_hex(16))
+
+# Функции импортируют psycopg2 на уровне модуля; без него проверяются только чистые модули
+HAS_PSYCOPG2 = importlib.util.find_spec('psycopg2') is not None
+HAS_DATABASE = HAS_PSYCOPG2 and bool(os.environ.get('DATABASE_URL'))
+
+
+def load(function: str, module: str = 'index'):
+    """Модуль функции вместе с её собственными одноимёнными модулями"""
+    return load_function(function, module)[0]
+
+
+def call(function, method: str, path: str, token: str, body: dict = None, query: dict = None) -> tuple:
+    """Вызов handler() функции от имени токена: (статус, разобранное тело)"""
+    response = function.handler({
+        'httpMethod': method,
+        'path': path,
+        'headers': {'Authorization': f'Bearer {token}'},
+        'body': json.dumps(body or {}),
+        'queryStringParameters': query or {}
+    }, None)
+    return response['statusCode'], json.loads(response['body'] or 'null')
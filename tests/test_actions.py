@@ -0,0 +1,48 @@
+"""Пачки событий /action"""
+import unittest
+
+from support import HAS_PSYCOPG2, load
+
+
+@unittest.skipUnless(HAS_PSYCOPG2, 'нужен psycopg2')
+class AggregateActionsTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.game = load('game')
+
+    def test_sums_by_type(self):
+        self.assertEqual(self.game.aggregate_actions([
+            {'actionType': 'action', 'value': 2},
+            {'actionType': 'social'},
+            {'actionType': 'action', 'value': 3}
+        ]), {'action': 5, 'social': 1})
+        self.assertEqual(self.game.aggregate_actions([]), {})
+
+    def test_split_sums_are_kept_whole(self):
+        # Клиент дробит 25 переключений вкладок на события 10 + 10 + 5
+        cap = self.game.ACTION_VALUE_MAX
+        events = [{'actionType': 'action', 'value': cap}] * 2 + [{'actionType': 'action', 'value': 5}]
+        self.assertEqual(self.game.aggregate_actions(events), {'action': 2 * cap + 5})
+        full = [{'actionType': 'secret', 'value': cap}] * self.game.ACTION_BATCH_MAX
+        self.assertEqual(self.game.aggregate_actions(full), {'secret': cap * self.game.ACTION_BATCH_MAX})
+
+    def test_rejects_malformed_batches(self):
+        cap = self.game.ACTION_VALUE_MAX
+        for events in (
+            None,
+            {'actionType': 'action'},
+            ['action'],
+            [{'actionType': 'coins', 'value': 1}],
+            [{'actionType': 'action', 'value': 0}],
+            [{'actionType': 'action', 'value': cap + 1}],
+            [{'actionType': 'action', 'value': True}],
+            [{'actionType': 'action', 'value': 1.5}],
+            [{'actionType': 'action'}] * (self.game.ACTION_BATCH_MAX + 1)
+        ):
+            with self.subTest(events=events):
+                self.assertIsNone(self.game.aggregate_actions(events))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,139 @@
+"""Допуск запросов на запись: предел параллельности и пользовательские корзины"""
+import os
+import unittest
+from unittest import mock
+
+from support import HAS_PSYCOPG2, load
+
+
+class Clock:
+    """Подменяемое время модуля admission"""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self) -> float:
+        return self.now
+
+
+class SharedBucketCursor:
+    """Общая корзина rate_limits: остаток за вычетом потраченного экземплярами"""
+
+    def __init__(self, tokens: float):
+        self.tokens = tokens
+        self.syncs = 0
+
+    def execute(self, sql: str, params: dict):
+        self.tokens = min(params['burst'], self.tokens) - params['spent']
+        self.syncs += 1
+
+    def fetchone(self):
+        return {'tokens': self.tokens}
+
+
+@unittest.skipUnless(HAS_PSYCOPG2, 'нужен psycopg2')
+class AdmissionTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.admission = load('game', 'admission')
+
+    def setUp(self):
+        self.admission._buckets.clear()
+
+    def test_burst_then_limited(self):
+        rate, burst = self.admission.BUCKETS['action']
+        cur = SharedBucketCursor(burst)
+        allowed = [self.admission.allow(cur, 1, 'action') for _ in range(burst + 1)]
+        self.assertEqual(allowed, [True] * burst + [False])
+        # Внутри окна решает локальная корзина, БД не трогается
+        self.assertEqual(cur.syncs, 0)
+
+    def test_buckets_are_per_user_and_type(self):
+        _, burst = self.admission.BUCKETS['chat']
+        cur = SharedBucketCursor(burst)
+        for _ in range(burst):
+            self.admission.allow(cur, 1, 'chat')
+        self.assertFalse(self.admission.allow(cur, 1, 'chat'))
+        self.assertTrue(self.admission.allow(SharedBucketCursor(burst), 2, 'chat'))
+        self.assertTrue(self.admission.allow(SharedBucketCursor(10), 1, 'action'))
+
+    def test_shared_bucket_spent_elsewhere(self):
+        # Другие экземпляры уже выбрали общую корзину: всплеск сверяется с ней и получает отказ
+        _, burst = self.admission.BUCKETS['purchase']
+        clock = Clock()
+        cur = SharedBucketCursor(0)
+        with mock.patch.object(self.admission, 'time', clock), \
+                mock.patch.object(self.admission, 'ADMISSION_SYNC_INTERVAL', 1):
+            self.assertTrue(all(self.admission.allow(cur, 3, 'purchase') for _ in range(burst)))
+            clock.now += 1
+            self.assertFalse(self.admission.allow(cur, 3, 'purchase'))
+        self.assertEqual(cur.syncs, 1)
+
+    def test_steady_heartbeats_do_not_write(self):
+        clock = Clock()
+        cur = SharedBucketCursor(0)
+        with mock.patch.object(self.admission, 'time', clock):
+            for _ in range(30):
+                self.assertTrue(self.admission.allow(cur, 5, 'heartbeat'))
+                clock.now += 60
+        self.assertEqual(cur.syncs, 0)
+
+    def test_throttled_user_syncs_once_per_window(self):
+        rate, burst = self.admission.BUCKETS['chat']
+        clock = Clock()
+        cur = SharedBucketCursor(burst)
+        with mock.patch.object(self.admission, 'time', clock):
+            for _ in range(1000):
+                self.admission.allow(cur, 6, 'chat')
+                clock.now += self.admission.ADMISSION_SYNC_INTERVAL / 100
+        self.assertLessEqual(cur.syncs, 10)
+
+    def test_rate_limits_can_be_disabled(self):
+        with mock.patch.dict(os.environ, {'ADMISSION_RATE_LIMITS': '0'}):
+            cur = SharedBucketCursor(0)
+            self.assertTrue(all(self.admission.allow(cur, 4, 'purchase') for _ in range(100)))
+            self.assertEqual(cur.syncs, 0)
+
+
+@unittest.skipUnless(HAS_PSYCOPG2, 'нужен psycopg2')
+class ConcurrencyTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.admission = load('game', 'admission')
+
+    def setUp(self):
+        self.saved = self.admission.pool.max_size
+
+    def tearDown(self):
+        self.admission.pool.max_size = self.saved
+
+    def test_limit_follows_pool_resized_after_import(self):
+        self.admission.pool.max_size = 16
+        with mock.patch.dict(os.environ):
+            os.environ.pop('ADMISSION_MAX_CONCURRENT', None)
+            self.assertEqual(self.admission.max_concurrent(), 16)
+        with mock.patch.dict(os.environ, {'ADMISSION_MAX_CONCURRENT': '4'}):
+            self.assertEqual(self.admission.max_concurrent(), 4)
+        with mock.patch.dict(os.environ, {'ADMISSION_MAX_CONCURRENT': '100'}):
+            self.assertEqual(self.admission.max_concurrent(), 16)
+
+    def test_writes_over_limit_are_shed(self):
+        self.admission.pool.max_size = 1
+        post = {'httpMethod': 'POST'}
+
+        @self.admission.limit_writes
+        def handler(event, context):
+            # Вложенный вызов идёт, пока внешний занимает единственное место
+            return {'statusCode': 200, 'inner': context and handler(post, None)['statusCode']}
+
+        with mock.patch.dict(os.environ):
+            os.environ.pop('ADMISSION_MAX_CONCURRENT', None)
+            self.assertEqual(handler(post, True), {'statusCode': 200, 'inner': 429})
+            self.assertEqual(handler(post, None)['statusCode'], 200)
+            self.assertEqual(handler({'httpMethod': 'GET'}, True)['inner'], 200)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,89 @@
+"""Окно последних сообщений чата в памяти"""
+import unittest
+from datetime import datetime
+
+from support import load
+
+chat_cache = load('chat', 'chat_cache')
+
+
+class Connection:
+    """Подключение для учёта подготовленных операторов queries.py"""
+
+
+class MessagesCursor:
+    """Кортежный курсор над списком сообщений: MAX(id) и операторы messages_*"""
+
+    def __init__(self, ids: list):
+        self.connection = Connection()
+        self.rows = [(i, 1, 'Гость1', f'Сообщение {i}', datetime(2026, 1, 1), False, None) for i in ids]
+        self.result = []
+        self.executed = []
+
+    def execute(self, sql: str, params=()):
+        self.executed.append(sql.split('(')[0].strip())
+        if 'MAX(id)' in sql:
+            self.result = [(max((r[0] for r in self.rows), default=0),)]
+        elif sql.startswith('EXECUTE messages_after'):
+            after_id, limit = params
+            self.result = [r for r in self.rows if r[0] > after_id][:limit]
+        elif sql.startswith('EXECUTE messages_latest'):
+            self.result = sorted(self.rows, reverse=True)[:params[0]]
+
+    def fetchone(self):
+        return self.result[0]
+
+    def fetchall(self):
+        return self.result
+
+
+class MessageWindowTest(unittest.TestCase):
+
+    def window(self, size: int = 5):
+        return chat_cache.MessageWindow(size, 60, 60, chat_cache.encode_messages)
+
+    @staticmethod
+    def ids(items) -> list:
+        return None if items is None else [message_id for message_id, _ in items]
+
+    def test_cold_window_misses(self):
+        self.assertIsNone(self.window().read(None, 5))
+
+    def test_short_history_is_complete(self):
+        window = self.window()
+        window.refresh(MessagesCursor([1, 2, 3]))
+        self.assertEqual(self.ids(window.read(None, 50)), [1, 2, 3])
+        self.assertEqual(self.ids(window.read(0, 50)), [1, 2, 3])
+        self.assertEqual(self.ids(window.read(2, 50)), [3])
+
+    def test_older_than_floor_goes_to_db(self):
+        window = self.window()
+        window.refresh(MessagesCursor(list(range(1, 11))))
+        self.assertEqual(self.ids(window.read(None, 5)), [6, 7, 8, 9, 10])
+        self.assertIsNone(window.read(None, 6))
+        self.assertEqual(self.ids(window.read(5, 2)), [6, 7])
+        self.assertIsNone(window.read(4, 50))
+
+    def test_refresh_appends_and_evicts(self):
+        window = self.window()
+        cur = MessagesCursor(list(range(1, 6)))
+        window.refresh(cur)
+        cur.rows += MessagesCursor([6, 7]).rows
+        window.refresh(cur, force=True)
+        self.assertEqual(self.ids(window.read(None, 5)), [3, 4, 5, 6, 7])
+        self.assertIsNone(window.read(1, 50))
+        self.assertEqual(self.ids(window.read(2, 50)), [3, 4, 5, 6, 7])
+
+    def test_probe_without_new_messages_does_not_reload(self):
+        window = self.window()
+        cur = MessagesCursor([1, 2])
+        window.refresh(cur)
+        cur.executed.clear()
+        window.refresh(cur, force=True)
+        self.assertEqual(cur.executed, ['SELECT COALESCE'])
+        window.refresh(cur)
+        self.assertEqual(cur.executed, ['SELECT COALESCE'])
+
+
+if __name__ == '__main__':
+    unittest.main()
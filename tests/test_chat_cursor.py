@@ -0,0 +1,25 @@
+"""Непрозрачные курсоры страниц чата"""
+import unittest
+
+from support import HAS_PSYCOPG2, load
+
+
+@unittest.skipUnless(HAS_PSYCOPG2, 'нужен psycopg2')
+class CursorTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.chat = load('chat')
+
+    def test_round_trip(self):
+        for message_id in (0, 1, 10 ** 12):
+            self.assertEqual(self.chat.decode_cursor(self.chat.encode_cursor(message_id)), message_id)
+
+    def test_rejects_foreign_and_broken_cursors(self):
+        for cursor in ('not-a-cursor', '', 'YzI6MTA', 'YzE6', 'YzE6LTE', '%%%', 'é'):
+            with self.subTest(cursor=cursor), self.assertRaises(ValueError):
+                self.chat.decode_cursor(cursor)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,98 @@
+"""Успешные сценарии функций с подписанным токеном: вызовы handler() против БД с применёнными миграциями
+
+Запуск:
+
+    DATABASE_URL=postgresql://localhost/chiken python -m unittest discover tests
+
+Тестовые пользователи (test_*) остаются в БД — запускать на тестовой базе.
+"""
+import os
+import secrets
+import unittest
+
+from support import HAS_DATABASE, call, load
+
+
+@unittest.skipUnless(HAS_DATABASE, 'нужны psycopg2 и DATABASE_URL')
+class HandlersTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        import psycopg2
+        cls.game = load('game')
+        cls.chat = load('chat')
+        cls.admin = load('admin')
+        cls.issue_token = staticmethod(load('game', 'session').issue_token)
+        cls.conn = psycopg2.connect(os.environ['DATABASE_URL'])
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.conn.close()
+
+    def create_user(self, is_admin: bool = False) -> tuple:
+        """Новый пользователь и его токен"""
+        username = f'test_{secrets.token_hex(6)}'
+        with self.conn.cursor() as cur:
+            cur.execute(
+                "INSERT INTO users (username, password_hash, coins, is_admin) VALUES (%s, '', 100, %s) RETURNING id",
+                (username, is_admin)
+            )
+            user_id = cur.fetchone()[0]
+        self.conn.commit()
+        return user_id, self.issue_token(user_id, username, False, is_admin)
+
+    def test_game_bootstrap(self):
+        _, token = self.create_user()
+        status, data = call(self.game, 'GET', '/bootstrap', token)
+        self.assertEqual(status, 200)
+        self.assertEqual(data['profile']['coins'], 100)
+        self.assertIsInstance(data['titles'], list)
+        self.assertIsInstance(data['tasks'], list)
+
+    def test_game_actions(self):
+        _, token = self.create_user()
+        status, data = call(self.game, 'POST', '/action', token, {'events': [
+            {'actionType': 'action', 'value': 1},
+            {'actionType': 'social', 'value': 1}
+        ]})
+        self.assertEqual(status, 200)
+        self.assertTrue(data['success'])
+        self.assertGreaterEqual(data['coins'], 100)
+
+    def test_game_heartbeat(self):
+        _, token = self.create_user()
+        status, data = call(self.game, 'POST', '/update-time', token, {'minutes': 1})
+        self.assertEqual(status, 200)
+        self.assertGreaterEqual(data['timeSpent'], 1)
+
+    def test_chat_send_and_read(self):
+        user_id, token = self.create_user()
+        status, data = call(self.chat, 'POST', '/', token, {'message': 'Привет из теста'})
+        self.assertEqual(status, 200)
+        self.assertEqual(data['message']['userId'], user_id)
+
+        status, messages = call(self.chat, 'GET', '/', token, query={'sinceId': str(data['message']['id'] - 1)})
+        self.assertEqual(status, 200)
+        self.assertIn(data['message']['id'], [m['id'] for m in messages])
+
+    def test_admin_give_coins(self):
+        target_id, _ = self.create_user()
+        _, admin_token = self.create_user(is_admin=True)
+        status, data = call(self.admin, 'POST', '/give-coins', admin_token,
+                                 {'targetUserId': target_id, 'amount': 50})
+        self.assertEqual(status, 200)
+        self.assertTrue(data['success'])
+        self.assertGreaterEqual(data['newCoins'], 150)
+
+        status, _ = call(self.admin, 'POST', '/give-coins', admin_token, {'targetUserId': -1, 'amount': 50})
+        self.assertEqual(status, 404)
+
+    def test_admin_stats(self):
+        _, admin_token = self.create_user(is_admin=True)
+        status, data = call(self.admin, 'GET', '/stats', admin_token)
+        self.assertEqual(status, 200)
+        self.assertGreaterEqual(data['totalUsers'], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,88 @@
+"""Движок заданий: пороги по ключам rule_key и завершение заданий на покупку"""
+import json
+import os
+import secrets
+import unittest
+
+from support import HAS_DATABASE, call, load
+
+rules = load('game', 'rules')
+
+
+def task(task_id: int, task_type: str, max_progress: int, title_id=None) -> dict:
+    return {'id': task_id, 'name': f'Задание {task_id}', 'task_type': task_type,
+            'title_id': title_id, 'reward': 10 * task_id, 'max_progress': max_progress}
+
+
+class RulesCrossedTest(unittest.TestCase):
+
+    def setUp(self):
+        self.rules = rules.Rules([
+            task(2, 'coins', 500),
+            task(1, 'coins', 100),
+            task(3, 'coins', 100),
+            task(4, 'special_purchase', 1, title_id=7),
+            task(5, 'special_purchase', 1, title_id=8)
+        ])
+
+    def ids(self, key, old, new) -> list:
+        return [t['id'] for t in self.rules.crossed(key, old, new)]
+
+    def test_threshold_in_half_open_interval(self):
+        self.assertEqual(self.ids('coins', 99, 100), [1, 3])
+        self.assertEqual(self.ids('coins', 100, 499), [])
+        self.assertEqual(self.ids('coins', 100, 500), [2])
+
+    def test_old_none_takes_every_threshold_up_to_new(self):
+        self.assertEqual(self.ids('coins', None, 99), [])
+        self.assertEqual(self.ids('coins', None, 10000), [1, 3, 2])
+
+    def test_decrease_crosses_nothing(self):
+        self.assertEqual(self.ids('coins', 600, 50), [])
+
+    def test_title_tasks_keyed_by_title(self):
+        self.assertEqual(self.ids(('special_purchase', 7), 0, 1), [4])
+        self.assertEqual(self.ids(('special_purchase', 8), 0, 1), [5])
+        self.assertEqual(self.ids('special_purchase', 0, 1), [])
+
+    def test_unknown_key(self):
+        self.assertEqual(self.ids('time', 0, 10 ** 6), [])
+
+    def test_rule_key(self):
+        self.assertEqual(rules.rule_key(task(1, 'coins', 1)), 'coins')
+        self.assertEqual(rules.rule_key(task(4, 'special_purchase', 1, title_id=7)), ('special_purchase', 7))
+
+
+@unittest.skipUnless(HAS_DATABASE, 'нужны psycopg2 и DATABASE_URL')
+class PurchaseTasksTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        import psycopg2
+        cls.auth = load('auth')
+        cls.game = load('game')
+        cls.conn = psycopg2.connect(os.environ['DATABASE_URL'])
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.conn.close()
+
+    def test_first_purchase_completes_task(self):
+        # Регистрация выдаёт стартовый титул [NEWBIE], так что первая покупка — второй титул
+        response = self.auth.handler({'httpMethod': 'POST', 'path': '/', 'headers': {}, 'body': json.dumps({
+            'action': 'register', 'username': f'test_{secrets.token_hex(6)}', 'password': 'test1234'
+        })}, None)
+        registered = json.loads(response['body'])
+        with self.conn.cursor() as cur:
+            cur.execute("UPDATE users SET coins = 100000 WHERE id = %s", (registered['user']['id'],))
+            cur.execute("SELECT id FROM titles WHERE price > 0 ORDER BY price LIMIT 1")
+            title_id = cur.fetchone()[0]
+        self.conn.commit()
+
+        status, data = call(self.game, 'POST', '/buy-title', registered['token'], {'titleId': title_id})
+        self.assertEqual(status, 200)
+        self.assertIn('Купить первый титул', [t['name'] for t in data['completedTasks']])
+
+
+if __name__ == '__main__':
+    unittest.main()